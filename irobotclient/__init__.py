@@ -0,0 +1,26 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""irobotclient - a client for the iRobot HTTP API, usable from the command line or as a library."""
+import logging
+
+from irobotclient.client_handler import IrobotClient
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.download_handler import DownloadResult
+from irobotclient.metrics_handler import FileMetrics
+
+# Messages are only shown by programs that configure logging for them.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
@@ -0,0 +1,364 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""async_handler.py - an asyncio counterpart of the Requester and download engine, for event loop based services."""
+import asyncio
+import errno
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+
+from os import path
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from irobotclient import response_handler
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.download_handler import DownloadResult, DEFAULT_CHUNK_SIZE, progress_log
+from irobotclient.request_formatter import request_headers
+from irobotclient.request_handler import ResponseCodes, OVERLOAD_CODES, REQUEST_LIMIT, BACKOFF_BASE_DELAY, \
+    BACKOFF_MAX_DELAY
+from irobotclient.response_handler import response_headers
+from irobotclient.resume_handler import PART_SUFFIX
+
+# Default maximum number of connections held open to iRobot by an AsyncRequester.
+DEFAULT_CONNECTION_LIMIT = 100
+
+# Default number of files downloaded at the same time by download_many.
+DEFAULT_ASYNC_CONCURRENCY = 100
+
+
+async def _raise_error_response(response, file_path: str):
+    # Raise the failure described by an iRobot error response.
+
+    try:
+        raise IrobotClientException(response.status, json.loads(await response.text())['description'])
+    except (ValueError, KeyError, TypeError):
+        raise IrobotClientException(response.status, f"{response.reason}. URL: {file_path}")
+
+
+class AsyncRequester:
+    """
+    The asyncio counterpart of request_handler.Requester, built on aiohttp (install irobotclient[async]).  It has the
+    same semantics: failed connections, 504 and 507 responses are retried with jittered exponential backoff, 202
+    responses are waited on until their iRobot-ETA, and a 401 moves on to the next accepted credential.  Waits are
+    asyncio sleeps, so hundreds of requests can be in flight, or waiting for iRobot, on one event loop.  Unlike the
+    Requester, it has no bandwidth limit (see bandwidth_handler).
+
+    The aiohttp session, and its pool of keep-alive connections, is created on first use inside the event loop and held
+    until the requester is closed.
+
+    Public methods:
+    get_data - handles the requesting of data.
+    close - releases the pooled connections.
+    """
+
+    def __init__(self, headers: dict, requested_url=None, additional_auth_credentials=None,
+                 connection_limit=DEFAULT_CONNECTION_LIMIT, keep_alive=True, authentication_cache=None):
+        """
+        Instantiates a requester with the data required for a request attempt.
+
+        :param headers: a dictionary of the headers for the request.
+        :param requested_url: a string of the iRobot server url not including the file path.
+        :param additional_auth_credentials: a list of additional authentication credentials is available.
+        :param connection_limit: the maximum number of connections open at the same time.
+        :param keep_alive: reuse connections between requests; if False every request closes its connection.
+        :param authentication_cache: an AuthenticationCache that newly negotiated schemes are recorded in.
+        """
+
+        if aiohttp is None:
+            raise ImportError("The asyncio API needs aiohttp; please install irobotclient[async].")
+
+        self._headers = headers
+        self._requested_url = requested_url
+        self._additional_auth_credentials = additional_auth_credentials
+        self._connection_limit = connection_limit
+        self._keep_alive = keep_alive
+        self._host = urlsplit(requested_url).netloc if requested_url else None
+        self._authentication_cache = authentication_cache if self._host else None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _get_session(self):
+        # Create the long-lived session on first use, as aiohttp sessions belong to the running event loop.  Data may
+        # take a long time to arrive, so no overall timeout is set.
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._connection_limit, force_close=not self._keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None))
+
+        return self._session
+
+    async def close(self):
+        """
+        Close the session and every pooled connection it holds.
+        """
+
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def _renegotiate_authentication(self, response, sent_headers: dict) -> bool:
+        # Switch to a credential accepted by iRobot after an authentication failure.  Requests that were rejected with
+        # a credential that has already been replaced retry with the new one.  Nothing here awaits, so no lock is
+        # needed between coroutines.
+
+        current_credential = self._headers.get(request_headers['AUTHORIZATION'])
+
+        if sent_headers.get(request_headers['AUTHORIZATION']) != current_credential:
+            return True
+
+        if not self._additional_auth_credentials:
+            return False
+
+        new_credential = response_handler.update_authentication_header(response, self._additional_auth_credentials)
+        self._headers[request_headers['AUTHORIZATION']] = new_credential
+
+        if new_credential and self._authentication_cache:
+            self._authentication_cache.record(self._host, new_credential.split(' ')[0])
+
+        return True
+
+    async def get_data(self, file_path: str, wait_for_data=True, byte_range=None, etag=None):
+        """
+        Requests the data from iRobot.
+
+        :param file_path: the full path of the file requested.
+        :param wait_for_data: sleep until the ETA of a 202 response and try again; if False a DataNotReadyException is
+        raised with the delay (including the ETA margin) instead.
+        :param byte_range: a tuple of the first and last (inclusive) byte to request, rather than the whole file.  The
+        last byte may be None to request everything from the first byte onwards.
+        :param etag: the ETag of a copy of the data the client already has; iRobot only sends the data if it differs.
+        :return: a successful aiohttp response, whose data has not been read; it must be released by the caller.
+        """
+
+        conditional_headers = {}
+        if byte_range:
+            first_byte, last_byte = byte_range
+            conditional_headers[request_headers['RANGE']] = \
+                f"bytes={first_byte}-{'' if last_byte is None else last_byte}"
+        if etag:
+            conditional_headers[request_headers['IF_NONE_MATCH']] = etag
+
+        if self._requested_url:
+            file_path = self._requested_url + file_path
+
+        for index in range(REQUEST_LIMIT):
+
+            headers = {**self._headers, **conditional_headers}
+            try:
+                response = await self._get_session().get(file_path, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if index == REQUEST_LIMIT - 1:
+                    raise
+                await _back_off(index)
+                continue
+
+            if response.status == ResponseCodes['SUCCESS'] or \
+                    (response.status == ResponseCodes['RANGED_DATA'] and byte_range) or \
+                    (response.status == ResponseCodes['CLIENT_MATCHED'] and etag):
+                return response
+
+            # Read the remainder of the (small) response so that its connection is returned to the pool.
+            await response.read()
+            response.release()
+
+            if response.status == ResponseCodes['FETCHING_DATA']:
+                # Both waiting here and waiting in the caller allow for the margin of the ETA.
+                delay = response_handler.get_request_delay(response) + \
+                    response_handler.get_request_eta_margin(response)
+
+                if not wait_for_data:
+                    raise DataNotReadyException(response.status, f"iRobot is fetching {file_path}.", delay)
+
+                await asyncio.sleep(max(0, delay))
+
+            elif response.status == ResponseCodes['AUTHENTICATION_FAILED'] and \
+                    self._renegotiate_authentication(response, headers):
+                pass
+
+            elif response.status == ResponseCodes['INVALID_RANGE']:
+                raise IrobotClientException(response.status, f"Requested range {byte_range} is not satisfiable. "
+                                                             f"URL: {file_path}")
+
+            elif response.status in OVERLOAD_CODES:
+                await _back_off(index)
+
+            elif 400 <= response.status < 600:
+                await _raise_error_response(response, file_path)
+
+        raise IrobotClientException(errno.ECONNABORTED, "ERROR: Maximum number of request retries.  This could be "
+                                                        "because of a large file being fetch.  Please try again "
+                                                        "later.")
+
+
+async def _back_off(attempt: int):
+    # Wait a random time, up to a limit that doubles with each attempt, before trying an overloaded iRobot again.
+
+    await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX_DELAY, BACKOFF_BASE_DELAY * 2 ** attempt)))
+
+
+async def _read_chunk(content, chunk_size: int) -> bytearray:
+    # Read up to chunk_size bytes, fewer only at the end of the data, so that writes and hash updates are large.
+
+    chunk = bytearray()
+
+    while len(chunk) < chunk_size:
+        data = await content.read(chunk_size - len(chunk))
+        if not data:
+            break
+        chunk += data
+
+    return chunk
+
+
+def _write_and_hash(file, hasher, data: bytearray):
+    # Write a chunk of data and add it to the checksum; run off the event loop, as both block.
+
+    file.write(data)
+    hasher.update(data)
+
+
+def _remove_part_file(part_location: str):
+    # Remove the part file of a download that failed; unlike the synchronous engine's, it cannot be resumed.
+
+    try:
+        os.unlink(part_location)
+    except FileNotFoundError:
+        pass
+
+
+async def download_file(request_handler: AsyncRequester, file_path: str, output_dir: str,
+                        chunk_size=DEFAULT_CHUNK_SIZE, log=None) -> DownloadResult:
+    """
+    Download a single file into the output directory.  The data is written to a part file and moved into place once
+    complete, or removed if the download fails or is cancelled.  Each chunk is written and hashed on the event loop's
+    default executor while the next one is read, so the event loop never blocks on the disk.  Errors are returned in
+    the result rather than raised.
+
+    :param request_handler: the AsyncRequester used to send the request.
+    :param file_path: the full path of the file requested.
+    :param output_dir: the directory (with trailing slash) that the file is saved in.
+    :param chunk_size: the size in bytes of the reads from the response.
+    :param log: the error logger.
+    :return: the DownloadResult of the file.
+    """
+
+    log = log if log else logging.getLogger(__name__)
+    loop = asyncio.get_running_loop()
+    save_location = output_dir + path.basename(file_path)
+    part_location = save_location + PART_SUFFIX
+    part_created = False
+
+    try:
+        response = await request_handler.get_data(file_path)
+
+        try:
+            hasher = hashlib.md5()
+            # Set first, as a cancellation while the executor opens the file would otherwise leave it behind.
+            part_created = True
+            file = await loop.run_in_executor(None, open, part_location, "wb")
+
+            pending_write = None
+
+            try:
+                while True:
+                    data_chunk = await _read_chunk(response.content, chunk_size)
+                    if pending_write:
+                        await pending_write
+                        pending_write = None
+                    if not data_chunk:
+                        break
+                    pending_write = loop.run_in_executor(None, _write_and_hash, file, hasher, data_chunk)
+            finally:
+                # Nothing may still be writing to the file once it is closed.
+                if pending_write:
+                    await asyncio.wait([pending_write])
+                await loop.run_in_executor(None, file.close)
+        finally:
+            response.release()
+
+        await loop.run_in_executor(None, os.replace, part_location, save_location)
+        checksum = hasher.hexdigest()
+    except Exception as err:
+        if part_created:
+            await loop.run_in_executor(None, _remove_part_file, part_location)
+        return DownloadResult(file_path, error=err)
+    except asyncio.CancelledError:
+        # Awaiting the executor again could itself be cancelled; the unlink is quick enough to block for.
+        if part_created:
+            _remove_part_file(part_location)
+        raise
+
+    checksum_matched = checksum == response.headers.get(response_headers['CHECKSUM'])
+
+    if not checksum_matched:
+        progress_log.warning("WARNING: Checksum of response and downloaded file do not match. Data may be corrupt or "
+                             "missing.")
+        log.error(f"The checksum of {save_location} does not match the checksum expected.")
+
+    return DownloadResult(file_path, save_location, checksum, checksum_matched)
+
+
+async def download_many(request_handler: AsyncRequester, file_paths, output_dir: str,
+                        concurrency=DEFAULT_ASYNC_CONCURRENCY, chunk_size=DEFAULT_CHUNK_SIZE, log=None):
+    """
+    Download the files concurrently on the running event loop, yielding each result as soon as its download
+    finishes.  Files are taken from the iterable lazily, so only `concurrency` of them are in progress (or waiting for
+    iRobot to fetch them) at a time.  Closing the generator early, or an error, cancels the downloads in progress and
+    waits for them to release their responses.
+
+    :param request_handler: the AsyncRequester used to send every request.
+    :param file_paths: an iterable of the full paths of the files to be downloaded.
+    :param output_dir: the directory (with trailing slash) that the files are saved in.
+    :param concurrency: the maximum number of files downloaded at the same time.
+    :param chunk_size: the size in bytes of the reads from each response.
+    :param log: the error logger.
+    :return: an asynchronous generator of DownloadResult objects.
+    """
+
+    file_paths = iter(file_paths)
+    pending = set()
+
+    try:
+        while True:
+            for file_path in itertools.islice(file_paths, concurrency - len(pending)):
+                pending.add(asyncio.ensure_future(download_file(request_handler, file_path, output_dir, chunk_size,
+                                                                log)))
+
+            if not pending:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        # Cancelled tasks are only finished once they have handled the cancellation.
+        await asyncio.gather(*pending, return_exceptions=True)
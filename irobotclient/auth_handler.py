@@ -0,0 +1,127 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""auth_handler.py - remember which authentication scheme each iRobot host accepts."""
+import fcntl
+import json
+import os
+import threading
+import time
+
+# Default number of seconds a negotiated authentication scheme is remembered on disk.
+DEFAULT_AUTH_CACHE_TTL = 24 * 60 * 60
+
+# Suffix of the file that is locked while the cache file is updated.
+LOCK_SUFFIX = ".lock"
+
+
+class AuthenticationCache:
+    """
+    The authentication scheme (eg: "Basic" or "Bearer") that each iRobot host was found to accept, so that requests go
+    straight to a working credential instead of having one rejected with a 401 first.  Schemes are kept in memory
+    and, if a cache file is given, in a JSON file that later runs read, each for a limited time.  Only the names of the
+    schemes are stored, never the credentials.
+
+    Public methods:
+    get_scheme - return the scheme a host is known to accept.
+    record - remember the scheme a host accepted.
+    """
+
+    def __init__(self, cache_location=None, ttl=DEFAULT_AUTH_CACHE_TTL):
+        """
+        Instantiate a cache, loading any schemes in the cache file that have not expired.
+
+        :param cache_location: the path of the JSON cache file; if None, schemes are only kept in memory.
+        :param ttl: the number of seconds a recorded scheme is remembered.
+        """
+
+        self._cache_location = cache_location
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # Maps each host to a (scheme, expiry time) tuple.
+        self._schemes = {}
+
+        if cache_location:
+            self._load()
+
+    def _read(self) -> dict:
+        # Read the unexpired schemes from the cache file; a missing or unreadable file is treated as empty.
+
+        try:
+            with open(self._cache_location) as cache_file:
+                schemes = json.load(cache_file)
+
+            return {host: (entry["scheme"], entry["expires"]) for host, entry in schemes.items()
+                    if entry["expires"] > time.time()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    def _load(self):
+        # Load the schemes recorded by earlier runs.
+
+        self._schemes = self._read()
+
+    def _save(self):
+        # Merge the schemes into the cache file, keeping the latest entry of each host.  Other runs may be recording
+        # the schemes of other hosts at the same time, so the file is read again and written while holding a lock on
+        # it, and replaced atomically so that runs loading it never read half a file.
+
+        os.makedirs(os.path.dirname(os.path.abspath(self._cache_location)), exist_ok=True)
+        temp_location = f"{self._cache_location}.{os.getpid()}.tmp"
+
+        with open(self._cache_location + LOCK_SUFFIX, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            for host, (scheme, expires) in self._read().items():
+                if expires > self._schemes.get(host, (None, 0))[1]:
+                    self._schemes[host] = (scheme, expires)
+
+            with open(temp_location, "w") as cache_file:
+                json.dump({host: {"scheme": scheme, "expires": expires}
+                           for host, (scheme, expires) in self._schemes.items()}, cache_file)
+
+            os.replace(temp_location, self._cache_location)
+
+    def get_scheme(self, host: str):
+        """
+        Return the authentication scheme the host is known to accept.
+
+        :param host: the host (and port) of the iRobot server.
+        :return: the name of the scheme, or None if it is not known or has expired.
+        """
+
+        with self._lock:
+            scheme, expires = self._schemes.get(host, (None, 0))
+
+        return scheme if expires > time.time() else None
+
+    def record(self, host: str, scheme: str):
+        """
+        Remember the authentication scheme a host accepted, writing it to the cache file if there is one.
+
+        :param host: the host (and port) of the iRobot server.
+        :param scheme: the name of the scheme.
+        """
+
+        with self._lock:
+            self._schemes[host] = (scheme, time.time() + self._ttl)
+
+            if self._cache_location:
+                try:
+                    self._save()
+                except OSError:
+                    # The scheme is still remembered for this run.
+                    pass
@@ -0,0 +1,218 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""bandwidth_handler.py - shape the bandwidth of downloads with a token bucket shared fairly between files."""
+import threading
+import time
+import weakref
+
+from collections import OrderedDict, deque
+
+import requests
+
+# The most bytes a single read is granted at once; the turns files take at the bandwidth are this size.
+DEFAULT_QUANTUM = 64 * 1024
+
+# The seconds of bandwidth that build up while downloads are idle, and may then be used at once; also the longest a
+# single grant takes at the rate.
+BURST_SECONDS = 0.1
+
+
+class _FilePacer:
+    # Spaces out the reads of one file, across all of its connections, so that together they keep to the file's rate.
+
+    def __init__(self, rate: float):
+        self._rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self, size: int):
+        # Wait until the file may read another size bytes.
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + size / self._rate
+
+        if start > now:
+            time.sleep(start - now)
+
+    def refund(self, size: int):
+        # Give back bytes that were granted but not read.
+
+        with self._lock:
+            self._next -= size / self._rate
+
+
+class _ThrottledStream:
+    # The raw stream of a response, every read of which is granted its bytes by a BandwidthLimiter first.  Anything
+    # else is passed through to the stream.
+
+    def __init__(self, raw, limiter, file_path: str, pacer):
+        self._raw = raw
+        self._limiter = limiter
+        self._file_path = file_path
+        self._pacer = pacer
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def readinto(self, buffer) -> int:
+        size = self._limiter._acquire(self._file_path, self._pacer, len(buffer))
+        length = self._raw.readinto(memoryview(buffer)[:size])
+        self._limiter._refund(self._pacer, size - (length or 0))
+
+        return length
+
+    def read(self, amt=None, **kwargs) -> bytes:
+        if amt is None:
+            return b"".join(iter(lambda: self.read(DEFAULT_QUANTUM, **kwargs), b""))
+
+        size = self._limiter._acquire(self._file_path, self._pacer, amt)
+        data = self._raw.read(size, **kwargs)
+        self._limiter._refund(self._pacer, size - len(data))
+
+        return data
+
+    def stream(self, amt=DEFAULT_QUANTUM, decode_content=None):
+        # A read of a non-empty amount only comes back empty at the end of the data.
+
+        while True:
+            data = self.read(amt, decode_content=decode_content)
+            if not data:
+                return
+            yield data
+
+
+class BandwidthLimiter:
+    """
+    A limit on the bandwidth the data of downloads is read at, applied to every read of every response it throttles.
+
+    The overall rate is a token bucket: bytes become available at the rate, up to a burst of BURST_SECONDS of it, and
+    each read takes up to a quantum of them before it reads, waiting if there are too few.  Reads waiting for the bucket
+    take turns by file rather than by connection, so every file being downloaded gets an equal share of the bandwidth
+    however many byte ranges of it are in flight, and a small index file is never left behind a large CRAM.
+
+    Each file may also be capped at a rate of its own, shared by all of its connections.  A limiter may be shared
+    between threads, and between the clients of a daemon, bounding their downloads together.
+
+    Public methods:
+    throttle - limit the bandwidth of a response's data.
+    """
+
+    def __init__(self, rate=None, file_rate=None, quantum=DEFAULT_QUANTUM):
+        """
+        Instantiate a limiter with a full bucket.
+
+        :param rate: the most bytes per second read by all the throttled responses together; None for no overall limit.
+        :param file_rate: the most bytes per second read for any one file; None for no limit per file.
+        :param quantum: the most bytes granted to a single read; it is reduced so that no grant takes longer than
+        BURST_SECONDS at either rate.
+        """
+
+        self.rate = rate
+        self.file_rate = file_rate
+        self._quantum = max(1, int(min([quantum] + [limit * BURST_SECONDS for limit in (rate, file_rate) if limit])))
+        self._capacity = max(self._quantum, rate * BURST_SECONDS) if rate else 0
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        # Maps each file with reads waiting for the bucket to their tickets, in the order the files take their turns.
+        self._waiting = OrderedDict()
+        # The pacer of each file being downloaded, kept only while one of its responses holds it.
+        self._pacers = weakref.WeakValueDictionary()
+        self._pacers_lock = threading.Lock()
+
+    def throttle(self, response: requests.Response, file_path: str) -> requests.Response:
+        """
+        Limit the bandwidth the data of a response is read at, however it is read.
+
+        :param response: a streamed response whose data has not been read.
+        :param file_path: the path of the file the data is of; the responses of the same file share its turns and its
+        rate.
+        :return: the response, whose raw stream is now throttled.
+        """
+
+        pacer = None
+        if self.file_rate:
+            with self._pacers_lock:
+                pacer = self._pacers.get(file_path)
+                if pacer is None:
+                    pacer = self._pacers[file_path] = _FilePacer(self.file_rate)
+
+        response.raw = _ThrottledStream(response.raw, self, file_path, pacer)
+
+        return response
+
+    def _acquire(self, file_path: str, pacer, size: int) -> int:
+        # Wait until a read of the file may go ahead, returning the number of bytes it may read: up to a quantum.  A
+        # file's own rate is waited for first, so that a capped file does not hold up the turns of the others.
+
+        size = min(size, self._quantum)
+
+        if pacer:
+            pacer.wait(size)
+        if self.rate:
+            self._take(file_path, size)
+
+        return size
+
+    def _refill(self):
+        # Add the tokens that have become available since the last refill, up to the capacity of the bucket.
+
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, file_path: str, size: int):
+        # Take size tokens from the bucket once it is the file's turn, and then this read's turn within the file, and
+        # there are enough of them.  The file then goes to the back of the queue, so the next read granted is another
+        # file's if any is waiting.
+
+        ticket = object()
+
+        with self._condition:
+            self._waiting.setdefault(file_path, deque()).append(ticket)
+
+            try:
+                while True:
+                    if next(iter(self._waiting.values()))[0] is ticket:
+                        self._refill()
+                        if self._tokens >= size:
+                            self._tokens -= size
+                            return
+                        self._condition.wait((size - self._tokens) / self.rate)
+                    else:
+                        self._condition.wait()
+            finally:
+                tickets = self._waiting.pop(file_path)
+                tickets.remove(ticket)
+                if tickets:
+                    self._waiting[file_path] = tickets
+                self._condition.notify_all()
+
+    def _refund(self, pacer, size: int):
+        # Give back bytes that were granted to a read but not read, at the end of the data.
+
+        if not size:
+            return
+
+        if pacer:
+            pacer.refund(size)
+        if self.rate:
+            with self._condition:
+                self._tokens = min(self._capacity, self._tokens + size)
+                self._condition.notify_all()
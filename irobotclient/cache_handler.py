@@ -0,0 +1,261 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""cache_handler.py - a content-addressed cache of downloaded files that can be shared by every run on a node."""
+import fcntl
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# Default upper limit (in bytes) on the total size of the files kept in the cache.
+DEFAULT_CACHE_SIZE = 100 * 1024 * 1024 * 1024
+
+# Name of the cache's database and of the directory holding the cached files.
+CACHE_INDEX_NAME = "cache.sqlite"
+CACHE_OBJECTS_DIR = "objects"
+
+# How long (in seconds) to wait for another process that is updating the cache's database.
+CACHE_LOCK_TIMEOUT = 60
+
+# The Linux ioctl that makes one file share the data blocks of another (a reflink), where the file system supports it.
+FICLONE = 0x40049409
+
+
+def _reflink(source: str, destination: str):
+    # Clone the source file into a new destination file without copying its data.  Raises OSError if the file system
+    # cannot do this.
+
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            os.unlink(destination)
+            raise
+
+
+def _copy(source: str, destination: str):
+    # Copy the data of the source file into a new destination file, in the kernel where that is possible.
+
+    copy_file_range = getattr(os, "copy_file_range", None)
+
+    if copy_file_range is not None:
+        try:
+            with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+                while copy_file_range(source_file.fileno(), destination_file.fileno(), 1024 * 1024 * 1024):
+                    pass
+            return
+        except OSError:
+            # The kernel cannot copy between these file systems (EXDEV, EOPNOTSUPP) or at all (ENOSYS); the data is
+            # copied through user space instead, replacing anything already copied.
+            pass
+
+    shutil.copyfile(source, destination)
+
+
+def reflink_or_copy(source: str, destination: str):
+    """
+    Make the destination a copy of the source file as cheaply as the file system allows: by a reflink, which shares
+    the data until either file is changed, and failing that by copying the data.  The copy is never a hard link, so
+    changing either file in place leaves the other as it was.  The destination is replaced atomically if it exists.
+
+    :param source: the path of the file to be copied.
+    :param destination: the path of the copy.
+    """
+
+    temp_location = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        try:
+            _reflink(source, temp_location)
+        except OSError:
+            _copy(source, temp_location)
+
+        os.replace(temp_location, destination)
+    except BaseException:
+        if os.path.exists(temp_location):
+            os.unlink(temp_location)
+        raise
+
+
+def _is_cacheable(etag) -> bool:
+    # ETags are used as file names in the cache, so anything other than a plain hex digest is not cached.
+
+    return bool(etag) and etag.isalnum()
+
+
+class DownloadCache:
+    """
+    A directory of downloaded files named by their iRobot ETag (the MD5 of their data), with an SQLite database
+    recording the size and last use of each and the ETag each iRobot path last had.  It is meant to be shared by every
+    run of the client on a node, so that a file wanted by several of them is only fetched from iRobot once.
+
+    A file whose path has been downloaded before is requested conditionally on the cached ETag; if iRobot answers 304
+    the cached copy is put in the output directory instead.  Copies are made by reflink or copy (see
+    reflink_or_copy), never by hard link, so an output file changed in place does not change the cached file.
+
+    When the files in the cache exceed its size limit, the least recently used are removed.
+
+    Public methods:
+    get_etag - return the ETag last seen for an iRobot path, if its data is still cached.
+    materialize - put a copy of cached data at a location.
+    add - add a downloaded file to the cache.
+    close - close the cache's database.
+    """
+
+    def __init__(self, cache_dir: str, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Open (creating if necessary) the cache directory.
+
+        :param cache_dir: the path of the cache directory.
+        :param max_size: the upper limit in bytes on the total size of the cached files.
+        """
+
+        self._objects_dir = os.path.join(cache_dir, CACHE_OBJECTS_DIR)
+        self._max_size = max_size
+
+        os.makedirs(self._objects_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(cache_dir, CACHE_INDEX_NAME), timeout=CACHE_LOCK_TIMEOUT,
+                                           check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS objects ("
+                                     "etag TEXT PRIMARY KEY, "
+                                     "size INTEGER NOT NULL, "
+                                     "last_used REAL NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS paths ("
+                                     "path TEXT PRIMARY KEY, "
+                                     "etag TEXT NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _object_location(self, etag: str) -> str:
+        # Cached files are spread over subdirectories by the first characters of their ETag.  Only plain MD5-like ETags
+        # (see _is_cacheable) are used as file names.
+
+        return os.path.join(self._objects_dir, etag[:2], etag)
+
+    def get_etag(self, file_path: str):
+        """
+        Return the ETag the iRobot path had when it was last added to the cache, if that data is still cached.
+
+        :param file_path: the path of the file as it is requested from iRobot.
+        :return: the ETag, or None.
+        """
+
+        with self._lock:
+            entry = self._connection.execute("SELECT paths.etag FROM paths JOIN objects ON paths.etag = objects.etag "
+                                             "WHERE paths.path = ?", (file_path,)).fetchone()
+
+        return entry[0] if entry else None
+
+    def materialize(self, etag: str, destination: str) -> bool:
+        """
+        Put a copy of the cached data with an ETag at the destination, and mark it as recently used.
+
+        :param etag: the ETag of the data.
+        :param destination: where the copy is to be made.
+        :return: False if the data is not (or is no longer) in the cache, in which case it has to be downloaded.
+        """
+
+        if not _is_cacheable(etag):
+            return False
+
+        with self._lock:
+            entry = self._connection.execute("SELECT size FROM objects WHERE etag = ?", (etag,)).fetchone()
+
+        object_location = self._object_location(etag)
+
+        try:
+            if not entry or os.path.getsize(object_location) != entry[0]:
+                return False
+
+            reflink_or_copy(object_location, destination)
+        except FileNotFoundError:
+            # Evicted by another run since the database was read.
+            return False
+
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE objects SET last_used = ? WHERE etag = ?", (time.time(), etag))
+
+        return True
+
+    def add(self, file_path: str, etag: str, save_location: str):
+        """
+        Add a downloaded (and validated) file to the cache, and remove the least recently used files if the cache is
+        then over its size limit.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        :param etag: the ETag iRobot gave the file.
+        :param save_location: where the file was downloaded to.
+        """
+
+        if not _is_cacheable(etag):
+            return
+
+        object_location = self._object_location(etag)
+        size = os.path.getsize(save_location)
+
+        if not os.path.exists(object_location):
+            os.makedirs(os.path.dirname(object_location), exist_ok=True)
+            reflink_or_copy(save_location, object_location)
+
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO objects (etag, size, last_used) VALUES (?, ?, ?)",
+                                     (etag, size, time.time()))
+            self._connection.execute("INSERT OR REPLACE INTO paths (path, etag) VALUES (?, ?)", (file_path, etag))
+
+        self._evict()
+
+    def _evict(self):
+        # Remove the least recently used files until the cache is within its size limit.  The file that was just added
+        # is removed as well if on its own it is larger than the limit.
+
+        with self._lock, self._connection:
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total_size <= self._max_size:
+                return
+
+            evicted = []
+            for etag, size in self._connection.execute("SELECT etag, size FROM objects ORDER BY last_used").fetchall():
+                if total_size <= self._max_size:
+                    break
+                evicted.append(etag)
+                total_size -= size
+
+            self._connection.executemany("DELETE FROM objects WHERE etag = ?", ((etag,) for etag in evicted))
+            self._connection.execute("DELETE FROM paths WHERE etag NOT IN (SELECT etag FROM objects)")
+
+        for etag in evicted:
+            try:
+                os.unlink(self._object_location(etag))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """
+        Close the cache's database.
+        """
+
+        with self._lock:
+            self._connection.close()
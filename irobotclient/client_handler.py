@@ -0,0 +1,315 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""client_handler.py - a programmatic interface to the client, for Python programs that download from iRobot."""
+import errno
+import logging
+import threading
+
+from concurrent.futures import Future
+
+from irobotclient import request_formatter
+from irobotclient.auth_handler import AuthenticationCache, DEFAULT_AUTH_CACHE_TTL
+from irobotclient.bandwidth_handler import BandwidthLimiter
+from irobotclient.cache_handler import DownloadCache, DEFAULT_CACHE_SIZE
+from irobotclient.concurrency_handler import ConcurrencyLimiter
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.download_handler import DownloadEngine, DownloadResult, DEFAULT_CHUNK_SIZE, DEFAULT_JOBS, \
+    prefetch_files, stream_file
+from irobotclient.index_handler import ChecksumIndex, INDEX_FILE_NAME
+from irobotclient.lock_handler import get_default_lock_dir
+from irobotclient.metrics_handler import MetricsRecorder
+from irobotclient.preflight_handler import preflight_files
+from irobotclient.request_handler import Requester, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+from irobotclient.segment_handler import DEFAULT_SEGMENT_SIZE, DEFAULT_MEMORY_BUDGET
+
+
+def _get_error(result: DownloadResult):
+    # The exception a download result stands for, if it is a failure: its error, or a checksum mismatch.
+
+    if result.error is not None:
+        return result.error
+
+    if not (result.checksum_matched or result.skipped):
+        return IrobotClientException(errno.EIO, f"ERROR: The checksum of {result.save_location or result.file_path} "
+                                                f"does not match the checksum expected.  It may be corrupt or missing "
+                                                f"data.")
+
+    return None
+
+
+class IrobotClient:
+    """
+    Downloads files from iRobot for a Python program, without starting a process per file.  Every call shares the
+    client's connection pool, negotiated authentication, concurrency limit, bandwidth limit, checksum index, download
+    cache and metrics, so they are set up once however many files are downloaded.
+
+    Every DownloadResult carries the FileMetrics of its file, so the time spent waiting for iRobot, the time to first
+    byte and the throughput of each download are known without writing any metrics files.
+
+    Public methods:
+    download - download a single file and return its result.
+    download_many - start downloading files in the background and return a future of each result.
+    iter_download - download files and yield each result as it completes, failures included.
+    prefetch - ask iRobot to stage files into its precache.
+    preflight - plan the download of files from their metadata.
+    stream - pass the data of a file through to a stream.
+    close - wait for background downloads and release every shared resource.
+    """
+
+    def __init__(self, url: str, output_dir: str, arvados_token=None, basic_username=None, basic_password=None,
+                 jobs=DEFAULT_JOBS, max_jobs=None, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, keep_alive=True, segments=1, segment_size=DEFAULT_SEGMENT_SIZE,
+                 memory_budget=DEFAULT_MEMORY_BUDGET, chunk_size=DEFAULT_CHUNK_SIZE, skip_unchanged=False,
+                 index_file=None, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, coalesce=True, auth_cache=None,
+                 auth_cache_ttl=DEFAULT_AUTH_CACHE_TTL, metrics=None, metrics_textfile=None, max_bandwidth=None,
+                 max_file_bandwidth=None, log=None, session=None, limiter=None, authentication_cache=None,
+                 bandwidth=None):
+        """
+        Instantiate a client; the options are those of the command line interface.
+
+        :param url: the iRobot server url, with a trailing slash; if None, file paths must be full URLs.
+        :param output_dir: the directory (with trailing slash) that files are saved in.
+        :param arvados_token: the Arvados authentication token.
+        :param basic_username: the Basic authentication username.
+        :param basic_password: the Basic authentication password.
+        :param jobs: the number of files downloaded at the same time to begin with.
+        :param max_jobs: the number of files the downloads at the same time can grow to while iRobot keeps up.
+        :param pool_connections: the number of hosts connections are pooled for.
+        :param pool_maxsize: the maximum number of connections kept open to each host.
+        :param keep_alive: reuse connections between requests.
+        :param segments: the maximum number of byte ranges of one file downloaded at the same time.
+        :param segment_size: the size in bytes of each byte range.
+        :param memory_budget: the upper limit in bytes on the read buffers of all the byte ranges in flight.
+        :param chunk_size: the size in bytes of the buffer each download reads into.
+        :param skip_unchanged: do not download files again whose copy in the output directory iRobot confirms is
+        unchanged.
+        :param index_file: the location of the checksum index; defaults to a file in the output directory.
+        :param cache_dir: the directory of a download cache shared with other runs on the node.
+        :param cache_size: the size in bytes the download cache is kept within.
+        :param coalesce: download a file only once when several processes on the host ask for it at the same time.
+        :param auth_cache: the location of the file the negotiated authentication scheme of each host is kept in.
+        :param auth_cache_ttl: the number of seconds a negotiated scheme is kept for.
+        :param metrics: the location of the file the metrics of every file are appended to as JSON lines.
+        :param metrics_textfile: the location of the Prometheus textfile the totals are written to when closed.
+        :param max_bandwidth: the most bytes per second read by all the downloads together.  Only the downloads of
+        this client (and the clients it shares its BandwidthLimiter with) are limited; the asyncio API
+        (async_handler) has no bandwidth limit.
+        :param max_file_bandwidth: the most bytes per second read for any one file.
+        :param log: the error logger.
+        :param session: a requests session, shared with other clients, whose connections are reused rather than
+        opening a pool for this client; the pool options are then ignored.
+        :param limiter: a ConcurrencyLimiter shared with other clients, bounding their downloads together; the jobs
+        options are then ignored.
+        :param authentication_cache: an AuthenticationCache shared with other clients, so that a scheme negotiated by
+        one is used by the others; the authentication cache options are then ignored.
+        :param bandwidth: a BandwidthLimiter shared with other clients, bounding their bandwidth together; the
+        bandwidth options are then ignored.
+        """
+
+        authentication_credentials = request_formatter.get_authentication_strings(arvados_token, basic_username,
+                                                                                  basic_password)
+        if not authentication_credentials:
+            raise IrobotClientException(errno.EACCES, "No Arvados or Basic authentication set.")
+
+        self._output_dir = output_dir
+        self._jobs = jobs
+        self._segments = segments
+        self._segment_size = segment_size
+        self._memory_budget = memory_budget
+        self._chunk_size = chunk_size
+        self._log = log if log else logging.getLogger(__name__)
+        self._lock_dir = get_default_lock_dir(cache_dir) if coalesce else None
+        self._limiter = limiter if limiter else ConcurrencyLimiter(jobs, max_jobs)
+        if not bandwidth and (max_bandwidth or max_file_bandwidth):
+            bandwidth = BandwidthLimiter(max_bandwidth, max_file_bandwidth)
+        self._metrics = MetricsRecorder(metrics, metrics_textfile)
+        self._checksum_index = None
+        self._cache = None
+        self._threads = set()
+        self._threads_lock = threading.Lock()
+
+        try:
+            if skip_unchanged:
+                self._checksum_index = ChecksumIndex(index_file or output_dir + INDEX_FILE_NAME)
+            if cache_dir:
+                self._cache = DownloadCache(cache_dir, cache_size)
+
+            self._request_handler = Requester(request_formatter.get_headers(authentication_credentials.pop(0)), url,
+                                              authentication_credentials,
+                                              pool_connections=pool_connections,
+                                              pool_maxsize=pool_maxsize,
+                                              keep_alive=keep_alive,
+                                              limiter=self._limiter,
+                                              authentication_cache=authentication_cache or
+                                              AuthenticationCache(auth_cache, auth_cache_ttl),
+                                              metrics=self._metrics,
+                                              session=session,
+                                              bandwidth=bandwidth)
+        except Exception:
+            self._close_stores()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def iter_download(self, file_paths, skip_existing=False):
+        """
+        Download the files concurrently, yielding each result as soon as its download finishes.  Errors and checksum
+        mismatches are reported in the results rather than raised.
+
+        :param file_paths: an iterable of the full paths of the files to be downloaded; it is read lazily.
+        :param skip_existing: do not request files whose name already exists in the output directory.
+        :return: a generator of DownloadResult objects.
+        """
+
+        download_engine = DownloadEngine(self._request_handler, self._output_dir, self._limiter.maximum_limit,
+                                         self._log, skip_existing,
+                                         segments=self._segments,
+                                         segment_size=self._segment_size,
+                                         memory_budget=self._memory_budget,
+                                         chunk_size=self._chunk_size,
+                                         checksum_index=self._checksum_index,
+                                         cache=self._cache,
+                                         lock_dir=self._lock_dir,
+                                         limiter=self._limiter,
+                                         metrics=self._metrics)
+
+        yield from download_engine.download(file_paths)
+
+    def download(self, file_path: str) -> DownloadResult:
+        """
+        Download a single file, waiting for iRobot if it is still fetching it.
+
+        :param file_path: the full path of the file to be downloaded.
+        :return: the DownloadResult of the file.
+        :raises IrobotClientException: if the file could not be downloaded, or its checksum does not match.
+        """
+
+        result, = self.iter_download([file_path])
+
+        error = _get_error(result)
+        if error:
+            raise error
+
+        return result
+
+    def _settle(self, futures: dict):
+        # Download the files of a download_many call, settling the future of each with its result as it completes.
+        # Files whose future was cancelled before its download started are left out.
+
+        file_paths = (file_path for file_path, future in futures.items() if future.set_running_or_notify_cancel())
+
+        try:
+            for result in self.iter_download(file_paths):
+                error = _get_error(result)
+                if error:
+                    futures[result.file_path].set_exception(error)
+                else:
+                    futures[result.file_path].set_result(result)
+        except Exception as err:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(err)
+        finally:
+            with self._threads_lock:
+                self._threads.discard(threading.current_thread())
+
+    def download_many(self, file_paths) -> list:
+        """
+        Start downloading the files in the background and return at once.  The files are downloaded as they would be
+        by iter_download; calls made while others are in progress share the client's concurrency limit.
+
+        :param file_paths: an iterable of the full paths of the files to be downloaded.
+        :return: a list of concurrent.futures.Future objects, one for each file path in the same order, whose result
+        is the DownloadResult of the file; a future raises the IrobotClientException of a file that could not be
+        downloaded or whose checksum does not match.  Cancelling a future before its download starts leaves the file
+        out.
+        """
+
+        file_paths = list(file_paths)
+        # A file requested more than once is downloaded once, and shares its future.
+        futures = {file_path: Future() for file_path in file_paths}
+
+        thread = threading.Thread(target=self._settle, args=(futures,), daemon=True)
+        with self._threads_lock:
+            self._threads.add(thread)
+        thread.start()
+
+        return [futures[file_path] for file_path in file_paths]
+
+    def prefetch(self, file_paths):
+        """
+        Ask iRobot to start staging the files into its precache, without downloading them.
+
+        :param file_paths: an iterable of the full paths of the files to be prefetched.
+        :return: a generator of PrefetchResult objects, soonest ready first within each window of files.
+        """
+
+        yield from prefetch_files(self._request_handler, file_paths, self._jobs)
+
+    def preflight(self, file_paths):
+        """
+        Fetch the metadata of the files and plan their download; see preflight_handler.preflight_files.
+
+        :param file_paths: an iterable of the full paths of the files to be downloaded.
+        :return: a generator of PreflightResult objects, in the order the files should be downloaded.
+        """
+
+        yield from preflight_files(self._request_handler, file_paths, self._output_dir, self._jobs,
+                                   checksum_index=self._checksum_index)
+
+    def stream(self, file_path: str, sink) -> DownloadResult:
+        """
+        Pass the data of a file through to a stream as it arrives, without writing it to disk.
+
+        :param file_path: the full path of the file requested.
+        :param sink: an unbuffered binary file object the data is written to; it is not closed.
+        :return: the DownloadResult of the file, without a save location; checksum_matched is False if the data
+        streamed does not match iRobot's checksum.
+        """
+
+        result = stream_file(self._request_handler, file_path, sink, self._chunk_size, self._log)
+        result.metrics = self._metrics.finish(result)
+
+        return result
+
+    def _close_stores(self):
+        # Close the checksum index, download cache and metrics, whichever were opened.
+
+        if self._checksum_index:
+            self._checksum_index.close()
+        if self._cache:
+            self._cache.close()
+        self._metrics.close()
+
+    def close(self):
+        """
+        Wait for the downloads started by download_many to finish, then close the connections, checksum index and
+        download cache, and write the metrics summary.
+        """
+
+        with self._threads_lock:
+            threads = list(self._threads)
+
+        for thread in threads:
+            thread.join()
+
+        self._request_handler.close()
+        self._close_stores()
@@ -0,0 +1,118 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""concurrency_handler.py - adapt the number of concurrent downloads to how loaded iRobot is."""
+import threading
+import time
+
+from contextlib import contextmanager
+
+# The factor the limit is cut by when iRobot is overloaded.
+DECREASE_FACTOR = 0.5
+
+# Overload signals within this many seconds of a cut are taken to be the same episode and do not cut the limit again.
+DECREASE_INTERVAL = 1.0
+
+
+class ConcurrencyLimiter:
+    """
+    An additive increase, multiplicative decrease (AIMD) limit on the number of files downloaded at the same time,
+    as used by TCP congestion control.  Every successful request raises the limit by 1/limit, so the limit grows by one
+    for each limit's worth of successes, up to the maximum; every overload signal from iRobot (a 504 or 507 response,
+    or a failed connection) halves it, down to one.  The signals of one overload episode, which arrive from many
+    requests at once, only cut the limit once.
+
+    Downloads beyond the current limit wait for a slot rather than failing, so a cut takes effect as the downloads in
+    progress finish.  A limiter may be shared between threads.
+
+    Public methods:
+    slot - a context manager holding one of the limited slots.
+    succeeded - report a successful request.
+    overloaded - report that iRobot is overloaded.
+    """
+
+    def __init__(self, initial_limit: int, maximum_limit=None):
+        """
+        Instantiate a limiter.
+
+        :param initial_limit: the number of slots to begin with.
+        :param maximum_limit: the number of slots the limit can grow to; defaults to the initial limit.
+        """
+
+        self._maximum_limit = max(maximum_limit or initial_limit, initial_limit)
+        self._limit = float(initial_limit)
+        self._active = 0
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    @property
+    def maximum_limit(self) -> int:
+        """
+        The number of slots the limit can grow to.
+        """
+
+        return self._maximum_limit
+
+    @property
+    def limit(self) -> int:
+        """
+        The number of slots currently available, in use or not.
+        """
+
+        return max(1, int(self._limit))
+
+    @contextmanager
+    def slot(self):
+        """
+        Wait for, and hold while in the context, one of the limited slots.
+        """
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify()
+
+    def succeeded(self):
+        """
+        Report a successful request, which raises the limit additively.
+        """
+
+        with self._condition:
+            previous_limit = self.limit
+            self._limit = min(self._maximum_limit, self._limit + 1 / self._limit)
+
+            if self.limit > previous_limit:
+                self._condition.notify()
+
+    def overloaded(self):
+        """
+        Report that iRobot is overloaded, which cuts the limit multiplicatively.
+        """
+
+        with self._condition:
+            now = time.monotonic()
+
+            if self._last_decrease is not None and now - self._last_decrease < DECREASE_INTERVAL:
+                return
+
+            self._limit = max(1.0, self._limit * DECREASE_FACTOR)
+            self._last_decrease = now
@@ -19,7 +19,14 @@ import argparse
 import os
 import errno
 
+from irobotclient.auth_handler import DEFAULT_AUTH_CACHE_TTL
+from irobotclient.cache_handler import DEFAULT_CACHE_SIZE
 from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.download_handler import DEFAULT_JOBS, DEFAULT_CHUNK_SIZE
+from irobotclient.endpoint_handler import split_urls
+from irobotclient.request_handler import DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+from irobotclient.segment_handler import DEFAULT_SEGMENT_SIZE, DEFAULT_MEMORY_BUDGET
+from irobotclient.stream_handler import is_stream_sink
 
 
 def _get_command_line_args(args=None):
@@ -28,12 +35,16 @@ def _get_command_line_args(args=None):
     parser = argparse.ArgumentParser(prog="irobotclient",
                                      formatter_class=argparse.RawTextHelpFormatter,
                                      description="Command line interface for iRobot HTTP requests",
-                                     usage="irobotclient [options] INPUT_FILE OUTPUT_DIR")
-    parser.add_argument("input_file", help="path and name of input file")
-    parser.add_argument("output_dir", help="path of output directory")
+                                     usage="irobotclient [options] INPUT_FILE OUTPUT_DIR\n"
+                                           "       irobotclient [options] --manifest MANIFEST OUTPUT_DIR")
+    parser.add_argument("input_file", nargs="?", help="path and name of input file")
+    parser.add_argument("output_dir", help="path of output directory; '-' or a named pipe streams the input file to "
+                                           "it instead")
     parser.add_argument("-u", "--url",
                         help="Use this tag if no irobot URL is set as an environment variable {IROBOT_URL}. "
-                             "URL scheme, domain and port for irobot. EXAMPLE: http://irobot:5000/",
+                             "URL scheme, domain and port for irobot. EXAMPLE: http://irobot:5000/.  A comma "
+                             "separated list of the URLs of several iRobot instances spreads the requests over them, "
+                             "failing over from any that are down or overloaded",
                         default=os.getenv('IROBOT_URL'))
     parser.add_argument("--arvados_token",
                         help="Arvados authentication token; if not supplied here it will be sourced from the "
@@ -47,6 +58,11 @@ def _get_command_line_args(args=None):
                         help="Basic authentication password; if not supplied here it will be sourced from the "
                              "environment {BASIC_PASSWORD}",
                         default=os.getenv('BASIC_PASSWORD'))
+    parser.add_argument("--auth_cache",
+                        help="File in which to remember which authentication scheme each iRobot host accepts, so that "
+                             "later runs use the right credential first")
+    parser.add_argument("--auth_cache_ttl", type=int, default=DEFAULT_AUTH_CACHE_TTL,
+                        help="Number of seconds an authentication scheme is remembered in the --auth_cache file")
     parser.add_argument("-f", "--force", default=False, action="store_true", help="force overwrite output file if "
                                                                                   "it already exists")
     parser.add_argument("--no_index", default=False, action="store_true", help="Do not download index files for "
@@ -54,6 +70,76 @@ def _get_command_line_args(args=None):
     parser.add_argument("-o", "--override_url", default=False, action="store_true", help="Override a URL set in the "
                                                                                          "IROBOT_URL environment "
                                                                                          "variable")
+    parser.add_argument("--pool_connections", type=int, default=DEFAULT_POOL_CONNECTIONS,
+                        help="Number of iRobot hosts to keep connection pools for")
+    parser.add_argument("--pool_maxsize", type=int, default=DEFAULT_POOL_MAXSIZE,
+                        help="Maximum number of connections kept alive per iRobot host")
+    parser.add_argument("--no_keep_alive", default=False, action="store_true", help="Close the connection after "
+                                                                                    "every request instead of "
+                                                                                    "reusing it")
+    parser.add_argument("-m", "--manifest",
+                        help="File listing the input files to download, one per line, instead of INPUT_FILE; use '-' "
+                             "to read the list from stdin")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+                        help="Number of files to download at the same time")
+    parser.add_argument("--max_jobs", type=int,
+                        help="Number of files the number downloaded at the same time may grow to while iRobot keeps "
+                             "up; it is cut back whenever iRobot reports it is overloaded.  Defaults to --jobs")
+    parser.add_argument("--prefetch", default=False, action="store_true",
+                        help="Ask iRobot to start fetching every file before downloading any of them, then download "
+                             "them in the order they are expected to be ready")
+    parser.add_argument("--prefetch_only", default=False, action="store_true",
+                        help="Ask iRobot to start fetching every file into its precache and exit without downloading")
+    parser.add_argument("--preflight", default=False, action="store_true",
+                        help="Fetch the metadata of all the files before downloading any of them, to check there is "
+                             "room for them, download the largest first and, with --skip_unchanged, leave out those "
+                             "already downloaded")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="Number of byte ranges of a large file to download at the same time; the default of 1 "
+                             "downloads each file as a single stream")
+    parser.add_argument("--segment_size", type=int, default=DEFAULT_SEGMENT_SIZE,
+                        help="Size in bytes of each byte range of a segmented download")
+    parser.add_argument("--memory_budget", type=int, default=DEFAULT_MEMORY_BUDGET,
+                        help="Upper limit in bytes on the buffers of all the byte ranges being downloaded")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Size in bytes of the buffer data is read into, and written and hashed from, at a time")
+    parser.add_argument("--max_bandwidth", type=int,
+                        help="Upper limit in bytes per second on the bandwidth of all the downloads together, shared "
+                             "equally between the files being downloaded")
+    parser.add_argument("--max_file_bandwidth", type=int,
+                        help="Upper limit in bytes per second on the bandwidth of any one file")
+    parser.add_argument("--metrics",
+                        help="File to append the performance metrics of every file, and a summary of the run, to as "
+                             "JSON lines")
+    parser.add_argument("--metrics_textfile",
+                        help="File to write a summary of the run to in the Prometheus text format, for the node "
+                             "exporter's textfile collector; name it *.prom")
+    parser.add_argument("--trace",
+                        help="File to write a timeline of the run to, in the Chrome trace event format, for viewing in "
+                             "Perfetto or chrome://tracing")
+    parser.add_argument("--skip_unchanged", default=False, action="store_true",
+                        help="Keep an index of the checksums of downloaded files and, for files already in the output "
+                             "directory, only download them again if they have changed in iRobot")
+    parser.add_argument("--index_file",
+                        help="Location of the checksum index used by --skip_unchanged; defaults to a file in the "
+                             "output directory")
+    parser.add_argument("--cache_dir",
+                        help="Directory of a download cache, which can be shared by every run on a node; files whose "
+                             "data iRobot confirms is already cached are copied from it instead of being downloaded.  "
+                             "If not supplied here it will be sourced from the environment {IROBOT_CACHE_DIR}",
+                        default=os.getenv('IROBOT_CACHE_DIR'))
+    parser.add_argument("--cache_size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="Upper limit in bytes on the size of the download cache; the least recently used files "
+                             "are removed to keep within it")
+    parser.add_argument("--no_coalesce", default=False, action="store_true",
+                        help="Do not wait for another process on this host that is downloading the same file, and "
+                             "reuse its result, but download the file regardless")
+    parser.add_argument("--daemon_socket",
+                        help="Unix socket of the irobotclient-daemon to hand the run to; defaults to the per-user "
+                             "socket in $XDG_RUNTIME_DIR or a private directory in the temporary directory.  If no "
+                             "daemon of this user is listening, or the run is traced, the run is done in this process")
+    parser.add_argument("--no_daemon", default=False, action="store_true",
+                        help="Do the run in this process even if an irobotclient-daemon is listening")
     args = parser.parse_args(args)
 
     return args
@@ -66,6 +152,11 @@ def _validate_command_line_args(args):
     _check_output_directory_argument(args)
     _check_url_argument(args)
     _check_authorisation_credentials(args)
+    _check_connection_pool_arguments(args)
+    _check_jobs_argument(args)
+    _check_segment_arguments(args)
+    _check_bandwidth_arguments(args)
+    _check_cache_arguments(args)
 
 
 def _check_input_file_argument(args):
@@ -73,6 +164,15 @@ def _check_input_file_argument(args):
     # Strips the leading slash from the input argument, if a separate URL has been specified on the commandline,
     # to prevent double slashes in the API request.
 
+    if bool(args.input_file) == bool(args.manifest):
+        raise IrobotClientException(errno=errno.EINVAL,
+                                    message="Please supply either an input file or a --manifest, but not both.")
+
+    if args.manifest:
+        if args.manifest != '-' and not os.path.isfile(args.manifest):
+            raise IrobotClientException(errno=errno.ENOENT, message=f"Manifest {args.manifest} does not exist.")
+        return
+
     if args.input_file.endswith('/'):
         raise IrobotClientException(errno=errno.ECONNABORTED,
                                     message="Cannot download entire directories at present.")
@@ -83,6 +183,13 @@ def _check_input_file_argument(args):
 
 def _check_output_directory_argument(args):
     # Check if the output directory already exists and if it already contains files of the same name as the input file.
+    # A stream output takes the data of a single file and is left as it is.
+
+    if is_stream_sink(args.output_dir):
+        if args.manifest:
+            raise IrobotClientException(errno=errno.EINVAL, message="Only a single input file can be streamed; "
+                                                                    "please supply an input file, not a --manifest.")
+        return
 
     # Expand the output_dir argument so the full directory path can be used in the rest of the program.
     args.output_dir = os.path.expanduser(args.output_dir)
@@ -93,7 +200,7 @@ def _check_output_directory_argument(args):
 
     try:
         for dir_file in os.listdir(args.output_dir):
-            if not args.force and args.input_file == dir_file:
+            if not args.force and not args.skip_unchanged and args.input_file == dir_file:
                 raise IrobotClientException(errno=errno.EEXIST, message="File already exists. Please use the "
                                                                         "--force option to overwrite.")
 
@@ -113,8 +220,8 @@ def _check_url_argument(args):
     if args.override_url and args.url == os.getenv('IROBOT_URL'):
         args.url = None
 
-    if args.url and not args.url.endswith('/'):
-        args.url += '/'
+    if args.url:
+        args.url = ",".join(split_urls(args.url))
 
 
 def _check_authorisation_credentials(args):
@@ -124,6 +231,51 @@ def _check_authorisation_credentials(args):
         raise IrobotClientException(errno=errno.EACCES, message="No Arvados or Basic authentication set; please check "
                                                                 "input arguments and/or environment variables.")
 
+    if args.auth_cache_ttl < 1:
+        raise IrobotClientException(errno=errno.EINVAL, message="The authentication cache TTL must be at least 1.")
+
+
+def _check_connection_pool_arguments(args):
+    # A connection pool needs room for at least one host and one connection.
+
+    if args.pool_connections < 1 or args.pool_maxsize < 1:
+        raise IrobotClientException(errno=errno.EINVAL, message="The connection pool options must be at least 1.")
+
+
+def _check_jobs_argument(args):
+    # At least one file has to be downloaded at a time, and the limit can only grow from there.
+
+    if args.jobs < 1:
+        raise IrobotClientException(errno=errno.EINVAL, message="The number of jobs must be at least 1.")
+
+    if args.max_jobs is not None and args.max_jobs < args.jobs:
+        raise IrobotClientException(errno=errno.EINVAL, message="The maximum number of jobs must be at least the "
+                                                                "number of jobs.")
+
+
+def _check_segment_arguments(args):
+    # At least one range of a file has to be downloaded at a time, into a buffer of at least one byte.
+
+    if args.segments < 1 or args.segment_size < 1 or args.memory_budget < 1 or args.chunk_size < 1:
+        raise IrobotClientException(errno=errno.EINVAL, message="The segment options, memory budget and chunk size "
+                                                                "must be at least 1.")
+
+
+def _check_bandwidth_arguments(args):
+    # A bandwidth limit, if there is one, has to let some data through.
+
+    if (args.max_bandwidth is not None and args.max_bandwidth < 1) or \
+            (args.max_file_bandwidth is not None and args.max_file_bandwidth < 1):
+        raise IrobotClientException(errno=errno.EINVAL, message="The bandwidth limits must be at least 1 byte per "
+                                                                "second.")
+
+
+def _check_cache_arguments(args):
+    # The download cache has to have room for something.
+
+    if args.cache_size < 1:
+        raise IrobotClientException(errno=errno.EINVAL, message="The cache size must be at least 1.")
+
 
 def run(config_args=None) -> argparse.ArgumentParser:
     """
@@ -34,4 +34,23 @@ class IrobotClientException(OSError):
         super().__init__(*args, **kwargs)
 
         self.errno = errno
-        self.strerror = message
\ No newline at end of file
+        self.strerror = message
+
+
+class DataNotReadyException(IrobotClientException):
+    """
+    Raised instead of waiting when iRobot is still fetching the requested data into its precache, so that the caller
+    can get on with other work and ask again once the delay has passed.
+    """
+
+    def __init__(self, errno: int, message: str, delay: int, *args, **kwargs) -> None:
+        """
+        Instantiate a class object with the delay suggested by iRobot.
+
+        :param errno: the iRobot response code.
+        :param message: a description of the data that is not ready.
+        :param delay: the number of seconds to wait before requesting the data again.
+        """
+        super().__init__(errno, message, *args, **kwargs)
+
+        self.delay = delay
@@ -0,0 +1,485 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""daemon_handler.py - a long-running node-local daemon that short-lived client processes hand their runs to.
+
+Usage: irobotclient-daemon [--socket SOCKET]
+"""
+import argparse
+import errno
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+
+from irobotclient.auth_handler import AuthenticationCache, DEFAULT_AUTH_CACHE_TTL
+from irobotclient.bandwidth_handler import BandwidthLimiter
+from irobotclient.client_handler import IrobotClient
+from irobotclient.concurrency_handler import ConcurrencyLimiter
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.download_handler import DownloadResult, PrefetchResult, DEFAULT_JOBS
+from irobotclient.metrics_handler import FileMetrics, FILE_COUNTERS
+from irobotclient.preflight_handler import PreflightResult
+from irobotclient.request_handler import create_session, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+
+# The IrobotClient methods a daemon runs, with the type and attributes of the results each yields.
+DAEMON_METHODS = {
+    "iter_download": (DownloadResult, ("file_path", "save_location", "checksum", "checksum_matched", "skipped",
+                                       "unchanged", "cached", "coalesced")),
+    "prefetch": (PrefetchResult, ("file_path", "delay")),
+    "preflight": (PreflightResult, ("file_path", "size", "checksum", "unchanged"))
+}
+
+# The client options that select the state kept warm between runs; runs that agree on them share it.
+WARM_OPTIONS = ("url", "pool_connections", "pool_maxsize", "jobs", "max_jobs", "auth_cache", "auth_cache_ttl",
+                "max_bandwidth", "max_file_bandwidth")
+
+# The client options that are local paths, made absolute before a run is handed over.
+PATH_OPTIONS = ("index_file", "cache_dir", "auth_cache", "metrics", "metrics_textfile")
+
+
+def get_default_socket() -> str:
+    """
+    Return the location of the daemon's socket: in the user's runtime directory if there is one; otherwise in a
+    per-user directory, private to the user, in the system's temporary directory.
+
+    :return: the path of the socket.
+    """
+
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "irobotclient.sock")
+
+    return os.path.join(tempfile.gettempdir(), f"irobotclient-{os.getuid()}", "irobotclient.sock")
+
+
+def _check_peer(connection: socket.socket):
+    # Raise unless the process at the other end of a Unix socket connection is run by this user.  Where the platform
+    # cannot tell, the ownership of the socket (see is_trusted) is relied on.
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return
+
+    _, uid, _ = struct.unpack("3i", connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                          struct.calcsize("3i")))
+    if uid != os.getuid():
+        raise IrobotClientException(errno.EACCES, "The daemon on the socket is run by another user.")
+
+
+def is_listening(socket_location: str) -> bool:
+    """
+    Check whether a daemon is accepting connections on the socket.
+
+    :param socket_location: the path of the Unix socket.
+    :return: whether a connection could be made.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_location)
+        except OSError:
+            return False
+
+    return True
+
+
+def is_trusted(socket_location: str) -> bool:
+    """
+    Check that the socket, and the daemon listening on it, belong to this user, so that a run's credentials can be
+    handed to it: the socket must be owned by the user and accessible to no one else, and the process listening on it
+    must be run by the user.
+
+    :param socket_location: the path of the Unix socket.
+    :return: whether the daemon can be trusted.
+    """
+
+    try:
+        status = os.lstat(socket_location)
+    except OSError:
+        return False
+
+    # Read and write access for the user only (0600) or stricter.
+    if not (stat.S_ISSOCK(status.st_mode) and status.st_uid == os.getuid() and not status.st_mode & 0o177):
+        return False
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_location)
+            _check_peer(connection)
+        except (OSError, IrobotClientException):
+            return False
+
+    return True
+
+
+def _make_private_directory(directory: str):
+    # Create the directory of the socket, accessible only to this user, if it does not exist; one that does must
+    # already be private, or another user could replace the socket in it.
+
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+
+    status = os.lstat(directory)
+    if not (stat.S_ISDIR(status.st_mode) and status.st_uid == os.getuid() and not status.st_mode & 0o077):
+        raise IrobotClientException(errno.EACCES, f"The directory of the socket, {directory}, must be owned by this "
+                                                  f"user and accessible to no one else.")
+
+
+def _encode_line(message) -> bytes:
+    # A message of the protocol: one JSON value per line.
+
+    return (json.dumps(message) + "\n").encode()
+
+
+def _encode_error(error: Exception) -> dict:
+    # Describe an exception well enough for the client to raise an IrobotClientException with the same error number.
+
+    if isinstance(error, OSError) and error.errno is not None:
+        return {"errno": error.errno, "strerror": error.strerror}
+
+    return {"errno": errno.ECONNABORTED, "strerror": f"{type(error).__name__}: {error}"}
+
+
+def _encode_result(result, attributes: tuple) -> dict:
+    # Describe a result by its attributes, its error and, for a download, its metrics.
+
+    encoded = {attribute: getattr(result, attribute) for attribute in attributes}
+    encoded["error"] = _encode_error(result.error) if result.error is not None else None
+
+    if getattr(result, "metrics", None) is not None:
+        encoded["metrics"] = result.metrics.as_dict()
+
+    return encoded
+
+
+def _decode_error(encoded: dict) -> IrobotClientException:
+    return IrobotClientException(encoded["errno"], encoded["strerror"])
+
+
+def _decode_metrics(encoded: dict) -> FileMetrics:
+    # Rebuild the metrics of a file from their dictionary; the throughput is calculated from the counters.
+
+    metrics = FileMetrics(encoded["file_path"])
+
+    for attribute in ("status", "time_to_first_byte", "duration") + FILE_COUNTERS:
+        setattr(metrics, attribute, encoded[attribute])
+
+    return metrics
+
+
+def _decode_result(result_type, encoded: dict):
+    # Rebuild a result from its description.
+
+    error = encoded.pop("error")
+    metrics = encoded.pop("metrics", None)
+    result = result_type(**encoded, error=_decode_error(error) if error else None)
+
+    if metrics:
+        result.metrics = _decode_metrics(metrics)
+
+    return result
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # Runs one client method for a connection.  The connection sends a request line, then the file paths one per line
+    # until it shuts down its side; the results are sent back one per line as they complete, ending with an end (or
+    # error) line.  The file paths are read lazily while the results are sent.
+
+    def _send(self, message):
+        self.wfile.write(_encode_line(message))
+        self.wfile.flush()
+
+    def handle(self):
+        request_line = self.rfile.readline()
+        if not request_line:
+            # The connection only checked that the daemon is listening.
+            return
+
+        try:
+            request = json.loads(request_line.decode())
+            _, attributes = DAEMON_METHODS[request["method"]]
+            file_paths = (json.loads(line.decode()) for line in self.rfile)
+
+            with self.server.get_client(request["options"]) as client:
+                for result in getattr(client, request["method"])(file_paths, **request["arguments"]):
+                    self._send({"result": _encode_result(result, attributes)})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; the run is abandoned.
+            return
+        except Exception as err:
+            self.server.log.exception(err)
+            self._send({"error": _encode_error(err)})
+            return
+
+        self._send({"end": True})
+
+
+class IrobotDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves the runs of short-lived client processes on a Unix socket, so that they do not each pay for opening
+    connections, negotiating authentication and setting up a concurrency limit.  The connection pool, concurrency
+    limiter, bandwidth limiter and negotiated authentication are kept warm for each combination of the WARM_OPTIONS,
+    and shared by every run that agrees on them, so that concurrent runs keep to one bandwidth limit together;
+    everything else (the output directory, checksum index, download cache and metrics) is set up for each run exactly
+    as it would be in process.  The socket is only accessible to the user running the daemon, as runs send their
+    credentials over it.
+
+    Public methods:
+    get_client - return a client for one run, sharing the warm state of its options.
+    serve_forever - serve runs until stopped (from socketserver).
+    server_close - close the warm connections and remove the socket.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_location: str, log=None):
+        """
+        Instantiate a daemon listening on the socket.
+
+        :param socket_location: the path of the Unix socket; a stale socket left by a daemon that did not stop
+        cleanly is replaced.
+        :param log: the error logger.
+        """
+
+        self.log = log if log else logging.getLogger(__name__)
+        self._socket_location = socket_location
+        self._lock = threading.Lock()
+        # Maps the warm options of a run to the (session, limiter, authentication cache, bandwidth limiter) its runs
+        # share.
+        self._warm_state = {}
+
+        if os.path.exists(socket_location):
+            if is_listening(socket_location):
+                raise IrobotClientException(errno.EADDRINUSE, f"A daemon is already listening on {socket_location}.")
+            os.remove(socket_location)
+
+        if socket_location == get_default_socket() and not os.getenv("XDG_RUNTIME_DIR"):
+            _make_private_directory(os.path.dirname(socket_location))
+
+        # The socket is readable and writable by this user only.
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_location, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def get_client(self, options: dict) -> IrobotClient:
+        """
+        Return a client for one run, sharing the connection pool, concurrency limiter, bandwidth limiter and negotiated
+        authentication of the runs with the same WARM_OPTIONS.
+
+        :param options: the IrobotClient options of the run.
+        :return: the client, which the caller closes.
+        """
+
+        key = tuple(options.get(option) for option in WARM_OPTIONS)
+
+        with self._lock:
+            if key not in self._warm_state:
+                self._warm_state[key] = (
+                    create_session(options.get("pool_connections", DEFAULT_POOL_CONNECTIONS),
+                                   options.get("pool_maxsize", DEFAULT_POOL_MAXSIZE)),
+                    ConcurrencyLimiter(options.get("jobs", DEFAULT_JOBS), options.get("max_jobs")),
+                    AuthenticationCache(options.get("auth_cache"),
+                                        options.get("auth_cache_ttl", DEFAULT_AUTH_CACHE_TTL)),
+                    BandwidthLimiter(options.get("max_bandwidth"), options.get("max_file_bandwidth"))
+                    if options.get("max_bandwidth") or options.get("max_file_bandwidth") else None)
+
+            session, limiter, authentication_cache, bandwidth = self._warm_state[key]
+
+        return IrobotClient(**options, log=self.log, session=session, limiter=limiter,
+                            authentication_cache=authentication_cache, bandwidth=bandwidth)
+
+    def server_close(self):
+        super().server_close()
+
+        with self._lock:
+            for session, _, _, _ in self._warm_state.values():
+                session.close()
+            self._warm_state.clear()
+
+        try:
+            os.remove(self._socket_location)
+        except FileNotFoundError:
+            pass
+
+
+class DaemonClient:
+    """
+    Hands the calls of a run to an IrobotDaemon, in place of an IrobotClient with the same options.  Each call is a
+    connection of its own: the file paths are sent from a thread as they are taken from the iterable, while the
+    results are yielded as the daemon sends them, so calls can be chained lazily just as the IrobotClient's can.
+
+    The progress messages of the daemon's downloads go to the daemon's logging, not back to the caller.  The options,
+    which include the credentials, are only sent to a daemon run by the same user; check is_trusted before handing a
+    run over.
+
+    Public methods:
+    iter_download - download files and yield each result as it completes, failures included.
+    prefetch - ask iRobot to stage files into its precache.
+    preflight - plan the download of files from their metadata.
+    """
+
+    def __init__(self, socket_location: str, **options):
+        """
+        Instantiate a client of the daemon on the socket.
+
+        :param socket_location: the path of the daemon's Unix socket.
+        :param options: the IrobotClient options of the run; local paths are made absolute, as the daemon does not
+        share the caller's working directory.
+        """
+
+        self._socket_location = socket_location
+        self._options = options
+        self._options["output_dir"] = os.path.join(os.path.abspath(options["output_dir"]), "")
+
+        for option in PATH_OPTIONS:
+            if options.get(option):
+                self._options[option] = os.path.abspath(options[option])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def _call(self, method: str, file_paths, **arguments):
+        # Run a client method in the daemon, yielding its results.  An error taking the file paths from the iterable
+        # is raised once the daemon has finished with those already sent, as it would be in process.
+
+        result_type, _ = DAEMON_METHODS[method]
+        path_errors = []
+
+        def send_file_paths():
+            try:
+                for file_path in file_paths:
+                    connection.sendall(_encode_line(file_path))
+            except Exception as err:
+                path_errors.append(err)
+            finally:
+                try:
+                    connection.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self._socket_location)
+            # The socket may have been replaced since it was checked; credentials only go to this user's daemon.
+            _check_peer(connection)
+            connection.sendall(_encode_line({"method": method, "options": self._options, "arguments": arguments}))
+            threading.Thread(target=send_file_paths, daemon=True).start()
+
+            with connection.makefile("rb") as responses:
+                for line in responses:
+                    message = json.loads(line.decode())
+
+                    if "result" in message:
+                        yield _decode_result(result_type, message["result"])
+                    elif "error" in message:
+                        raise _decode_error(message["error"])
+                    else:
+                        break
+                else:
+                    raise IrobotClientException(errno.ECONNABORTED, "ERROR: The daemon closed the connection before "
+                                                                    "the run was finished.")
+
+        if path_errors:
+            raise path_errors[0]
+
+    def iter_download(self, file_paths, skip_existing=False):
+        """
+        Download the files in the daemon; see IrobotClient.iter_download.
+
+        :param file_paths: an iterable of the full paths of the files to be downloaded; it is read lazily.
+        :param skip_existing: do not request files whose name already exists in the output directory.
+        :return: a generator of DownloadResult objects.
+        """
+
+        yield from self._call("iter_download", file_paths, skip_existing=skip_existing)
+
+    def prefetch(self, file_paths):
+        """
+        Ask iRobot, through the daemon, to start staging the files into its precache; see IrobotClient.prefetch.
+
+        :param file_paths: an iterable of the full paths of the files to be prefetched.
+        :return: a generator of PrefetchResult objects.
+        """
+
+        yield from self._call("prefetch", file_paths)
+
+    def preflight(self, file_paths):
+        """
+        Plan the download of the files in the daemon; see IrobotClient.preflight.
+
+        :param file_paths: an iterable of the full paths of the files to be downloaded.
+        :return: a generator of PreflightResult objects, in the order the files should be downloaded.
+        """
+
+        yield from self._call("preflight", file_paths)
+
+
+def _parse_arguments(args=None) -> argparse.Namespace:
+    # The options of the daemon itself; those of each run are sent by its client.
+
+    parser = argparse.ArgumentParser(prog="irobotclient-daemon",
+                                     description="Serve the runs of irobotclient processes on this node, keeping "
+                                                 "their connections and negotiated authentication warm")
+    parser.add_argument("--socket", default=get_default_socket(),
+                        help="Path of the Unix socket to listen on; defaults to the per-user socket in "
+                             "$XDG_RUNTIME_DIR or the temporary directory")
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """
+    Entry point of the daemon: serve runs until interrupted or terminated.
+
+    :param args: the command line arguments; defaults to sys.argv.
+    """
+
+    args = _parse_arguments(args)
+    logging.basicConfig(format='\n%(asctime)s - %(message)s', level=logging.ERROR)
+
+    # Terminating the daemon stops it cleanly, removing its socket.
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+
+    try:
+        daemon = IrobotDaemon(args.socket)
+    except IrobotClientException as err:
+        print(err, file=sys.stderr)
+        sys.exit(err.errno)
+
+    print(f"Listening on {args.socket}", file=sys.stderr)
+
+    with daemon:
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
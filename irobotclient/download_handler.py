@@ -0,0 +1,699 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""download_handler.py - download engine that fetches files from iRobot with a bounded pool of workers."""
+import errno
+import functools
+import hashlib
+import heapq
+import itertools
+import logging
+import sqlite3
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import ExitStack
+from os import path
+from requests import Response
+
+from irobotclient import trace_handler
+from irobotclient.cache_handler import reflink_or_copy
+from irobotclient.concurrency_handler import ConcurrencyLimiter
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.lock_handler import DownloadLock
+from irobotclient.metrics_handler import TimedHasher
+from irobotclient.request_handler import Requester, ResponseCodes, REQUEST_LIMIT
+from irobotclient.response_handler import response_headers
+from irobotclient.resume_handler import PartialDownload
+from irobotclient.segment_handler import download_segments, get_content_range_start, calculate_file_checksum, \
+    repair_ranges, DEFAULT_SEGMENT_SIZE, DEFAULT_MEMORY_BUDGET
+from irobotclient.stream_handler import can_read_into, pipelined_copy, read_chunks, write_all
+
+# The logger that messages about the progress of downloads (waits for iRobot, resumes, repairs and warnings) are sent
+# to.  The command line interface prints them; other programs only see them if they configure logging.
+PROGRESS_LOGGER = "irobotclient.progress"
+progress_log = logging.getLogger(PROGRESS_LOGGER)
+
+# Default size (in bytes) of the buffer that data is read into, and written and hashed from, at a time.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Downloads of more than this many chunks are pipelined, with hashing and writing on their own threads; smaller ones are
+# not worth the threads.
+PIPELINE_THRESHOLD_CHUNKS = 4
+
+# Default number of files downloaded at the same time.
+DEFAULT_JOBS = 4
+
+# How many files, per worker, are handed to the pool ahead of time so that a worker never waits for work.
+QUEUED_FILES_PER_JOB = 2
+
+# Files that iRobot is still fetching are parked until their ETA.  No new files are started while this many are
+# parked, and a parked file is polled no sooner than the minimum delay (in seconds) after its last request.
+MAX_PARKED_FILES = 1000
+MINIMUM_POLL_DELAY = 1
+
+# The number of files asked to be prefetched, and then ordered by ETA, at a time.
+PREFETCH_WINDOW = 1000
+
+
+def _download_data(response: Response, save_location: str, partial=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                   record=None) -> str:
+    # Downloads data to a file in the the output directory in chunks read into reusable buffers, which are written and
+    # hashed from without being copied; large downloads overlap reading, hashing and writing on separate threads.
+    # Calculated checksum as it goes and returns the hex string.  If the partial download has data committed, the
+    # response holds the rest of the data and it is appended after that.  If given, record(counter, value) is called
+    # with the bytes downloaded and the time spent hashing them.
+
+    if partial and partial.committed:
+        hasher = partial.rehash()
+        file = open(save_location, "r+b", buffering=0)
+        file.seek(partial.committed)
+        file.truncate()
+    else:
+        hasher = hashlib.md5()
+        file = open(save_location, "wb", buffering=0)
+
+    if record:
+        hasher = TimedHasher(hasher)
+
+    with file:
+        _copy_data(response, file, hasher, chunk_size, partial.advance if partial else None)
+
+    if record:
+        record("bytes", hasher.bytes)
+        record("hash_time", hasher.elapsed)
+
+    return hasher.hexdigest()
+
+
+def _copy_data(response: Response, file, hasher, chunk_size: int, on_written=None):
+    # Write the data of a response to an unbuffered file and feed it to the hasher; large responses are pipelined.
+
+    content_length = int(response.headers.get(response_headers['CONTENT_LENGTH'], 0))
+
+    if content_length > chunk_size * PIPELINE_THRESHOLD_CHUNKS and can_read_into(response):
+        pipelined_copy(response, file, hasher, chunk_size, on_written)
+        return
+
+    for data_chunk in trace_handler.iterate("read", read_chunks(response, chunk_size)):
+        with trace_handler.span("write"):
+            write_all(file, data_chunk)
+        with trace_handler.span("hash"):
+            hasher.update(data_chunk)
+        if on_written:
+            on_written(file, len(data_chunk))
+
+
+def _validate_downloaded_data(response: Response, calculated_checksum: str, log=None) -> bool:
+    # Check that the response checksum tag matches the file checksum.
+
+    try:
+        checksum = response.headers[response_headers['CHECKSUM']]
+    except KeyError as err:
+        progress_log.warning(f"WARNING: Could not obtain a checksum from the response {response_headers['CHECKSUM']} "
+                             f"header.")
+        log.exception(err)
+        return False
+
+    if not calculated_checksum == checksum:
+        progress_log.warning("WARNING: Checksum of response and downloaded file do not match. Data may be corrupt or "
+                             "missing.")
+        log.exception(IrobotClientException(errno.ECONNABORTED, "ERROR: The checksum of the downloaded file does not "
+                                                                "match the checksum expected.  The file may be "
+                                                                "corrupt or missing data.  Please try again."))
+        return False
+
+    return True
+
+
+class DownloadResult:
+    """
+    The outcome of a single file download.  Either the save location and checksum are set, or the error that stopped
+    the download is.
+    """
+
+    def __init__(self, file_path: str, save_location=None, checksum=None, checksum_matched=False, error=None,
+                 skipped=False, unchanged=False, cached=False, coalesced=False, metrics=None):
+        """
+        Instantiate a result for one requested file.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        :param save_location: where the data was written to.
+        :param checksum: the MD5 hex digest calculated while the data was written.
+        :param checksum_matched: whether the calculated checksum matched the one sent by iRobot.
+        :param error: the exception raised while requesting or downloading the file.
+        :param skipped: whether the file was left alone because it already exists in the output directory.
+        :param unchanged: whether the file was not downloaded because iRobot confirmed the copy in the output directory
+        is identical.
+        :param cached: whether the file was copied from the download cache instead of being downloaded.
+        :param coalesced: whether the file was downloaded by another process (or worker) at the same time, and its
+        result reused.
+        :param metrics: the FileMetrics of the file, if they were recorded.
+        """
+
+        self.file_path = file_path
+        self.save_location = save_location
+        self.checksum = checksum
+        self.checksum_matched = checksum_matched
+        self.error = error
+        self.skipped = skipped
+        self.unchanged = unchanged
+        self.cached = cached
+        self.coalesced = coalesced
+        self.metrics = metrics
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"DownloadResult(file_path={self.file_path!r}, save_location={self.save_location!r}, " \
+               f"checksum={self.checksum!r}, error={self.error!r}, skipped={self.skipped!r}, " \
+               f"unchanged={self.unchanged!r}, cached={self.cached!r}, coalesced={self.coalesced!r})"
+
+
+class DownloadEngine:
+    """
+    Downloads files from iRobot using a bounded pool of worker threads that share one Requester (and therefore one
+    connection pool).  Files are pulled lazily from the iterable given to download, so only a handful of them are
+    queued at any time.
+
+    Files larger than the segment size can be split into byte ranges that are fetched concurrently, by a second pool
+    of threads sized so that the read buffers of all the ranges in flight fit within the memory budget.
+
+    Data is written to a part file with a sidecar state file (see resume_handler) and only moved to its save location
+    once complete, so a download interrupted by the process being stopped is continued by the next run.
+
+    A file whose checksum does not match its ETag is checked range by range against iRobot's checksums of its chunks,
+    and only the corrupt ranges are downloaded again.
+
+    With a download cache, a file whose data is already cached (by this or another run) is requested conditionally on
+    its cached ETag and copied from the cache rather than downloaded again.
+
+    With a lock directory, each file is downloaded while holding a lock on its iRobot path, so processes on the same
+    host asking for the same file at the same time download it once: the others wait, then reuse the result.
+
+    With a concurrency limiter shared with the Requester, only as many workers download at a time as the limiter
+    allows: more while requests succeed, fewer when iRobot reports it is overloaded.
+
+    With a metrics recorder (usually shared with the Requester), the bytes, transfer time, hashing time and time parked
+    of each file are recorded, and its metrics written once its result is known.
+
+    Without a lock directory, a file whose save location is already being downloaded (the same path listed twice, say)
+    is held back until that download finishes, as both would write the same part file.
+
+    Workers never sleep on a 202 response.  The file is instead parked in a priority queue keyed by its iRobot-ETA
+    (plus the ETA margin) and requested again once that time has passed, while the workers carry on downloading files
+    that are ready.
+
+    Public methods:
+    download - download every file and yield a DownloadResult for each as it completes.
+    """
+
+    def __init__(self, request_handler: Requester, output_dir: str, jobs=DEFAULT_JOBS, log=None, skip_existing=False,
+                 segments=1, segment_size=DEFAULT_SEGMENT_SIZE, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 chunk_size=DEFAULT_CHUNK_SIZE, checksum_index=None, cache=None, lock_dir=None, limiter=None,
+                 metrics=None):
+        """
+        Instantiate an engine that writes into the output directory.
+
+        :param request_handler: the Requester used to send every request.
+        :param output_dir: the directory (with trailing slash) that the files are saved in.
+        :param jobs: the maximum number of files downloaded at the same time; the size of the pool of workers.
+        :param log: the error logger.
+        :param skip_existing: do not request files whose name already exists in the output directory.
+        :param segments: the maximum number of byte ranges of one file downloaded at the same time; 1 downloads every
+        file as a single stream.
+        :param segment_size: the size in bytes of each byte range.
+        :param memory_budget: the upper limit in bytes on the read buffers of all the byte ranges in flight.
+        :param chunk_size: the size in bytes of the buffer each download reads into.
+        :param checksum_index: a ChecksumIndex of the files in the output directory.  If given, files already there are
+        requested conditionally on their ETag and not downloaded again if iRobot confirms they are unchanged.
+        :param cache: a DownloadCache that downloaded files are added to and, where iRobot confirms the cached data is
+        current, copied from.
+        :param lock_dir: the directory of the locks (see lock_handler) that coalesce downloads of the same file; if not
+        given, files are downloaded without locking.
+        :param limiter: a ConcurrencyLimiter that adapts how many of the workers download at the same time to how
+        loaded iRobot is; if not given, all of them do.
+        :param metrics: a MetricsRecorder that the performance of every file is recorded in.
+        """
+
+        self._request_handler = request_handler
+        self._output_dir = output_dir
+        self._jobs = jobs
+        self._log = log if log else logging.getLogger(__name__)
+        self._skip_existing = skip_existing
+        self._segments = segments
+        self._segment_size = segment_size
+        self._chunk_size = chunk_size
+        self._checksum_index = checksum_index
+        self._cache = cache
+        self._lock_dir = lock_dir
+        self._limiter = limiter if limiter else ConcurrencyLimiter(jobs)
+        self._metrics = metrics
+        self._segment_workers = max(1, min(jobs * segments, memory_budget // chunk_size))
+        self._segment_executor = None
+
+    def _save_location(self, file_path: str) -> str:
+        # Where a file is saved: its name in the output directory.
+
+        return self._output_dir + path.basename(file_path)
+
+    def _download_file(self, file_path: str) -> DownloadResult:
+        # Download a single file, holding its lock if downloads are coalesced.  If another process held the lock and
+        # downloaded the file in the meantime, its result is reused.  Errors are returned in the result rather than
+        # raised so the caller can decide which of them are fatal.
+
+        save_location = self._save_location(file_path)
+
+        if self._skip_existing and path.exists(save_location):
+            return DownloadResult(file_path, save_location, skipped=True)
+
+        if not self._lock_dir:
+            return self._fetch_file(file_path, save_location)
+
+        lock = DownloadLock(self._lock_dir, file_path, self._request_handler.url)
+
+        try:
+            with trace_handler.span("lock"):
+                waited = lock.acquire()
+
+            shared_result = lock.shared_result() if waited else None
+            result = self._coalesced_result(file_path, save_location, *shared_result) if shared_result else None
+
+            if result:
+                return result
+
+            result = self._fetch_file(file_path, save_location)
+
+            if result.checksum_matched:
+                lock.publish(result.save_location, result.checksum)
+        except Exception as err:
+            return DownloadResult(file_path, error=err)
+        finally:
+            lock.release()
+
+        return result
+
+    def _coalesced_result(self, file_path: str, save_location: str, shared_location: str, checksum: str) \
+            -> DownloadResult:
+        # The result of a file downloaded by another process while this one waited for it, copied into place if it was
+        # downloaded to another directory.  A copy is read back and must match the published checksum, as the file it
+        # was copied from is not this process's to trust.  If it cannot be copied, or does not match, None is returned
+        # and the file is downloaded instead.
+
+        if path.abspath(save_location) != shared_location:
+            try:
+                reflink_or_copy(shared_location, save_location)
+            except OSError as err:
+                progress_log.warning(f"WARNING: Could not copy {shared_location}, downloaded by another process; "
+                                     f"downloading {file_path} instead.")
+                self._log.exception(err)
+                return None
+
+            if calculate_file_checksum(save_location) != checksum:
+                progress_log.warning(f"WARNING: {shared_location}, downloaded by another process, has changed since; "
+                                     f"downloading {file_path} instead.")
+                return None
+
+        if self._checksum_index:
+            self._checksum_index.record(save_location, checksum)
+
+        return DownloadResult(file_path, save_location, checksum, True, coalesced=True)
+
+    def _fetch_file(self, file_path: str, save_location: str) -> DownloadResult:
+        # Request, download and validate a single file once the concurrency limiter has a slot for it.
+
+        with trace_handler.span("file", file_path=file_path), self._limiter.slot():
+            return self._transfer_file(file_path, save_location)
+
+    def _transfer_file(self, file_path: str, save_location: str) -> DownloadResult:
+        # Request, download and validate a single file.
+
+        try:
+            known_etag = self._checksum_index.get_etag(save_location) if self._checksum_index else None
+            cached_etag = self._cache.get_etag(file_path) if self._cache and not known_etag else None
+            partial = PartialDownload(save_location)
+            response = self._request_data(file_path, partial, known_etag or cached_etag)
+
+            if response.status_code == ResponseCodes['CLIENT_MATCHED']:
+                if known_etag:
+                    return DownloadResult(file_path, save_location, known_etag, True, unchanged=True)
+
+                if self._materialize(cached_etag, save_location):
+                    return self._cached_result(file_path, save_location, cached_etag)
+
+                # Evicted from the cache since it was looked up.
+                response = self._request_data(file_path, partial)
+
+            etag = response.headers.get(response_headers['CHECKSUM'])
+
+            # The same data may have been cached under another path.
+            if self._cache and etag and self._materialize(etag, save_location):
+                response.close()
+                return self._cached_result(file_path, save_location, etag)
+
+            file_size = int(response.headers.get(response_headers['CONTENT_LENGTH'], 0))
+            record = functools.partial(self._metrics.add, file_path) if self._metrics else None
+            transfer_start = time.monotonic()
+
+            if response.status_code == ResponseCodes['RANGED_DATA']:
+                progress_log.info(f"Resuming {file_path} from byte {partial.committed}.")
+                checksum = _download_data(response, partial.location, partial, self._chunk_size, record)
+
+            elif self._segment_executor and file_size > self._segment_size:
+                if not (partial.resumable and (partial.etag, partial.size, partial.segment_size) ==
+                        (etag, file_size, self._segment_size)):
+                    partial.start(etag, file_size, self._segment_size)
+                elif partial.completed_segments:
+                    progress_log.info(f"Resuming {file_path} with {len(partial.completed_segments)} byte ranges "
+                                      f"complete.")
+
+                if record:
+                    record("bytes", file_size - sum(min(self._segment_size, file_size - first_byte)
+                                                    for first_byte in partial.completed_segments))
+
+                checksum = download_segments(self._request_handler, file_path, response, partial.location,
+                                             file_size, self._segment_executor, self._segments, self._segment_size,
+                                             self._chunk_size, partial.completed_segments, partial.commit_segment)
+
+            else:
+                partial.start(etag, file_size)
+                checksum = _download_data(response, partial.location, partial, self._chunk_size, record)
+
+            partial.finish()
+
+            if etag and checksum != etag:
+                with trace_handler.span("repair"):
+                    checksum = self._repair_file(file_path, save_location, checksum)
+
+            if record:
+                record("transfer_time", time.monotonic() - transfer_start)
+
+            with trace_handler.span("validate"):
+                checksum_matched = _validate_downloaded_data(response, checksum, self._log)
+
+            if checksum_matched and self._checksum_index:
+                self._checksum_index.record(save_location, checksum, etag)
+
+            if checksum_matched and self._cache:
+                self._add_to_cache(file_path, etag, save_location)
+        except Exception as err:
+            return DownloadResult(file_path, error=err)
+
+        return DownloadResult(file_path, save_location, checksum, checksum_matched)
+
+    def _repair_file(self, file_path: str, save_location: str, checksum: str) -> str:
+        # Check a file whose checksum does not match range by range against iRobot's chunk checksums and download the
+        # corrupt ranges again.  Returns the checksum of the repaired file, or the original checksum if iRobot cannot
+        # provide chunk checksums.
+
+        try:
+            chunk_checksums = self._request_handler.get_chunk_checksums(file_path)
+        except IrobotClientException as err:
+            self._log.exception(err)
+            return checksum
+
+        if not chunk_checksums:
+            return checksum
+
+        repaired_ranges = repair_ranges(self._request_handler, file_path, save_location, chunk_checksums,
+                                        self._segments * self._jobs, self._chunk_size)
+        progress_log.warning(f"WARNING: Checksum of {file_path} did not match; downloaded {len(repaired_ranges)} of "
+                             f"its {len(chunk_checksums)} ranges again.")
+
+        if self._metrics:
+            self._metrics.add(file_path, "bytes", sum(last_byte - first_byte + 1
+                                                      for first_byte, last_byte in repaired_ranges))
+
+        return calculate_file_checksum(save_location)
+
+    def _cached_result(self, file_path: str, save_location: str, etag: str) -> DownloadResult:
+        # The result of a file copied from the download cache, which is recorded in the checksum index as if it had
+        # been downloaded.
+
+        if self._checksum_index:
+            self._checksum_index.record(save_location, etag)
+
+        return DownloadResult(file_path, save_location, etag, True, cached=True)
+
+    def _materialize(self, etag: str, save_location: str) -> bool:
+        # Put a copy of cached data at the save location.  A copy that cannot be made (between file systems that cannot
+        # share its data, say) is treated as a cache miss: the file is downloaded instead, so the error is only logged.
+
+        try:
+            return self._cache.materialize(etag, save_location)
+        except (OSError, sqlite3.Error) as err:
+            progress_log.warning(f"WARNING: Could not copy {save_location} from the download cache; downloading it "
+                                 f"instead.")
+            self._log.exception(err)
+            return False
+
+    def _add_to_cache(self, file_path: str, etag: str, save_location: str):
+        # A file that cannot be added to the cache (a full disk, say) has still been downloaded, so the error is only
+        # logged.
+
+        try:
+            self._cache.add(file_path, etag, save_location)
+        except (OSError, sqlite3.Error) as err:
+            progress_log.warning(f"WARNING: Could not add {save_location} to the download cache.")
+            self._log.exception(err)
+
+    def _request_data(self, file_path: str, partial: PartialDownload, known_etag=None) -> Response:
+        # Request the data.  A file already downloaded is requested conditionally on its ETag, so iRobot answers 304 if
+        # it is unchanged.  If an interrupted single stream download left data behind, only the rest of it is
+        # requested, as long as its ETag shows the data has not changed since; otherwise the whole file is requested.
+
+        if known_etag:
+            return self._request_handler.get_data(file_path, wait_for_data=False, etag=known_etag)
+
+        if partial.resumable and partial.segment_size is None:
+            try:
+                response = self._request_handler.get_data(file_path, wait_for_data=False,
+                                                          byte_range=(partial.committed, None))
+            except IrobotClientException as err:
+                if err.errno != ResponseCodes['INVALID_RANGE']:
+                    raise
+            else:
+                if response.status_code == ResponseCodes['SUCCESS']:
+                    return response
+
+                if response.headers.get(response_headers['CHECKSUM']) == partial.etag and \
+                        get_content_range_start(response) == partial.committed:
+                    return response
+
+                response.close()
+
+        return self._request_handler.get_data(file_path, wait_for_data=False)
+
+    def _park(self, parked: list, file_path: str, polls: int, delay: int, sequence) -> bool:
+        # Put a file that is being fetched by iRobot in the queue of parked files, ordered by when it should be ready.
+        # Returns False if the file has already been polled too many times.
+
+        if polls >= REQUEST_LIMIT:
+            return False
+
+        ready_time = time.monotonic() + max(delay, MINIMUM_POLL_DELAY)
+        heapq.heappush(parked, (ready_time, next(sequence), file_path, polls))
+
+        if self._metrics:
+            self._metrics.add(file_path, "fetch_wait", max(delay, MINIMUM_POLL_DELAY))
+        progress_log.info(f"iRobot is fetching {file_path}; requesting it again in {max(delay, MINIMUM_POLL_DELAY)} "
+                          f"seconds.")
+
+        return True
+
+    def download(self, file_paths):
+        """
+        Download the files concurrently, yielding each result as soon as its download finishes; the order of the
+        results is therefore not the order of the file paths.  Closing the generator early cancels any files that
+        have not been started and waits for those in progress.
+
+        :param file_paths: an iterable of the full paths of the files to be downloaded.
+        :return: a generator of DownloadResult objects.
+        """
+
+        file_paths = iter(file_paths)
+        queue_size = self._jobs * QUEUED_FILES_PER_JOB
+        sequence = itertools.count()
+        # Maps each submitted future to its file path and the number of times that file has been requested.
+        pending = {}
+        # A heap of (ready time, sequence, file path, polls) for the files iRobot is still fetching.
+        parked = []
+        # Without locks, maps the save location of each file in progress (or parked) to the files held back until it
+        # finishes.  Held back files count towards the queue, so a manifest of duplicates is not read into memory.
+        in_progress = {}
+        held_back = 0
+
+        def submit(file_path: str):
+            nonlocal held_back
+
+            if not self._lock_dir:
+                save_location = self._save_location(file_path)
+                if save_location in in_progress:
+                    in_progress[save_location].append(file_path)
+                    held_back += 1
+                    return
+                in_progress[save_location] = deque()
+
+            pending[executor.submit(self._download_file, file_path)] = (file_path, 1)
+
+        def release(file_path: str):
+            # Start the next file held back for the save location of a file whose result is final.
+            nonlocal held_back
+
+            if not self._lock_dir:
+                waiting = in_progress.pop(self._save_location(file_path))
+                if waiting:
+                    held_back -= 1
+                    submit(waiting.popleft())
+                    in_progress[self._save_location(file_path)].extend(waiting)
+
+        # The segment pool is entered first so that it outlives every file worker that may still submit ranges to it.
+        with ExitStack() as stack, ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            if self._segments > 1:
+                self._segment_executor = stack.enter_context(ThreadPoolExecutor(max_workers=self._segment_workers))
+
+            try:
+                while True:
+                    while parked and parked[0][0] <= time.monotonic():
+                        _, _, file_path, polls = heapq.heappop(parked)
+                        pending[executor.submit(self._download_file, file_path)] = (file_path, polls + 1)
+
+                    if len(parked) < MAX_PARKED_FILES:
+                        for file_path in itertools.islice(file_paths,
+                                                          max(0, queue_size - len(pending) - held_back)):
+                            submit(file_path)
+
+                    if not pending and not parked:
+                        return
+
+                    timeout = max(0, parked[0][0] - time.monotonic()) if parked else None
+                    done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                    # Results that complete together are handled in the order their files were submitted.
+                    for future in [future for future in pending if future in done]:
+                        file_path, polls = pending.pop(future)
+                        result = future.result()
+
+                        if isinstance(result.error, DataNotReadyException):
+                            if self._park(parked, file_path, polls, result.error.delay, sequence):
+                                continue
+
+                            result.error = IrobotClientException(errno.ECONNABORTED,
+                                                                 "ERROR: Maximum number of request retries.  This "
+                                                                 "could be because of a large file being fetch.  "
+                                                                 "Please try again later.")
+                        release(file_path)
+                        if self._metrics:
+                            result.metrics = self._metrics.finish(result)
+                        yield result
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class PrefetchResult:
+    """
+    The outcome of asking iRobot to prefetch a single file: either the delay until the file should be ready or the
+    error returned by iRobot.
+    """
+
+    def __init__(self, file_path: str, delay=0, error=None):
+        """
+        Instantiate a result for one prefetched file.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        :param delay: the number of seconds until iRobot expects to have the file in its precache.
+        :param error: the exception raised while asking for the file.
+        """
+
+        self.file_path = file_path
+        self.delay = delay
+        self.error = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"PrefetchResult(file_path={self.file_path!r}, delay={self.delay!r}, error={self.error!r})"
+
+
+def prefetch_files(request_handler: Requester, file_paths, jobs=DEFAULT_JOBS, window=PREFETCH_WINDOW):
+    """
+    Ask iRobot to start staging every file into its precache before any of them are downloaded, so that iRobot's
+    fetching from iRODS overlaps the downloads.  The files are taken a window at a time; each window is prefetched
+    concurrently and its results are yielded in ETA order, soonest first, so downloading them in that order waits the
+    least.
+
+    :param request_handler: the Requester used to send every request.
+    :param file_paths: an iterable of the full paths of the files to be prefetched.
+    :param jobs: the maximum number of prefetch requests sent at the same time.
+    :param window: the maximum number of files prefetched, and held in memory, at a time.
+    :return: a generator of PrefetchResult objects.
+    """
+
+    def prefetch(file_path: str) -> PrefetchResult:
+        try:
+            return PrefetchResult(file_path, request_handler.prefetch(file_path))
+        except Exception as err:
+            return PrefetchResult(file_path, error=err)
+
+    file_paths = iter(file_paths)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            results = list(executor.map(prefetch, itertools.islice(file_paths, window)))
+            if not results:
+                return
+
+            yield from sorted(results, key=lambda result: result.delay)
+
+
+def stream_file(request_handler: Requester, file_path: str, sink, chunk_size=DEFAULT_CHUNK_SIZE, log=None) \
+        -> DownloadResult:
+    """
+    Pass the data of a file through to a stream (the standard output or a named pipe) as it arrives, calculating its
+    checksum on the way, so that a downstream tool can read it without it being written to disk and read back.  The
+    data is requested as a single stream, waiting for iRobot if it is still fetching the file; nothing is kept, so a
+    stream that is interrupted or corrupt cannot be resumed or repaired, only reported at the end.
+
+    :param request_handler: the Requester used to send the request.
+    :param file_path: the full path of the file requested.
+    :param sink: an unbuffered binary file object the data is written to; it is not closed.
+    :param chunk_size: the size in bytes of the buffer the data is read into.
+    :param log: the error logger.
+    :return: the DownloadResult of the file, without a save location; checksum_matched is False if the data streamed
+    does not match iRobot's checksum.
+    """
+
+    log = log if log else logging.getLogger(__name__)
+
+    try:
+        with trace_handler.span("file", file_path=file_path):
+            response = request_handler.get_data(file_path)
+            hasher = hashlib.md5()
+            _copy_data(response, sink, hasher, chunk_size)
+            checksum = hasher.hexdigest()
+
+            with trace_handler.span("validate"):
+                checksum_matched = _validate_downloaded_data(response, checksum, log)
+    except Exception as err:
+        return DownloadResult(file_path, error=err)
+
+    return DownloadResult(file_path, checksum=checksum, checksum_matched=checksum_matched)
@@ -0,0 +1,182 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""endpoint_handler.py - spread requests over several iRobot instances and fail over between them."""
+import threading
+import time
+
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# Weight of the latest response time in each endpoint's moving average of its latency.
+LATENCY_SMOOTHING = 0.3
+
+# Seconds an endpoint is avoided after a failure, doubling with each failure in a row up to the maximum.
+UNHEALTHY_BASE_DELAY = 1
+UNHEALTHY_MAX_DELAY = 60
+
+# Maximum number of files whose endpoint is remembered.
+MAX_PINNED_FILES = 10000
+
+
+def split_urls(urls: str) -> list:
+    """
+    Split a comma separated list of iRobot urls.
+
+    :param urls: the urls, separated by commas.
+    :return: a list of the urls, each with a trailing slash.
+    """
+
+    return [url if url.endswith('/') else url + '/' for url in (url.strip() for url in urls.split(',')) if url]
+
+
+class Endpoint:
+    """
+    One iRobot instance and what is known of its health.
+
+    Attributes:
+    url - the base url of the instance, with a trailing slash.
+    host - the host (and port) of the instance.
+    outstanding - the number of requests sent to it that have not had a response yet.
+    latency - the moving average of its response times in seconds; zero until it has responded.
+    failures - the number of requests in a row that failed to connect or found it overloaded.
+    unhealthy_until - the monotonic time until which it is avoided.
+    """
+
+    def __init__(self, url: str):
+        """
+        :param url: the base url of the instance, with a trailing slash.
+        """
+
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.outstanding = 0
+        self.latency = 0.0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def __repr__(self):
+        return f"Endpoint(url={self.url!r}, outstanding={self.outstanding!r}, latency={self.latency!r}, " \
+               f"failures={self.failures!r})"
+
+
+class EndpointPool:
+    """
+    Several iRobot instances sharing an iRODS zone, and the choice between them.  Each request goes to the healthy
+    instance with the lowest expected wait: its latency weighted by the requests already outstanding on it, so an
+    instance that has not responded yet is tried first, a busy one is given fewer requests and a slow one fewer still.
+
+    Each instance fetches data into its own precache, so a file that an instance has served, is fetching or was asked
+    to prefetch is pinned to it: later requests for that file (polls after a 202, byte ranges, checksums) go to the
+    same instance while it stays healthy, rather than starting another fetch elsewhere.
+
+    An instance that fails to connect or reports it is overloaded is avoided for a time that doubles with each failure
+    in a row, and tried again once it has passed; the first response it then sends marks it healthy.  If every
+    instance is being avoided, the one that has been avoided longest is chosen.  A pool may be shared between threads.
+
+    Public methods:
+    select - choose the instance for a request.
+    succeeded - record an instance's response.
+    failed - record an instance's failure.
+    has_healthy - whether any instance is not being avoided.
+    """
+
+    def __init__(self, urls: list):
+        """
+        Instantiate a pool of instances, all assumed healthy.
+
+        :param urls: the base urls of the instances, each with a trailing slash.
+        """
+
+        self.endpoints = [Endpoint(url) for url in urls]
+        self._lock = threading.Lock()
+        # Maps each pinned file path to its endpoint, least recently used first.
+        self._pinned = OrderedDict()
+
+    def select(self, file_path: str) -> Endpoint:
+        """
+        Choose the instance to send a request for the file to, counting the request as outstanding on it until its
+        response or failure is recorded.
+
+        :param file_path: the path of the file requested, without a base url.
+        :return: the chosen Endpoint.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.unhealthy_until <= now]
+            pinned = self._pinned.get(file_path)
+
+            if pinned in healthy:
+                endpoint = pinned
+            elif healthy:
+                endpoint = min(healthy, key=lambda endpoint: (endpoint.latency * (endpoint.outstanding + 1),
+                                                              endpoint.outstanding))
+            else:
+                endpoint = min(self.endpoints, key=lambda endpoint: endpoint.unhealthy_until)
+
+            endpoint.outstanding += 1
+
+            return endpoint
+
+    def succeeded(self, endpoint: Endpoint, latency=None, file_path=None):
+        """
+        Record a response from an instance, marking it healthy.
+
+        :param endpoint: the Endpoint the request was sent to.
+        :param latency: the seconds until the response headers arrived; None if the response says nothing of how
+        loaded the instance is (a rejected credential, say), so that it is not counted in its latency.
+        :param file_path: the path of a file the instance now has, or is fetching, in its precache; it is pinned to
+        the instance.
+        """
+
+        with self._lock:
+            endpoint.outstanding -= 1
+            if latency is not None:
+                endpoint.latency = latency if not endpoint.latency else \
+                    LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * endpoint.latency
+            endpoint.failures = 0
+            endpoint.unhealthy_until = 0.0
+
+            if file_path is not None:
+                self._pinned[file_path] = endpoint
+                self._pinned.move_to_end(file_path)
+                if len(self._pinned) > MAX_PINNED_FILES:
+                    self._pinned.popitem(last=False)
+
+    def failed(self, endpoint: Endpoint):
+        """
+        Record that a request to an instance failed to connect or found it overloaded, avoiding it for a time.
+
+        :param endpoint: the Endpoint the request was sent to.
+        """
+
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.failures += 1
+            endpoint.unhealthy_until = time.monotonic() + \
+                min(UNHEALTHY_MAX_DELAY, UNHEALTHY_BASE_DELAY * 2 ** (endpoint.failures - 1))
+
+    def has_healthy(self) -> bool:
+        """
+        Whether any instance is not being avoided, so that a failed request can be sent there at once.
+
+        :return: True if there is a healthy instance.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            return any(endpoint.unhealthy_until <= now for endpoint in self.endpoints)
@@ -15,26 +15,27 @@ You should have received a copy of the GNU General Public License along
 with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 """entrypoint.py - the entry point of the program."""
-import logging
-import hashlib
 import errno
+import logging
+import sys
 
-from logging.handlers import RotatingFileHandler
 from os import path
-from requests import Response
+
+from logging.handlers import RotatingFileHandler
 
 from irobotclient import configuration_handler
 from irobotclient import request_formatter
+from irobotclient import trace_handler
+from irobotclient.client_handler import IrobotClient
 from irobotclient.custom_exceptions import IrobotClientException
-from irobotclient.request_handler import Requester, ResponseCodes
-from irobotclient.response_handler import response_headers
+from irobotclient.daemon_handler import DaemonClient, get_default_socket, is_listening, is_trusted
+from irobotclient.download_handler import PROGRESS_LOGGER
+from irobotclient.request_handler import ResponseCodes
+from irobotclient.stream_handler import STDOUT_SINK, is_stream_sink, open_stream_sink
 
 # Error log
 ERROR_LOG_FILE = "irobot_client_error.log"
 
-# Limit for the size (in bytes) of data downloaded at a time.
-CHUNK_SIZE = 1024
-
 
 def _set_error_logger(file_name: str) -> logging.Logger:
     # Set up the logger for writing exceptions to file_name.
@@ -51,6 +52,17 @@ def _set_error_logger(file_name: str) -> logging.Logger:
     return logger
 
 
+def _set_progress_logger():
+    # Print the progress messages of the downloads along with the program's own.  Called once the standard output is
+    # known, as it is redirected while streaming.
+
+    logger = logging.getLogger(PROGRESS_LOGGER)
+    logger.setLevel(logging.INFO)
+
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stdout))
+
+
 def _handle_error_details(error: Exception, log: logging.Logger):
     # Log the exception to file and exit with a non-zero code.
 
@@ -63,63 +75,85 @@ def _handle_error_details(error: Exception, log: logging.Logger):
     exit(1)
 
 
-def _download_data(response: Response, save_location: str) -> str:
-    # Downloads data to a file in the the output directory in iterable chunks.  Calculated checksum as it goes and
-    # returns the hex string.
+def _run(client: IrobotClient, file_list, log=None, skip_existing=False):
+    # Call the core functionality of the program; sending the requests and downloading the responses concurrently.
+    # The file list may be a lazily evaluated iterable, so only a count of the failures is kept.
 
-    hasher = hashlib.md5()
+    failed_files = 0
 
-    with open(save_location, "wb") as file:
-        for data_chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            if data_chunk:
-                file.write(bytes(data_chunk))
-                hasher.update(bytes(data_chunk))
+    for result in client.iter_download(file_list, skip_existing):
+        if result.skipped:
+            print(f"WARNING: {result.save_location} already exists; use the --force option to overwrite.")
+            continue
 
-    return hasher.hexdigest()
+        if result.unchanged:
+            print(f"{result.save_location} is unchanged; not downloaded again.")
+            continue
 
+        if result.succeeded:
+            continue
 
-def _validate_downloaded_data(response: Response, calculated_checksum: str, log=None):
-    # Check that the response checksum tag matches the file checksum.
+        if isinstance(result.error, IrobotClientException) and result.error.errno == ResponseCodes['NOT_FOUND']:
+            log.exception(result.error)
+            print(f"WARNING: Could not find {result.file_path}.")
+            failed_files += 1
+        else:
+            raise result.error
 
-    try:
-        checksum = response.headers[response_headers['CHECKSUM']]
-    except KeyError as err:
-        print(f"WARNING: Could not obtain a checksum from the response {response_headers['CHECKSUM']} header.")
-        log.exception(err)
-        return
+    if failed_files:
+        print("WARNING: Not all files were downloaded.  Please check irobot_client_error.log for more details")
 
-    if not calculated_checksum == checksum:
-        print(f"WARNING: Checksum of response and downloaded file do not match. Data may be corrupt or missing.")
-        log.exception(IrobotClientException(errno.ECONNABORTED, "ERROR: The checksum of the downloaded file does not "
-                                                                "match the checksum expected.  The file may be "
-                                                                "corrupt or missing data.  Please try again."))
+    print("Exiting....")
 
 
-def _run(request_handler: Requester, output_dir: str, file_list: list, log=None):
-    # Call the core functionality of the program; sending the request and getting the response
+def _stream(client: IrobotClient, file_path: str, output: str):
+    # Stream a single file to the standard output or a named pipe, failing once it has all been passed through if its
+    # checksum does not match.
 
-    all_files_downloaded = True
+    with open_stream_sink(output) as sink:
+        result = client.stream(file_path, sink)
 
-    for file in file_list:
-        try:
-            response = request_handler.get_data(file)
-        except IrobotClientException as err:
-            if err.errno == ResponseCodes['NOT_FOUND']:
-                log.exception(IrobotClientException)
-                print(f"WARNING: Could not find {file}.")
-                all_files_downloaded = False
-                continue
-            else:
-                raise
+    if not result.succeeded:
+        raise result.error
 
-        full_file_path = output_dir + (path.split(response.url))[1]
-        checksum = _download_data(response, full_file_path)
-        _validate_downloaded_data(response, checksum, log)
+    if not result.checksum_matched:
+        raise IrobotClientException(errno.EIO, f"ERROR: The checksum of the data streamed from {file_path} does not "
+                                               f"match the checksum expected.  It may be corrupt or missing data.")
 
-    if not all_files_downloaded:
-        print("WARNING: Not all files were downloaded.  Please check irobot_client_error.log for more details")
 
-    print("Exiting....")
+def _prefetch(client: IrobotClient, file_list, log=None):
+    # Ask iRobot to stage all the files into its precache without downloading them.
+
+    failed_files = 0
+    latest_delay = 0
+
+    for result in client.prefetch(file_list):
+        if result.succeeded:
+            latest_delay = max(latest_delay, result.delay)
+            continue
+
+        if isinstance(result.error, IrobotClientException) and result.error.errno == ResponseCodes['NOT_FOUND']:
+            log.exception(result.error)
+            print(f"WARNING: Could not find {result.file_path}.")
+            failed_files += 1
+        else:
+            raise result.error
+
+    if failed_files:
+        print("WARNING: Not all files were prefetched.  Please check irobot_client_error.log for more details")
+
+    print(f"All files should be ready to download in {latest_delay} seconds.\nExiting....")
+
+
+def _preflight(client: IrobotClient, output_dir: str, file_list):
+    # Yield the files in the order planned from their metadata, leaving out those that are already downloaded.
+
+    for result in client.preflight(file_list):
+        if result.unchanged:
+            print(f"{output_dir + path.basename(result.file_path)} is unchanged; not downloaded again.")
+            continue
+
+        yield result.file_path
 
 
 def main():
@@ -129,16 +163,92 @@ def main():
     log = _set_error_logger(ERROR_LOG_FILE)
 
     try:
+        configuration_start = trace_handler.now()
         config_details = configuration_handler.run()
 
-        authentication_credentials = request_formatter.get_authentication_strings(config_details.arvados_token,
-                                                                                  config_details.basic_username,
-                                                                                  config_details.basic_password)
-        headers = request_formatter.get_headers(authentication_credentials.pop(0))
-        file_list = request_formatter.get_file_list(config_details.input_file, config_details.no_index)
+        if config_details.trace:
+            trace_handler.start(config_details.trace)
+            trace_handler.record("configuration", configuration_start)
+
+        streaming = is_stream_sink(config_details.output_dir)
+        if config_details.output_dir == STDOUT_SINK:
+            # Messages must not be mixed into the data.
+            sys.stdout = sys.stderr
+        _set_progress_logger()
 
-        _run(Requester(headers, config_details.url, authentication_credentials),
-             config_details.output_dir, file_list, log)
+        if config_details.manifest:
+            manifest = sys.stdin if config_details.manifest == '-' else open(config_details.manifest)
+            file_list = request_formatter.get_manifest_file_list(manifest, config_details.no_index,
+                                                                 bool(config_details.url))
+        else:
+            manifest = None
+            file_list = request_formatter.get_file_list(config_details.input_file, config_details.no_index)
+
+        try:
+            options = dict(url=config_details.url,
+                           output_dir=config_details.output_dir,
+                           arvados_token=config_details.arvados_token,
+                           basic_username=config_details.basic_username,
+                           basic_password=config_details.basic_password,
+                           jobs=config_details.jobs,
+                           max_jobs=config_details.max_jobs,
+                           pool_connections=config_details.pool_connections,
+                           pool_maxsize=config_details.pool_maxsize,
+                           keep_alive=not config_details.no_keep_alive,
+                           segments=config_details.segments,
+                           segment_size=config_details.segment_size,
+                           memory_budget=config_details.memory_budget,
+                           chunk_size=config_details.chunk_size,
+                           skip_unchanged=config_details.skip_unchanged and not streaming,
+                           index_file=config_details.index_file,
+                           cache_dir=None if config_details.prefetch_only or streaming else config_details.cache_dir,
+                           cache_size=config_details.cache_size,
+                           coalesce=not config_details.no_coalesce,
+                           auth_cache=config_details.auth_cache,
+                           auth_cache_ttl=config_details.auth_cache_ttl,
+                           metrics=config_details.metrics,
+                           metrics_textfile=config_details.metrics_textfile,
+                           max_bandwidth=config_details.max_bandwidth,
+                           max_file_bandwidth=config_details.max_file_bandwidth)
+
+            # A stream has to be written by this process, and a trace is of this process, so neither is handed to
+            # the daemon.  Nor are the credentials handed to a daemon that is not this user's.
+            daemon_socket = config_details.daemon_socket or get_default_socket()
+            use_daemon = not (streaming or config_details.trace or config_details.no_daemon) and \
+                is_listening(daemon_socket)
+            if use_daemon and not is_trusted(daemon_socket):
+                print(f"WARNING: The daemon socket {daemon_socket} is not private to this user; running in this "
+                      f"process.")
+                log.error(f"The daemon socket {daemon_socket} is not private to this user.")
+                use_daemon = False
+
+            if use_daemon:
+                client = DaemonClient(daemon_socket, **options)
+            else:
+                client = IrobotClient(**options, log=log)
+
+            with client:
+                if streaming:
+                    _stream(client, config_details.input_file, config_details.output_dir)
+                    return
+
+                if config_details.prefetch_only:
+                    _prefetch(client, file_list, log)
+                    return
+
+                if config_details.preflight:
+                    file_list = _preflight(client, config_details.output_dir, file_list)
+
+                if config_details.prefetch:
+                    file_list = (result.file_path for result in client.prefetch(file_list))
+
+                # Files named in a manifest are not checked up front, so existing ones are skipped as they come.
+                _run(client, file_list, log,
+                     skip_existing=bool(manifest) and not (config_details.force or config_details.skip_unchanged))
+        finally:
+            if manifest and manifest is not sys.stdin:
+                manifest.close()
+            trace_handler.stop()
     except IrobotClientException as err:
         _handle_error_details(err, log)
     except OSError as err:
@@ -0,0 +1,119 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""index_handler.py - a persistent local index of the checksums of files that have been downloaded."""
+import os
+import sqlite3
+import threading
+
+from irobotclient.segment_handler import calculate_file_checksum
+
+# Name of the index database when it is kept in the output directory.
+INDEX_FILE_NAME = ".irobotclient_index.sqlite"
+
+
+class ChecksumIndex:
+    """
+    An SQLite database mapping each downloaded file to its size, modification time, MD5 and the ETag iRobot gave it.
+
+    An entry is only trusted while the file's size and modification time are unchanged, so the ETag of a file that is
+    still as it was downloaded can be sent in an If-None-Match header without reading the file again.  The index may be
+    shared between threads.
+
+    Public methods:
+    get_etag - return the ETag of a file on disk, if it is still as it was downloaded.
+    record - add or replace the entry of a downloaded file.
+    close - close the database.
+    """
+
+    def __init__(self, index_location: str):
+        """
+        Open (creating if necessary) the index database.
+
+        :param index_location: the path of the database file.
+        """
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(index_location, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                                     "path TEXT PRIMARY KEY, "
+                                     "size INTEGER NOT NULL, "
+                                     "mtime_ns INTEGER NOT NULL, "
+                                     "md5 TEXT NOT NULL, "
+                                     "etag TEXT)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_etag(self, save_location: str, rehash_unknown=True):
+        """
+        Return the ETag to send in an If-None-Match header for a file already on disk.
+
+        :param save_location: the path of the file.
+        :param rehash_unknown: if the file has no trustworthy entry, hash it, record it, and return its MD5 (which is
+        what iRobot uses as an ETag).
+        :return: the ETag, or None if the file does not exist or cannot be vouched for.
+        """
+
+        try:
+            file_stat = os.stat(save_location)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            entry = self._connection.execute("SELECT size, mtime_ns, md5, etag FROM files WHERE path = ?",
+                                             (os.path.abspath(save_location),)).fetchone()
+
+        if entry and entry[:2] == (file_stat.st_size, file_stat.st_mtime_ns):
+            return entry[3] if entry[3] else entry[2]
+
+        if not rehash_unknown:
+            return None
+
+        checksum = calculate_file_checksum(save_location)
+        self.record(save_location, checksum)
+
+        return checksum
+
+    def record(self, save_location: str, checksum: str, etag=None):
+        """
+        Add or replace the entry of a file as it is now on disk.
+
+        :param save_location: the path of the file.
+        :param checksum: the MD5 hex digest of the file.
+        :param etag: the ETag iRobot gave the file, if it differs from the checksum.
+        """
+
+        file_stat = os.stat(save_location)
+
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, md5, etag) "
+                                     "VALUES (?, ?, ?, ?, ?)",
+                                     (os.path.abspath(save_location), file_stat.st_size, file_stat.st_mtime_ns,
+                                      checksum, etag))
+
+    def close(self):
+        """
+        Close the database.
+        """
+
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,184 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""lock_handler.py - file locks that stop processes on the same host downloading the same file at the same time."""
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+
+from irobotclient.custom_exceptions import IrobotClientException
+
+# Name of the lock directory kept in the download cache, if there is one.
+CACHE_LOCK_DIR = "locks"
+
+# Number of hex digits of the MD5 of a lock's key that its lock file is named by, which bounds the lock files ever
+# created to 16 ** LOCK_NAME_DIGITS however many paths are downloaded.
+LOCK_NAME_DIGITS = 3
+
+
+def get_default_lock_dir(cache_dir=None) -> str:
+    """
+    Return the directory that download locks are kept in: inside the download cache if there is one, as that is
+    what the processes sharing it have in common; otherwise a per-user directory in the system's temporary directory.
+
+    :param cache_dir: the path of the download cache directory.
+    :return: the path of the lock directory.
+    """
+
+    if cache_dir:
+        return os.path.join(cache_dir, CACHE_LOCK_DIR)
+
+    return os.path.join(tempfile.gettempdir(), f"irobotclient-{os.getuid()}-locks")
+
+
+def _make_private_directory(directory: str):
+    # Create the lock directory, accessible only to this user, if it does not exist; one that does must already be
+    # private, or another user could plant results in its lock files or hold them to stall downloads.
+
+    os.makedirs(os.path.dirname(directory) or ".", exist_ok=True)
+
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+
+    status = os.lstat(directory)
+    if not (stat.S_ISDIR(status.st_mode) and status.st_uid == os.getuid() and not status.st_mode & 0o077):
+        raise IrobotClientException(errno.EACCES, f"The lock directory, {directory}, must be owned by this user and "
+                                                  f"accessible to no one else.")
+
+
+class DownloadLock:
+    """
+    An exclusive lock (flock) on a file named after the iRobot url and path being downloaded, held for the whole
+    download.
+    A second process (or thread) asking for the same path waits for the lock rather than downloading it again.
+
+    The holder writes the location and checksum of a download it completed and validated into the lock file, so a
+    waiter that is given the lock afterwards can reuse that file instead of downloading it.  Lock files are never
+    removed, as removing a lock file that another process is waiting on would let a third process lock a new file of
+    the same name; instead they are named by the first LOCK_NAME_DIGITS hex digits of the MD5 of the url and path, so
+    their number is bounded.  Paths sharing a lock file are downloaded one at a time, and a result is only handed to a
+    waiter for the same path.
+
+    The lock directory is created accessible only to this user, and one that is not is refused.
+
+    Public methods:
+    acquire - take the lock, waiting for another holder if necessary.
+    shared_result - return the result left by a holder this lock waited for.
+    publish - leave the result of a completed download for any waiters.
+    release - release the lock.
+    """
+
+    def __init__(self, lock_dir: str, file_path: str, url=None):
+        """
+        Instantiate a lock for one iRobot path.
+
+        :param lock_dir: the directory holding the lock files.
+        :param file_path: the path of the file as it is requested from iRobot.
+        :param url: the iRobot url the path is requested from, so that the same path on different iRobot servers is
+        locked separately; None if the path is a full url.
+        """
+
+        self._key = f"{url}\n{file_path}" if url else file_path
+        self._location = os.path.join(lock_dir, hashlib.md5(self._key.encode()).hexdigest()[:LOCK_NAME_DIGITS] +
+                                      ".lock")
+        self._lock_dir = lock_dir
+        self._file = None
+        self._wait_start = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def acquire(self) -> bool:
+        """
+        Take the lock, blocking while another process or thread holds it.
+
+        :return: True if the lock was held by someone else and had to be waited for.
+        """
+
+        _make_private_directory(self._lock_dir)
+        self._file = open(self._location, "a+")
+
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            self._wait_start = time.time()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            return True
+
+    def shared_result(self):
+        """
+        Return the result of a download completed while this lock was being waited for, if the downloaded file is
+        still as it was when the result was published.
+
+        :return: a (save location, checksum) tuple, or None if the file has to be downloaded.
+        """
+
+        if self._wait_start is None:
+            return None
+
+        try:
+            self._file.seek(0)
+            result = json.load(self._file)
+
+            if result["key"] != self._key or result["published"] < self._wait_start:
+                return None
+
+            file_stat = os.stat(result["save_location"])
+            if (file_stat.st_size, file_stat.st_mtime_ns) != (result["size"], result["mtime_ns"]):
+                return None
+
+            return result["save_location"], result["checksum"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def publish(self, save_location: str, checksum: str):
+        """
+        Leave the result of a completed and validated download in the lock file for any waiters.
+
+        :param save_location: where the file was downloaded to.
+        :param checksum: the MD5 hex digest of the file.
+        """
+
+        file_stat = os.stat(save_location)
+
+        self._file.seek(0)
+        self._file.truncate()
+        json.dump({"key": self._key, "save_location": os.path.abspath(save_location), "checksum": checksum,
+                   "size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns, "published": time.time()},
+                  self._file)
+        self._file.flush()
+
+    def release(self):
+        """
+        Release the lock.
+        """
+
+        if self._file:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
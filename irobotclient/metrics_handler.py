@@ -0,0 +1,309 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""metrics_handler.py - record per-file performance metrics and export them as JSON lines or a Prometheus textfile."""
+import json
+import os
+import random
+import threading
+import time
+
+# The counters kept for every file, all of which start at zero.
+FILE_COUNTERS = ("requests", "retries", "authentication_renegotiations", "fetch_wait", "bytes", "hash_time",
+                 "transfer_time")
+
+# The most times to first byte kept to estimate their median from; up to this many files the median is exact.
+FIRST_BYTE_SAMPLES = 1000
+
+
+class FileMetrics:
+    """
+    The performance of downloading a single file, which together tell iRobot's staging latency (time spent waiting
+    on 202 responses) apart from the network (time to first byte, throughput) and the client (time spent hashing).
+
+    Attributes:
+    requests - the number of requests sent for the file, including those for its byte ranges.
+    retries - the number of requests that had to be sent again.
+    authentication_renegotiations - the number of 401 responses that made the client switch credentials.
+    fetch_wait - the seconds waited for iRobot to fetch the file into its precache.
+    time_to_first_byte - the seconds between sending the data request and receiving the response headers.
+    bytes - the number of bytes downloaded.
+    hash_time - the seconds spent calculating the checksum while downloading a single stream.
+    transfer_time - the seconds spent downloading the data.
+    duration - the seconds from the first request for the file to its result.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Instantiate the metrics of one requested file.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        """
+
+        self.file_path = file_path
+        self.status = None
+        self.time_to_first_byte = None
+        self.duration = None
+        self._started = time.monotonic()
+
+        for counter in FILE_COUNTERS:
+            setattr(self, counter, 0)
+
+    @property
+    def throughput(self) -> float:
+        """
+        The bytes downloaded per second of transfer time.
+        """
+
+        return self.bytes / self.transfer_time if self.transfer_time else 0.0
+
+    def as_dict(self) -> dict:
+        """
+        Return the metrics as a dictionary, ready to be written as JSON.
+        """
+
+        return {"file_path": self.file_path, "status": self.status,
+                "time_to_first_byte": self.time_to_first_byte, "duration": self.duration,
+                "throughput": self.throughput, **{counter: getattr(self, counter) for counter in FILE_COUNTERS}}
+
+
+class TimedHasher:
+    """
+    Wraps a hashlib object to count the bytes it is fed and the time it spends hashing them.
+    """
+
+    def __init__(self, hasher):
+        """
+        :param hasher: the hashlib object to wrap.
+        """
+
+        self._hasher = hasher
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def update(self, data):
+        started = time.perf_counter()
+        self._hasher.update(data)
+        self.elapsed += time.perf_counter() - started
+        self.bytes += len(data)
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+
+def _get_status(result) -> str:
+    # Name the outcome of a download for the metrics.
+
+    if result.error is not None:
+        return "failed"
+
+    for status in ("skipped", "unchanged", "cached", "coalesced"):
+        if getattr(result, status):
+            return status
+
+    return "downloaded" if result.checksum_matched else "corrupt"
+
+
+class MetricsRecorder:
+    """
+    Collects the metrics of every file as it is downloaded.  Each file's metrics are written as a JSON line once its
+    result is known, followed at the end of the batch by a summary line; a Prometheus node exporter textfile of the
+    batch totals can be written as well.  A recorder may be shared between threads.
+
+    Only the files still in progress are kept, so its memory does not grow with the batch: the median time to first
+    byte is estimated from a uniform sample of FIRST_BYTE_SAMPLES of them (reservoir sampling).
+
+    Public methods:
+    add - add to a counter of a file.
+    first_byte - record a file's time to first byte.
+    finish - record the result of a file and write its metrics.
+    close - write the batch summary.
+    """
+
+    def __init__(self, json_lines_location=None, textfile_location=None):
+        """
+        Instantiate a recorder.
+
+        :param json_lines_location: the path of the file the JSON lines are appended to.
+        :param textfile_location: the path of the Prometheus textfile written at the end of the batch; it should be in
+        the node exporter's textfile directory and end in .prom.
+        """
+
+        self._json_lines_file = open(json_lines_location, "a") if json_lines_location else None
+        self._textfile_location = textfile_location
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # The metrics of the files that have not had their results yet.
+        self._files = {}
+        self._statuses = {}
+        self._totals = {counter: 0 for counter in FILE_COUNTERS}
+        self._time_to_first_byte_sum = 0.0
+        self._time_to_first_byte_count = 0
+        # A uniform sample of the times to first byte of the finished files.
+        self._time_to_first_byte_samples = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _file(self, file_path: str) -> FileMetrics:
+        # The metrics of a file, created on first use; the lock must be held.
+
+        if file_path not in self._files:
+            self._files[file_path] = FileMetrics(file_path)
+
+        return self._files[file_path]
+
+    def add(self, file_path: str, counter: str, value=1):
+        """
+        Add to one of the counters of a file.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        :param counter: the name of the counter, one of FILE_COUNTERS.
+        :param value: the amount to add.
+        """
+
+        with self._lock:
+            metrics = self._file(file_path)
+            setattr(metrics, counter, getattr(metrics, counter) + value)
+
+    def first_byte(self, file_path: str, seconds: float):
+        """
+        Record the time to first byte of a file's data request; only the first is kept.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        :param seconds: the time between sending the request and receiving the response headers.
+        """
+
+        with self._lock:
+            metrics = self._file(file_path)
+            if metrics.time_to_first_byte is None:
+                metrics.time_to_first_byte = seconds
+
+    def finish(self, result):
+        """
+        Record the result of a file, add its metrics to the batch totals and write them as a JSON line.
+
+        :param result: the DownloadResult of the file.
+        :return: the FileMetrics of the file.
+        """
+
+        with self._lock:
+            metrics = self._file(result.file_path)
+            del self._files[result.file_path]
+
+            metrics.status = _get_status(result)
+            metrics.duration = time.monotonic() - metrics._started
+
+            self._statuses[metrics.status] = self._statuses.get(metrics.status, 0) + 1
+            for counter in FILE_COUNTERS:
+                self._totals[counter] += getattr(metrics, counter)
+            if metrics.time_to_first_byte is not None:
+                self._sample_time_to_first_byte(metrics.time_to_first_byte)
+
+            self._write_json_line({"type": "file", **metrics.as_dict()})
+
+        return metrics
+
+    def _sample_time_to_first_byte(self, seconds: float):
+        # Add a file's time to first byte to the totals, and to the sample in place of a random one once it is full, so
+        # that every time is in the sample with the same probability; the lock must be held.
+
+        self._time_to_first_byte_sum += seconds
+        self._time_to_first_byte_count += 1
+
+        if len(self._time_to_first_byte_samples) < FIRST_BYTE_SAMPLES:
+            self._time_to_first_byte_samples.append(seconds)
+        else:
+            index = random.randrange(self._time_to_first_byte_count)
+            if index < FIRST_BYTE_SAMPLES:
+                self._time_to_first_byte_samples[index] = seconds
+
+    def _write_json_line(self, record: dict):
+        # Append one record to the JSON lines file, if there is one; the lock must be held.
+
+        if self._json_lines_file:
+            self._json_lines_file.write(json.dumps(record) + "\n")
+            self._json_lines_file.flush()
+
+    def summary(self) -> dict:
+        """
+        Return the totals of the batch so far.
+
+        :return: a dictionary of the batch metrics.
+        """
+
+        with self._lock:
+            duration = time.monotonic() - self._started
+            first_bytes = sorted(self._time_to_first_byte_samples)
+
+            return {"files": dict(self._statuses), "duration": duration,
+                    "throughput": self._totals["bytes"] / duration if duration else 0.0,
+                    "median_time_to_first_byte": first_bytes[len(first_bytes) // 2] if first_bytes else None,
+                    **self._totals}
+
+    def _write_textfile(self, summary: dict):
+        # Write the batch totals in the Prometheus text format, replacing the file atomically as the node exporter
+        # may read it at any time.
+
+        lines = ["# HELP irobotclient_files_total Files handled, by outcome.",
+                 "# TYPE irobotclient_files_total counter"]
+        lines += [f'irobotclient_files_total{{status="{status}"}} {count}'
+                  for status, count in sorted(summary["files"].items())]
+
+        for name, value, description in (
+                ("requests_total", summary["requests"], "Requests sent to iRobot."),
+                ("retries_total", summary["retries"], "Requests sent to iRobot again."),
+                ("authentication_renegotiations_total", summary["authentication_renegotiations"],
+                 "Credentials switched after a 401 response."),
+                ("bytes_total", summary["bytes"], "Bytes downloaded."),
+                ("fetch_wait_seconds_total", summary["fetch_wait"], "Seconds waited for iRobot to fetch data."),
+                ("hash_seconds_total", summary["hash_time"], "Seconds spent calculating checksums."),
+                ("transfer_seconds_total", summary["transfer_time"], "Seconds spent downloading data."),
+                ("batch_duration_seconds", summary["duration"], "Seconds the batch took."),
+                ("batch_throughput_bytes_per_second", summary["throughput"], "Bytes downloaded per second.")):
+            metric_type = "counter" if name.endswith("_total") else "gauge"
+            lines += [f"# HELP irobotclient_{name} {description}", f"# TYPE irobotclient_{name} {metric_type}",
+                      f"irobotclient_{name} {value}"]
+
+        lines += ["# HELP irobotclient_time_to_first_byte_seconds Seconds until the response headers of each file.",
+                  "# TYPE irobotclient_time_to_first_byte_seconds summary",
+                  f"irobotclient_time_to_first_byte_seconds_sum {self._time_to_first_byte_sum}",
+                  f"irobotclient_time_to_first_byte_seconds_count {self._time_to_first_byte_count}"]
+
+        temp_location = f"{self._textfile_location}.{os.getpid()}.tmp"
+        with open(temp_location, "w") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.replace(temp_location, self._textfile_location)
+
+    def close(self):
+        """
+        Write the batch summary as a final JSON line and to the Prometheus textfile, then close the JSON lines file.
+        """
+
+        summary = self.summary()
+
+        with self._lock:
+            self._write_json_line({"type": "summary", **summary})
+
+            if self._textfile_location:
+                self._write_textfile(summary)
+
+            if self._json_lines_file:
+                self._json_lines_file.close()
+                self._json_lines_file = None
@@ -0,0 +1,128 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""preflight_handler.py - plan a batch of downloads from iRobot's metadata before any data is transferred."""
+import errno
+import itertools
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.request_handler import Requester
+
+# Default number of files whose metadata is fetched, and which are then planned, at a time.
+PREFLIGHT_WINDOW = 1000
+
+# The keys of the size and checksum in iRobot's metadata representation.
+METADATA_SIZE = "size"
+METADATA_CHECKSUM = "checksum"
+
+
+class PreflightResult:
+    """
+    What the preflight learned about a single file: its size and checksum if iRobot provided its metadata, whether
+    the copy already in the output directory is identical, or the error returned by iRobot.
+    """
+
+    def __init__(self, file_path: str, size=None, checksum=None, unchanged=False, error=None):
+        """
+        Instantiate a result for one requested file.
+
+        :param file_path: the path of the file as it was requested from iRobot.
+        :param size: the size of the file in bytes, if known.
+        :param checksum: the MD5 hex digest of the file, if known.
+        :param unchanged: whether the file in the output directory is identical, so it need not be downloaded.
+        :param error: the exception raised while requesting the metadata.
+        """
+
+        self.file_path = file_path
+        self.size = size
+        self.checksum = checksum
+        self.unchanged = unchanged
+        self.error = error
+
+    def __repr__(self):
+        return f"PreflightResult(file_path={self.file_path!r}, size={self.size!r}, checksum={self.checksum!r}, " \
+               f"unchanged={self.unchanged!r}, error={self.error!r})"
+
+
+def _fetch_metadata(request_handler: Requester, file_path: str) -> PreflightResult:
+    # Request the metadata of one file.  Errors are kept in the result; the data request for the file will report
+    # them as usual.
+
+    try:
+        metadata = request_handler.get_metadata(file_path)
+    except Exception as err:
+        return PreflightResult(file_path, error=err)
+
+    if not metadata:
+        return PreflightResult(file_path)
+
+    return PreflightResult(file_path, metadata.get(METADATA_SIZE), metadata.get(METADATA_CHECKSUM))
+
+
+def _check_disk_space(output_dir: str, required_size: int):
+    # Fail before any data is transferred if the files cannot all fit in the output directory.
+
+    free_size = shutil.disk_usage(output_dir).free
+
+    if required_size > free_size:
+        raise IrobotClientException(errno.ENOSPC, f"ERROR: The files to be downloaded need {required_size} bytes but "
+                                                  f"only {free_size} bytes are free in {output_dir}.")
+
+
+def preflight_files(request_handler: Requester, file_paths, output_dir: str, jobs: int, window=PREFLIGHT_WINDOW,
+                    checksum_index=None):
+    """
+    Fetch the metadata of a batch of files concurrently and plan their download before any data is transferred.
+    Files already in the output directory with the checksum iRobot has for them are marked as unchanged, the output
+    directory is checked for room for the rest, and the batch is ordered: unchanged files first, then the largest
+    files first, so that the longest downloads (which are the ones split into segments) start while the many small
+    files fill in around them, rather than being left until the end.
+
+    The files are taken a window at a time; each window is planned in full before any of it is yielded.  Files whose
+    metadata is not available are yielded after those of known size and downloaded as usual.
+
+    :param request_handler: the Requester used to send every request.
+    :param file_paths: an iterable of the full paths of the files to be downloaded.
+    :param output_dir: the directory (with trailing slash) that the files are saved in.
+    :param jobs: the maximum number of metadata requests sent at the same time.
+    :param window: the maximum number of files planned, and held in memory, at a time.
+    :param checksum_index: a ChecksumIndex of the files in the output directory, used to compare them to iRobot's
+    checksums without reading them; without one, no file is considered unchanged.
+    :return: a generator of PreflightResult objects, in the order the files should be downloaded.
+    """
+
+    file_paths = iter(file_paths)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            results = list(executor.map(lambda file_path: _fetch_metadata(request_handler, file_path),
+                                        itertools.islice(file_paths, window)))
+            if not results:
+                return
+
+            for result in results:
+                if checksum_index and result.checksum:
+                    save_location = output_dir + path.basename(result.file_path)
+                    result.unchanged = checksum_index.get_etag(save_location) == result.checksum
+
+            _check_disk_space(output_dir, sum(result.size or 0 for result in results if not result.unchanged))
+
+            yield from sorted(results, key=lambda result: (not result.unchanged, result.size is None,
+                                                           -(result.size or 0)))
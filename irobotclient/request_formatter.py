@@ -34,7 +34,16 @@ authentication_types = {
 # A dictionary of the headers required for the request.
 request_headers = {
     'AUTHORIZATION': "Authorization",
-    'ACCEPT': "Accept"
+    'ACCEPT': "Accept",
+    'RANGE': "Range",
+    'IF_NONE_MATCH': "If-None-Match"
+}
+
+# The representations of a data object that can be requested from iRobot with the Accept header.
+media_types = {
+    'DATA': "application/octet-stream",
+    'METADATA': "application/vnd.irobot.metadata+json",
+    'CHECKSUM': "application/vnd.irobot.checksum"
 }
 
 
@@ -58,6 +67,35 @@ def get_file_list(input_file: str, no_index: bool) -> list:
     return file_list
 
 
+def get_manifest_file_list(manifest, no_index: bool, strip_leading_slash: bool):
+    """
+    Lazily return all the files (full paths) listed in a manifest, each followed by its index files unless otherwise
+    requested.  Blank lines and lines starting with '#' are ignored, as are directories which cannot be downloaded.
+
+    Only one line of the manifest is held at a time, so arbitrarily long manifests use a constant amount of memory.
+
+    :param manifest: an iterable of lines, such as an open file or stdin, each holding the full path to a file.
+    :param no_index: flag to not download the index files by default.
+    :param strip_leading_slash: remove any leading slash so the paths can be appended to a separately supplied URL.
+    :return: a generator of the full paths of all the files to be downloaded.
+    """
+
+    for line in manifest:
+        input_file = line.strip()
+
+        if not input_file or input_file.startswith('#'):
+            continue
+
+        if input_file.endswith('/'):
+            print(f"WARNING: Cannot download entire directories at present; skipping {input_file}.")
+            continue
+
+        if strip_leading_slash:
+            input_file = input_file.lstrip('/')
+
+        yield from get_file_list(input_file, no_index)
+
+
 def get_authentication_strings(arvados_token: str, basic_username: str, basic_password: str) -> list:
     """
     Set the authentication credentials and return them as a dictionary to be used in the request header.
@@ -92,7 +130,7 @@ def get_headers(authentication_credentials: str) -> dict:
 
     headers = {
         request_headers["AUTHORIZATION"]: authentication_credentials,
-        request_headers["ACCEPT"]: "application/octet-stream"
+        request_headers["ACCEPT"]: media_types['DATA']
     }
 
     return headers
@@ -17,20 +17,37 @@ with this program. If not, see <http://www.gnu.org/licenses/>.
 import json
 
 """request_handler.py - Requester class to make the request to iRobot and attempt to rectify any failure responses."""
+import random
 import requests
+import threading
 import time
 import errno
 
-from irobotclient import response_handler
-from irobotclient.custom_exceptions import IrobotClientException
-from irobotclient.request_formatter import request_headers
+from requests.adapters import HTTPAdapter
+
+from irobotclient import response_handler, trace_handler
+from irobotclient.response_handler import response_headers
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.endpoint_handler import EndpointPool, split_urls
+from irobotclient.request_formatter import request_headers, media_types
 
 # Limit the amount of consecutive request retries.
 REQUEST_LIMIT = 10
 
+# Defaults for the pooled HTTP connections held by a Requester.  The pool connections are the number of hosts a
+# connection pool is cached for; the pool max size is the number of connections kept alive per host.
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+
+# Requests that find iRobot overloaded are retried after a random delay of up to the base delay doubled for each retry
+# so far, capped at the maximum (in seconds), so that clients backing off at the same time do not return together.
+BACKOFF_BASE_DELAY = 1
+BACKOFF_MAX_DELAY = 60
+
 # An enumeration to name HTTP response status codes.
 ResponseCodes = {
     'SUCCESS': 200,
+    'CREATED': 201,
     'FETCHING_DATA': 202,
     'RANGED_DATA': 206,
     'CLIENT_MATCHED': 304,
@@ -44,6 +61,48 @@ ResponseCodes = {
     'PRECACHE_FULL': 507
 }
 
+# The responses with which iRobot says it is overloaded.
+OVERLOAD_CODES = (ResponseCodes['TIMEOUT'], ResponseCodes['PRECACHE_FULL'])
+
+
+def _release_connection(response: requests.Response):
+    # Read the remainder of a (small) non-data response so that its connection is returned to the pool for reuse
+    # rather than being closed.
+
+    response.content
+
+
+def create_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE) -> requests.Session:
+    """
+    Create a long-lived session with a pooled adapter mounted for both URL schemes.
+
+    :param pool_connections: the number of hosts to cache connection pools for.
+    :param pool_maxsize: the maximum number of connections kept alive per host.
+    :return: the session.
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def _raise_error_response(response: requests.Response, file_path: str):
+    # Raise the failure described by an iRobot error response.
+
+    try:
+        raise IrobotClientException(response.status_code, response.json()['description'])
+    except json.JSONDecodeError:
+        raise IrobotClientException(response.status_code, f"{response.reason}. URL: {file_path}")
+
+
+def _get_eta_delay(response: requests.Response) -> int:
+    # The number of seconds until a 202 response says its data should be ready, allowing for the margin of error.
+
+    return response_handler.get_request_delay(response) + response_handler.get_request_eta_margin(response)
+
 
 class Requester:
     """
@@ -51,64 +110,270 @@ class Requester:
     return code.  A successful request causes the class to pass the response up to the calling code to handle
     the data download.
 
+    A single HTTP session, backed by a pool of keep-alive connections, is held for the lifetime of the object so that
+    retries, 202 polls, authentication renegotiations and subsequent files all reuse the same connections.  A Requester
+    may be shared between threads.
+
+    Requests that find iRobot overloaded (504 and 507 responses, and failed connections) are retried with jittered
+    exponential backoff, and reported to the concurrency limiter if there is one, as are successful data requests.
+    The data of successful data requests is read through the bandwidth limiter if there is one.
+
+    Several iRobot instances can be given.  Requests are then spread over them by an EndpointPool, and a request that
+    finds one overloaded or down is sent straight to another healthy instance rather than backed off; only when none is
+    healthy is the request backed off and the overload reported to the limiter.
+
     Public methods:
     get_data - handles the requesting of data.
+    get_metadata - requests the iRODS metadata of a file rather than its data.
+    get_chunk_checksums - requests the checksums of each chunk of a file.
+    prefetch - asks iRobot to start fetching data into its precache without downloading it.
+    close - releases the pooled connections.
     """
 
-    def __init__(self, headers: dict, requested_url=None, additional_auth_credentials=None):
+    def __init__(self, headers: dict, requested_url=None, additional_auth_credentials=None,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, keep_alive=True,
+                 limiter=None, authentication_cache=None, metrics=None, session=None, bandwidth=None):
         """
         Instantiates a class object with the data require for a request attempt.
 
-        :param requested_url: a string of the iRobot server url not including the file path.
+        :param requested_url: a string of the iRobot server url not including the file path, or a comma separated
+        list of the urls of several iRobot instances sharing an iRODS zone.
         :param headers: a dictionary of the headers for the request.
         :param additional_auth_credentials: a list of additional authentication credentials is available.
+        :param pool_connections: the number of hosts to cache connection pools for.
+        :param pool_maxsize: the maximum number of connections kept alive per host.
+        :param keep_alive: reuse connections between requests; if False every request closes its connection.
+        :param limiter: a ConcurrencyLimiter told of every successful data request and every overload.
+        :param authentication_cache: an AuthenticationCache of the scheme each iRobot host accepts; the credential of
+        the scheme known to be accepted is used first, and a newly negotiated scheme is recorded.
+        :param metrics: a MetricsRecorder that the requests, retries, waits and time to first byte of every data request
+        are added to, under the path of the file requested.
+        :param session: a session (see create_session) shared with other Requesters, whose connections are reused
+        instead of opening a pool of this Requester's own; it is not closed with this Requester.
+        :param bandwidth: a BandwidthLimiter that the data of every data response is read through.
         """
 
         self._requested_url = requested_url
+        self._endpoints = EndpointPool(split_urls(requested_url)) if requested_url else None
         self._headers = headers
         self._additional_auth_credentials = additional_auth_credentials
+        self._session = session if session else create_session(pool_connections, pool_maxsize)
+        self._owns_session = session is None
+        self._connection_headers = {} if keep_alive else {"Connection": "close"}
+        self._authentication_lock = threading.Lock()
+        self._limiter = limiter
+        # Authentication is negotiated once for every instance, and remembered under the first.
+        self._host = self._endpoints.endpoints[0].host if self._endpoints else None
+        self._authentication_cache = authentication_cache if self._host else None
+        self._metrics = metrics
+        self._bandwidth = bandwidth
+
+        if self._authentication_cache:
+            self._use_cached_scheme()
+
+    @property
+    def url(self):
+        """
+        The iRobot url, or comma separated urls, that file paths are requested from; None if file paths are full urls.
+        """
+
+        return self._requested_url
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _use_cached_scheme(self):
+        # Start with the credential of the scheme this host is known to accept, keeping the credential it replaces in
+        # case the host no longer accepts that scheme.
+
+        scheme = self._authentication_cache.get_scheme(self._host)
+        current_credential = self._headers.get(request_headers['AUTHORIZATION'], "")
+
+        if not scheme or current_credential.startswith(f"{scheme} "):
+            return
+
+        for index, credential in enumerate(self._additional_auth_credentials or []):
+            if credential.startswith(f"{scheme} "):
+                self._additional_auth_credentials[index] = current_credential
+                self._headers[request_headers['AUTHORIZATION']] = credential
+                return
+
+    def _renegotiate_authentication(self, response: requests.Response, sent_headers: dict) -> bool:
+        # Switch to a credential accepted by iRobot after an authentication failure.  When several threads are
+        # rejected with the same credential only the first one moves on to the next; the others retry with it.
+        # Returns whether there is a new credential worth retrying with.
+
+        with self._authentication_lock, trace_handler.span("authentication"):
+            current_credential = self._headers.get(request_headers['AUTHORIZATION'])
+
+            if sent_headers.get(request_headers['AUTHORIZATION']) != current_credential:
+                return True
+
+            if not self._additional_auth_credentials:
+                return False
+
+            new_credential = response_handler.update_authentication_header(response, self._additional_auth_credentials)
+            self._headers[request_headers['AUTHORIZATION']] = new_credential
+
+            if new_credential and self._authentication_cache:
+                self._authentication_cache.record(self._host, new_credential.split(' ')[0])
+
+            return True
+
+    def _select_endpoint(self, file_path: str) -> tuple:
+        # Choose the iRobot instance for a request, returning it and the url of the file there; without a url the file
+        # path is the full url.
+
+        if not self._endpoints:
+            return None, file_path
+
+        endpoint = self._endpoints.select(file_path)
+
+        return endpoint, endpoint.url + file_path
+
+    def _back_off(self, attempt: int):
+        # Wait before the next attempt and report that iRobot is overloaded, unless another healthy instance can take
+        # the attempt at once.
+
+        if self._endpoints and self._endpoints.has_healthy():
+            return
+
+        if self._limiter:
+            self._limiter.overloaded()
+
+        with trace_handler.span("backoff", attempt=attempt):
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_DELAY, BACKOFF_BASE_DELAY * 2 ** attempt)))
+
+    def _send(self, request: requests.Request, attempt: int, endpoint=None, file_path=None, **kwargs):
+        # Send a request.  A connection that fails, other than on the last attempt, is treated as an overload: the
+        # request is backed off and None returned so that the caller tries again.  A streamed request's span ends once
+        # its response headers arrive.  The outcome is recorded against the endpoint the request was sent to, and a
+        # file it answers for without an error is pinned to it.
+
+        try:
+            with trace_handler.span("request", method=request.method, url=request.url, attempt=attempt) as span:
+                response = self._session.send(request.prepare(), **kwargs)
+                span.set(status=response.status_code)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if endpoint:
+                self._endpoints.failed(endpoint)
+
+            if attempt == REQUEST_LIMIT - 1:
+                raise
+
+            self._back_off(attempt)
+            return None
+        except Exception:
+            if endpoint:
+                self._endpoints.failed(endpoint)
+            raise
+
+        if endpoint and response.status_code in OVERLOAD_CODES:
+            self._endpoints.failed(endpoint)
+        elif endpoint:
+            # A rejected credential is answered at once, without iRobot doing any work, so it says nothing of how
+            # loaded the instance is.
+            latency = None if response.status_code == ResponseCodes['AUTHENTICATION_FAILED'] else \
+                response.elapsed.total_seconds()
+            self._endpoints.succeeded(endpoint, latency, file_path if response.status_code < 400 else None)
+
+        return response
+
+    def _record(self, file_path: str, counter: str, value=1):
+        # Add to a counter of the file's metrics, if they are being recorded.
+
+        if self._metrics:
+            self._metrics.add(file_path, counter, value)
+
+    def close(self):
+        """
+        Close the session and every pooled connection it holds, unless the session is shared.
+        """
+
+        if self._owns_session:
+            self._session.close()
 
-    def get_data(self, file_path: str) -> requests.Response:
+    def get_data(self, file_path: str, wait_for_data=True, byte_range=None, etag=None) -> requests.Response:
         """
         Requests the data from iRobot
 
         :param file_path: the full path of the file requested.
-        :return: a successful iRobot response
+        :param wait_for_data: sleep until the ETA of a 202 response and try again; if False a DataNotReadyException is
+        raised with the delay (including the ETA margin) instead.
+        :param byte_range: a tuple of the first and last (inclusive) byte to request, rather than the whole file.  The
+        last byte may be None to request everything from the first byte onwards.
+        :param etag: the ETag of a copy of the data the client already has; iRobot only sends the data if it differs.
+        :return: a successful iRobot response; a 206 response if a byte range was requested and iRobot honoured it; a
+        304 response, without data, if an ETag was given and it matches.
         """
 
-        if self._requested_url:
-            file_path = self._requested_url + file_path
+        conditional_headers = {}
+        if byte_range:
+            first_byte, last_byte = byte_range
+            conditional_headers[request_headers['RANGE']] = \
+                f"bytes={first_byte}-{'' if last_byte is None else last_byte}"
+        if etag:
+            conditional_headers[request_headers['IF_NONE_MATCH']] = etag
+
+        requested_path = file_path
 
         try:
             for index in range(REQUEST_LIMIT):
 
-                request = requests.Request(method='GET', url=file_path, headers=self._headers)
-                req = request.prepare()
-                session = requests.Session()
-                response = session.send(req, stream=True)
+                endpoint, file_path = self._select_endpoint(requested_path)
+                headers = {**self._headers, **self._connection_headers, **conditional_headers}
+                request = requests.Request(method='GET', url=file_path, headers=headers)
+                self._record(requested_path, "requests")
+                if index:
+                    self._record(requested_path, "retries")
+                response = self._send(request, index, endpoint, requested_path, stream=True)
+
+                if response is None:
+                    continue
 
-                if response.status_code == ResponseCodes['SUCCESS']:
+                if response.status_code == ResponseCodes['SUCCESS'] or \
+                        (response.status_code == ResponseCodes['RANGED_DATA'] and byte_range):
+                    if self._limiter:
+                        self._limiter.succeeded()
+                    if self._metrics:
+                        self._metrics.first_byte(requested_path, response.elapsed.total_seconds())
+                    if self._bandwidth:
+                        self._bandwidth.throttle(response, requested_path)
                     return response
 
-                elif response.status_code == ResponseCodes['FETCHING_DATA']:
-                    time.sleep(response_handler.get_request_delay(response))
+                _release_connection(response)
+
+                if response.status_code == ResponseCodes['FETCHING_DATA'] and not wait_for_data:
+                    raise DataNotReadyException(response.status_code, f"iRobot is fetching {file_path}.",
+                                                _get_eta_delay(response))
 
-                elif response.status_code == ResponseCodes['RANGED_DATA']:
-                    pass  # TODO - This response could have a ETA of remaining data ranges
+                elif response.status_code == ResponseCodes['FETCHING_DATA']:
+                    # Waiting allows for the margin of the ETA, as a parked request does, rather than asking again
+                    # while the data may still be on its way.
+                    delay = max(0, _get_eta_delay(response))
+                    self._record(requested_path, "fetch_wait", delay)
+                    with trace_handler.span("fetch wait", delay=delay):
+                        time.sleep(delay)
 
-                elif response.status_code == ResponseCodes['CLIENT_MATCHED']:
-                    pass  # TODO - Client has already downloaded this data; need to add sum to request for this to work?
+                elif response.status_code == ResponseCodes['CLIENT_MATCHED'] and etag:
+                    return response
 
                 elif response.status_code == ResponseCodes['AUTHENTICATION_FAILED'] and \
-                        self._additional_auth_credentials:
-                    self._headers[request_headers['AUTHORIZATION']] = \
-                        response_handler.update_authentication_header(response, self._additional_auth_credentials)
+                        self._renegotiate_authentication(response, headers):
+                    self._record(requested_path, "authentication_renegotiations")
+
+                elif response.status_code == ResponseCodes['INVALID_RANGE']:
+                    raise IrobotClientException(response.status_code, f"Requested range {byte_range} is not "
+                                                                       f"satisfiable. URL: {file_path}")
+
+                elif response.status_code in OVERLOAD_CODES:
+                    self._back_off(index)
 
                 elif 400 <= response.status_code < 600:
-                    try:
-                        raise IrobotClientException(response.status_code, response.json()['description'])
-                    except json.JSONDecodeError:
-                        raise IrobotClientException(response.status_code, f"{response.reason}. URL: {file_path}")
+                    _raise_error_response(response, file_path)
 
             raise IrobotClientException(errno.ECONNABORTED, "ERROR: Maximum number of request retries.  This could be "
                                                             "because of a large file being fetch.  Please try again "
@@ -122,3 +387,148 @@ class Requester:
             raise
         except:
             raise
+
+    def get_metadata(self, file_path: str):
+        """
+        Requests the metadata of the file (its size, checksum, timestamps and AVUs) from iRobot, which has it from
+        iRODS without having to fetch the data.
+
+        :param file_path: the full path of the file requested.
+        :return: a dictionary of the metadata; None if this iRobot cannot provide it.
+        """
+
+        requested_path = file_path
+
+        for index in range(REQUEST_LIMIT):
+
+            endpoint, file_path = self._select_endpoint(requested_path)
+            headers = {**self._headers, **self._connection_headers,
+                       request_headers['ACCEPT']: media_types['METADATA']}
+            request = requests.Request(method='GET', url=file_path, headers=headers)
+            response = self._send(request, index, endpoint, requested_path, stream=True)
+
+            if response is None:
+                continue
+
+            # An iRobot that ignores the Accept header answers with the data, which is not read.
+            if response.status_code == ResponseCodes['SUCCESS'] and \
+                    response.headers.get(response_headers['CONTENT_TYPE'], "").startswith(media_types['METADATA']):
+                return response.json()
+
+            if response.status_code == ResponseCodes['SUCCESS']:
+                response.close()
+                return None
+
+            _release_connection(response)
+
+            if response.status_code == ResponseCodes['INVALID_MEDIA_REQUESTED']:
+                return None
+
+            elif response.status_code == ResponseCodes['AUTHENTICATION_FAILED'] and \
+                    self._renegotiate_authentication(response, headers):
+                pass
+
+            elif response.status_code in OVERLOAD_CODES:
+                self._back_off(index)
+
+            elif 400 <= response.status_code < 600:
+                _raise_error_response(response, file_path)
+
+            else:
+                return None
+
+        raise IrobotClientException(errno.ECONNABORTED, "ERROR: Maximum number of request retries.")
+
+    def get_chunk_checksums(self, file_path: str) -> list:
+        """
+        Requests the checksums that iRobot calculated for each chunk of the file when it fetched it into its precache,
+        so that a download can be checked, and repaired, a range at a time.
+
+        :param file_path: the full path of the file requested.
+        :return: a list of (first byte, last byte, MD5 hex digest) tuples in file order; empty if this iRobot cannot
+        provide them or the file is not in its precache.
+        """
+
+        requested_path = file_path
+
+        for index in range(REQUEST_LIMIT):
+
+            endpoint, file_path = self._select_endpoint(requested_path)
+            headers = {**self._headers, **self._connection_headers,
+                       request_headers['ACCEPT']: media_types['CHECKSUM'],
+                       request_headers['RANGE']: "bytes=0-"}
+            request = requests.Request(method='GET', url=file_path, headers=headers)
+            response = self._send(request, index, endpoint, requested_path, stream=True)
+
+            if response is None:
+                continue
+
+            # An iRobot that ignores the Accept header answers with the data, which is not read.
+            if response.status_code in (ResponseCodes['SUCCESS'], ResponseCodes['RANGED_DATA']) and \
+                    not response.headers.get(response_headers['CONTENT_TYPE'], "").startswith("multipart/byteranges"):
+                response.close()
+                return []
+
+            if response.status_code == ResponseCodes['RANGED_DATA']:
+                return response_handler.get_chunk_checksums(response)
+
+            _release_connection(response)
+
+            if response.status_code == ResponseCodes['AUTHENTICATION_FAILED'] and \
+                    self._renegotiate_authentication(response, headers):
+                pass
+
+            elif response.status_code in (ResponseCodes['INVALID_MEDIA_REQUESTED'], ResponseCodes['INVALID_RANGE']) \
+                    or response.status_code < 400:
+                return []
+
+            elif response.status_code in OVERLOAD_CODES:
+                self._back_off(index)
+
+            else:
+                _raise_error_response(response, file_path)
+
+        raise IrobotClientException(errno.ECONNABORTED, "ERROR: Maximum number of request retries.")
+
+    def prefetch(self, file_path: str) -> int:
+        """
+        Ask iRobot to seed its precache with the data, without transferring it, so that iRobot can fetch it from iRODS
+        while other files are being downloaded.
+
+        :param file_path: the full path of the file requested.
+        :return: the number of seconds until the data should be ready; zero if it already is or if this iRobot does not
+        support seeding its precache, in which case the data will be fetched when it is requested.
+        """
+
+        requested_path = file_path
+
+        for index in range(REQUEST_LIMIT):
+
+            endpoint, file_path = self._select_endpoint(requested_path)
+            headers = {**self._headers, **self._connection_headers}
+            request = requests.Request(method='POST', url=file_path, headers=headers)
+            response = self._send(request, index, endpoint, requested_path)
+
+            if response is None:
+                continue
+
+            _release_connection(response)
+
+            if response.status_code in (ResponseCodes['SUCCESS'], ResponseCodes['CREATED'],
+                                        ResponseCodes['INVALID_REQUEST_METHOD']):
+                return 0
+
+            elif response.status_code == ResponseCodes['FETCHING_DATA']:
+                return max(0, _get_eta_delay(response))
+
+            elif response.status_code == ResponseCodes['AUTHENTICATION_FAILED'] and \
+                    self._renegotiate_authentication(response, headers):
+                pass
+
+            elif response.status_code in OVERLOAD_CODES:
+                self._back_off(index)
+
+            elif 400 <= response.status_code < 600:
+                _raise_error_response(response, file_path)
+
+        raise IrobotClientException(errno.ECONNABORTED, "ERROR: Maximum number of request retries.")
@@ -28,7 +28,10 @@ DEFAULT_WAIT_RESPONSE_TIME = 600
 response_headers = {
     'ETA': "iRobot-ETA",
     'ACCEPTED_AUTH_TYPES': "WWW-Authenticate",
-    'CHECKSUM': "ETag"
+    'CHECKSUM': "ETag",
+    'CONTENT_LENGTH': "Content-Length",
+    'CONTENT_RANGE': "Content-Range",
+    'CONTENT_TYPE': "Content-Type"
 }
 
 
@@ -36,7 +39,7 @@ def _get_default_request_delay() -> int:
     # If a 202 response returns with no iRobot-ETA header then a delay will be set by this method.
 
     try:
-        return os.environ['IROBOT_REQUEST_DELAY_TIME']
+        return int(os.environ['IROBOT_REQUEST_DELAY_TIME'])
     except:
         return DEFAULT_WAIT_RESPONSE_TIME
 
@@ -58,6 +61,49 @@ def get_request_delay(response: requests.Response) -> int:
         return _get_default_request_delay()
 
 
+def get_request_eta_margin(response: requests.Response) -> int:
+    """
+    Return the uncertainty, in seconds, that iRobot gives with the ETA of a 202 response.
+
+    :param response: the response from iRobot.
+    :return: the +/- margin of the ETA header, or zero if there is no margin.
+    """
+
+    # Eg:  iRobot-ETA: 2017-09-25T12:34:56Z+0000 +/- 123
+    margin = re.search(r'\+/-\s*(\d+)', response.headers.get(response_headers['ETA'], ""))
+
+    return int(margin.group(1)) if margin else 0
+
+
+def get_chunk_checksums(response: requests.Response) -> list:
+    """
+    Return the checksums of the chunks of a file from iRobot's response to a ranged checksum request, which is a
+    multipart/byteranges body with a part for each chunk holding its MD5.
+
+    :param response: the response from iRobot.
+    :return: a list of (first byte, last byte, MD5 hex digest) tuples, both bytes inclusive, in file order; empty if the
+    response does not hold the checksums of chunks.
+    """
+
+    # Eg:  Content-Type: multipart/byteranges; boundary=3d6b6a416f9b5
+    boundary = re.search(r'boundary="?([^";]+)"?', response.headers.get(response_headers['CONTENT_TYPE'], ""))
+
+    if not boundary:
+        return []
+
+    chunk_checksums = []
+
+    for part in response.content.split(b"--" + boundary.group(1).encode()):
+        part_headers, _, part_body = part.partition(b"\r\n\r\n")
+        content_range = re.search(rb'Content-Range:\s*bytes\s+(\d+)-(\d+)', part_headers, re.IGNORECASE)
+
+        if content_range:
+            chunk_checksums.append((int(content_range.group(1)), int(content_range.group(2)),
+                                    part_body.strip().decode()))
+
+    return sorted(chunk_checksums)
+
+
 def update_authentication_header(response: requests.Response, auth_credentials: list) -> str:
     """
     Returns an accepted authentication string to use in the next request following an authentication failure response.
@@ -0,0 +1,199 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""resume_handler.py - keep track of partially downloaded files so that an interrupted download can be continued."""
+import hashlib
+import json
+import os
+
+# Suffixes of the file that data is written to until the download is complete, and of its sidecar state file.
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".state"
+
+# How many bytes (of a single stream download) are written between updates of the state file.
+STATE_COMMIT_INTERVAL = 64 * 1024 * 1024
+
+# Size (in bytes) of the reads used to rehash the data already downloaded.
+REHASH_READ_SIZE = 1024 * 1024
+
+
+class PartialDownload:
+    """
+    A download in progress.  Data is written to a temporary part file next to the final save location, and a small
+    JSON state file alongside it records the ETag of the data and how much of it is safely on disk: the number of bytes
+    for a single stream, or the completed byte ranges for a segmented download.  The state is only updated after the
+    data it describes has been flushed to disk, so after an interruption the download can be continued from there.
+
+    MD5 objects cannot be saved, so when a single stream is resumed the data already on disk is read back and hashed
+    again; reading the local disk is far cheaper than fetching the data again.
+
+    Public methods:
+    start - begin a new download, discarding any previous state.
+    advance - record data written by a single stream, committing the state periodically.
+    commit - flush the data written so far and record it in the state.
+    commit_segment - record a byte range of a segmented download as complete.
+    rehash - return an MD5 object fed with the data already committed.
+    finish - move the complete file to its save location and remove the state.
+    """
+
+    def __init__(self, save_location: str):
+        """
+        Instantiate a partial download, loading the state of an earlier attempt if there is one.
+
+        :param save_location: where the complete file is to be saved.
+        """
+
+        self.save_location = save_location
+        self.location = save_location + PART_SUFFIX
+        self._state_location = self.location + STATE_SUFFIX
+
+        self.etag = None
+        self.size = None
+        self.committed = 0
+        self.segment_size = None
+        self.completed_segments = set()
+        self._uncommitted = 0
+
+        self._load()
+
+    def _load(self):
+        # Read the state of an earlier attempt; any state that cannot be trusted is ignored.
+
+        try:
+            with open(self._state_location) as state_file:
+                state = json.load(state_file)
+
+            if os.path.getsize(self.location) < state["committed"]:
+                return
+
+            self.etag = state["etag"]
+            self.size = state["size"]
+            self.committed = state["committed"]
+            self.segment_size = state.get("segment_size")
+            self.completed_segments = set(state.get("completed_segments", []))
+        except (OSError, ValueError, KeyError, TypeError):
+            self.etag = None
+
+    def _save(self):
+        # Replace the state file atomically so an interruption never leaves it half written.
+
+        temporary_location = self._state_location + ".tmp"
+
+        with open(temporary_location, "w") as state_file:
+            json.dump({"etag": self.etag,
+                       "size": self.size,
+                       "committed": self.committed,
+                       "segment_size": self.segment_size,
+                       "completed_segments": sorted(self.completed_segments)}, state_file)
+
+        os.replace(temporary_location, self._state_location)
+
+    @property
+    def resumable(self) -> bool:
+        return bool(self.etag) and (self.committed > 0 or bool(self.completed_segments))
+
+    def start(self, etag: str, size: int, segment_size=None, committed=0):
+        """
+        Begin recording a download, discarding the state of any earlier attempt.
+
+        :param etag: the ETag of the data being downloaded.
+        :param size: the size of the whole file in bytes.
+        :param segment_size: the size of each byte range of a segmented download; None for a single stream.
+        :param committed: the number of bytes of a single stream already on disk.
+        """
+
+        self.etag = etag
+        self.size = size
+        self.segment_size = segment_size
+        self.committed = committed
+        self.completed_segments = set()
+        self._uncommitted = 0
+
+        if self.etag:
+            self._save()
+
+    def advance(self, file, written: int):
+        """
+        Record data written by a single stream, committing it once enough has built up.
+
+        :param file: the open part file.
+        :param written: the number of bytes just written.
+        """
+
+        self._uncommitted += written
+
+        if self._uncommitted >= STATE_COMMIT_INTERVAL:
+            self.commit(file)
+
+    def commit(self, file):
+        """
+        Flush the data written by a single stream to disk and record it in the state.
+
+        :param file: the open part file.
+        """
+
+        file.flush()
+        os.fsync(file.fileno())
+
+        self.committed += self._uncommitted
+        self._uncommitted = 0
+
+        if self.etag:
+            self._save()
+
+    def commit_segment(self, file_descriptor: int, first_byte: int):
+        """
+        Flush the data of a segmented download to disk and record a byte range as complete.
+
+        :param file_descriptor: the descriptor of the open part file.
+        :param first_byte: the first byte of the completed range.
+        """
+
+        os.fsync(file_descriptor)
+        self.completed_segments.add(first_byte)
+
+        if self.etag:
+            self._save()
+
+    def rehash(self):
+        """
+        Return an MD5 object fed with the committed data of a single stream, so that hashing can carry on from there.
+        """
+
+        hasher = hashlib.md5()
+        remaining = self.committed
+
+        with open(self.location, "rb") as file:
+            while remaining:
+                data_chunk = file.read(min(REHASH_READ_SIZE, remaining))
+                if not data_chunk:
+                    raise EOFError(f"{self.location} is shorter than its recorded state.")
+                hasher.update(data_chunk)
+                remaining -= len(data_chunk)
+
+        return hasher
+
+    def finish(self):
+        """
+        Move the complete part file to the save location and remove the state file.
+        """
+
+        os.replace(self.location, self.save_location)
+
+        try:
+            os.remove(self._state_location)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,286 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""segment_handler.py - download a single large file as byte ranges fetched concurrently over pooled connections."""
+import errno
+import hashlib
+import itertools
+import os
+import re
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests import Response
+
+from irobotclient import trace_handler
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.request_handler import Requester, ResponseCodes
+from irobotclient.response_handler import response_headers
+from irobotclient.stream_handler import read_chunks, write_all
+
+# Default size (in bytes) of each byte range of a segmented download.
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Default upper limit (in bytes) on the memory used by the read buffers of all the segments in flight.
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Size (in bytes) of the reads used to checksum a file once all its segments are written.
+CHECKSUM_READ_SIZE = 1024 * 1024
+
+
+def plan_segments(file_size: int, segment_size: int) -> list:
+    """
+    Split a file into consecutive byte ranges.
+
+    :param file_size: the size of the file in bytes.
+    :param segment_size: the maximum size of each range in bytes.
+    :return: a list of (first byte, last byte) tuples, both inclusive, covering the whole file.
+    """
+
+    return [(first_byte, min(first_byte + segment_size, file_size) - 1)
+            for first_byte in range(0, file_size, segment_size)]
+
+
+def get_content_range_start(response: Response) -> int:
+    """
+    Return the first byte of the data in a 206 response.
+
+    :param response: a ranged response from iRobot.
+    :return: the first byte given by the Content-Range header; None if there is no such header.
+    """
+
+    # Eg:  Content-Range: bytes 0-1023/4096
+    content_range = re.match(r'bytes\s+(\d+)-', response.headers.get(response_headers['CONTENT_RANGE'], ""))
+
+    return int(content_range.group(1)) if content_range else None
+
+
+def calculate_file_checksum(save_location: str) -> str:
+    """
+    Read a file back from disk and return its MD5 hex digest.
+
+    :param save_location: the path of the file.
+    :return: the MD5 hex digest of the file.
+    """
+
+    hasher = hashlib.md5()
+
+    with trace_handler.span("checksum"), open(save_location, "rb") as file:
+        for data_chunk in iter(lambda: file.read(CHECKSUM_READ_SIZE), b""):
+            hasher.update(data_chunk)
+
+    return hasher.hexdigest()
+
+
+def _preallocate(file_descriptor: int, file_size: int):
+    # Reserve the disk space for the whole file up front, so segments can be written at any offset and a full disk is
+    # found before any data is transferred.
+
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(file_descriptor, 0, file_size)
+            return
+        except OSError as err:
+            if err.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+
+    os.ftruncate(file_descriptor, file_size)
+
+
+def _write_segment(response: Response, file_descriptor: int, first_byte: int, last_byte: int, chunk_size: int):
+    # Write the data of a response in place, starting at first_byte and stopping after last_byte, with positional
+    # writes so that concurrent segments never share a file offset.
+
+    offset = first_byte
+
+    for data_chunk in trace_handler.iterate("read", read_chunks(response, chunk_size)):
+        data_chunk = data_chunk[:last_byte + 1 - offset]
+        with trace_handler.span("write"):
+            write_all(file_descriptor, data_chunk, offset)
+        offset += len(data_chunk)
+
+        if offset > last_byte:
+            break
+
+    response.close()
+
+    if offset != last_byte + 1:
+        raise IrobotClientException(errno.EIO, f"ERROR: Received {offset - first_byte} bytes of the range "
+                                               f"{first_byte}-{last_byte}; the data is incomplete.")
+
+
+def _download_segment(request_handler: Requester, file_path: str, file_descriptor: int, first_byte: int,
+                      last_byte: int, chunk_size: int, response=None):
+    # Request a single byte range, unless its response is given, and write it into place.
+
+    with trace_handler.span("segment", file_path=file_path, first_byte=first_byte, last_byte=last_byte):
+        if response is None:
+            response = request_handler.get_data(file_path, byte_range=(first_byte, last_byte))
+
+        if response.status_code != ResponseCodes['RANGED_DATA'] or get_content_range_start(response) != first_byte:
+            response.close()
+            raise IrobotClientException(ResponseCodes['INVALID_RANGE'], f"iRobot did not return the requested range "
+                                                                        f"{first_byte}-{last_byte} of {file_path}.")
+
+        _write_segment(response, file_descriptor, first_byte, last_byte, chunk_size)
+
+
+def download_segments(request_handler: Requester, file_path: str, response: Response, save_location: str,
+                      file_size: int, executor: ThreadPoolExecutor, segments: int, segment_size: int,
+                      chunk_size: int, completed_segments=frozenset(), on_segment_written=None) -> str:
+    """
+    Download a file as byte ranges fetched concurrently and written in place into a preallocated file.
+
+    The response of the initial, whole file, request is used for the first range and closed once that range has been
+    read, so no request is wasted.  At most `segments` ranges of this file are in flight at once; the executor is
+    shared between files and its size bounds the total.
+
+    The second range is requested before any data is read.  If the server, or a proxy in front of it, ignores the
+    Range header and answers 200, the whole file is streamed from one response instead: the initial one if it is
+    still unread.
+
+    :param request_handler: the Requester used to request each range.
+    :param file_path: the full path of the file requested.
+    :param response: the successful response to the request for the whole file.
+    :param save_location: where the data is written to.
+    :param file_size: the size of the file in bytes.
+    :param executor: the pool of threads that fetch the ranges.
+    :param segments: the maximum number of ranges of this file fetched at the same time.
+    :param segment_size: the size of each range in bytes.
+    :param chunk_size: the size of the reads from each response.
+    :param completed_segments: the first bytes of ranges already written by an earlier, interrupted, download; these
+    are not fetched again and the file is not truncated.
+    :param on_segment_written: called with the file descriptor and the first byte of each range once it is written.
+    :return: the MD5 hex digest of the downloaded file.
+    """
+
+    byte_ranges = iter([byte_range for byte_range in plan_segments(file_size, segment_size)
+                        if byte_range[0] not in completed_segments])
+    flags = os.O_WRONLY | os.O_CREAT | (0 if completed_segments else os.O_TRUNC)
+    file_descriptor = os.open(save_location, flags, 0o666)
+    # Maps each range in flight to its first byte.
+    pending = {}
+
+    try:
+        _preallocate(file_descriptor, file_size)
+
+        first_range = None if 0 in completed_segments else next(byte_ranges)
+        probe_range = next(byte_ranges, None)
+        probe = None
+
+        if probe_range:
+            try:
+                probe = request_handler.get_data(file_path, byte_range=probe_range)
+            except Exception:
+                response.close()
+                raise
+
+        if probe is not None and probe.status_code == ResponseCodes['SUCCESS']:
+            if first_range:
+                probe.close()
+            else:
+                response.close()
+                response = probe
+
+            with trace_handler.span("segment", file_path=file_path, first_byte=0, last_byte=file_size - 1):
+                _write_segment(response, file_descriptor, 0, file_size - 1, chunk_size)
+            byte_ranges = iter(())
+
+        else:
+            if first_range:
+                pending[executor.submit(_write_segment, response, file_descriptor, *first_range, chunk_size)] = \
+                    first_range[0]
+            else:
+                response.close()
+
+            if probe is not None:
+                pending[executor.submit(_download_segment, request_handler, file_path, file_descriptor, *probe_range,
+                                        chunk_size, probe)] = probe_range[0]
+
+        try:
+            while True:
+                for first_byte, last_byte in itertools.islice(byte_ranges, segments - len(pending)):
+                    pending[executor.submit(_download_segment, request_handler, file_path, file_descriptor,
+                                            first_byte, last_byte, chunk_size)] = first_byte
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    first_byte = pending.pop(future)
+                    future.result()
+                    if on_segment_written:
+                        on_segment_written(file_descriptor, first_byte)
+        finally:
+            # Nothing may still be writing to the file once it is closed.
+            for future in pending:
+                future.cancel()
+            wait(pending)
+    finally:
+        os.close(file_descriptor)
+
+    return calculate_file_checksum(save_location)
+
+
+def _range_matches(file_descriptor: int, first_byte: int, last_byte: int, checksum: str) -> bool:
+    # Check the data of a byte range on disk against its expected MD5.
+
+    hasher = hashlib.md5()
+    offset = first_byte
+
+    while offset <= last_byte:
+        data_chunk = os.pread(file_descriptor, min(CHECKSUM_READ_SIZE, last_byte + 1 - offset), offset)
+        if not data_chunk:
+            return False
+        hasher.update(data_chunk)
+        offset += len(data_chunk)
+
+    return hasher.hexdigest() == checksum
+
+
+def repair_ranges(request_handler: Requester, file_path: str, save_location: str, chunk_checksums: list,
+                  workers: int, chunk_size: int) -> list:
+    """
+    Check a downloaded file a byte range at a time against the checksums iRobot has for its chunks, and download again
+    only the ranges that do not match, writing them in place.  The ranges are checked, and fetched, concurrently.
+
+    :param request_handler: the Requester used to request each range.
+    :param file_path: the full path of the file requested.
+    :param save_location: where the data was written to.
+    :param chunk_checksums: a list of (first byte, last byte, MD5 hex digest) tuples covering the whole file.
+    :param workers: the number of ranges checked, or fetched, at the same time.
+    :param chunk_size: the size of the reads from each response.
+    :return: the (first byte, last byte) tuples of the ranges that were downloaded again.
+    """
+
+    file_descriptor = os.open(save_location, os.O_RDWR)
+
+    try:
+        # A file of the wrong size is cut, or padded, to the size iRobot has; any padding fails its checksum.
+        os.ftruncate(file_descriptor, max(last_byte for _, last_byte, _ in chunk_checksums) + 1)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            matches = executor.map(lambda chunk: _range_matches(file_descriptor, *chunk), chunk_checksums)
+            corrupt_ranges = [(first_byte, last_byte) for (first_byte, last_byte, _), match
+                              in zip(chunk_checksums, matches) if not match]
+
+            for future in [executor.submit(_download_segment, request_handler, file_path, file_descriptor, first_byte,
+                                           last_byte, chunk_size) for first_byte, last_byte in corrupt_ranges]:
+                future.result()
+    finally:
+        os.close(file_descriptor)
+
+    return corrupt_ranges
@@ -0,0 +1,244 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""stream_handler.py - move data from a response to disk through reusable buffers, optionally as a pipeline."""
+import os
+import queue
+import stat
+import sys
+import threading
+
+from requests import Response
+
+from irobotclient import trace_handler
+
+# The number of buffers that a pipelined download cycles through; it bounds the memory of each download to this
+# many chunks.
+PIPELINE_DEPTH = 4
+
+# The output that stands for the standard output when data is streamed rather than saved.
+STDOUT_SINK = "-"
+
+# Each thread keeps its read buffers between downloads rather than allocating new ones for every file.
+_thread_buffers = threading.local()
+
+
+def _get_buffers(count: int, size: int) -> list:
+    # Return this thread's reusable buffers, only allocating more if there are too few or they are the wrong size.
+
+    buffers = getattr(_thread_buffers, "buffers", [])
+    if buffers and len(buffers[0]) != size:
+        buffers = []
+
+    buffers.extend(memoryview(bytearray(size)) for _ in range(count - len(buffers)))
+    _thread_buffers.buffers = buffers
+
+    return buffers[:count]
+
+
+def can_read_into(response: Response) -> bool:
+    """
+    Whether the data of a response can be read straight into a buffer.  Responses with a content encoding have to be
+    decoded through requests instead.
+
+    :param response: the streamed response from iRobot.
+    :return: True if the raw response supports readinto and has no content encoding.
+    """
+
+    return response.headers.get("Content-Encoding", "identity") == "identity" and hasattr(response.raw, "readinto")
+
+
+def _fill(response: Response, buffer: memoryview) -> int:
+    # Fill as much of the buffer as possible, so that disk writes and hash updates are large.  Returns the number of
+    # bytes read, which is less than the size of the buffer only at the end of the data.
+
+    filled = 0
+    while filled < len(buffer):
+        read = response.raw.readinto(buffer[filled:])
+        if not read:
+            break
+        filled += read
+
+    return filled
+
+
+def read_chunks(response: Response, chunk_size: int):
+    """
+    Read the data of a streamed response into a reusable buffer, yielding a view of the filled part of it each time.
+    Each view is only valid until the next one is yielded, so it must be written and hashed before moving on; nothing
+    is copied out of the buffer.
+
+    Responses with a content encoding are decoded through requests instead, which allocates each chunk.
+
+    :param response: the streamed response from iRobot.
+    :param chunk_size: the size of the buffer, and so the largest read, in bytes.
+    :return: a generator of memoryview objects.
+    """
+
+    if not can_read_into(response):
+        for data_chunk in response.iter_content(chunk_size=chunk_size):
+            if data_chunk:
+                yield memoryview(data_chunk)
+        return
+
+    buffer, = _get_buffers(1, chunk_size)
+
+    while True:
+        filled = _fill(response, buffer)
+
+        if not filled:
+            return
+
+        yield buffer[:filled]
+
+        if filled < chunk_size:
+            return
+
+
+def is_stream_sink(output: str) -> bool:
+    """
+    Whether an output is a stream that data is passed through to as it arrives, rather than a directory that files
+    are saved in: the standard output, or a named pipe (FIFO).
+
+    :param output: the output given on the command line.
+    :return: True if the output is "-" or a named pipe.
+    """
+
+    if output == STDOUT_SINK:
+        return True
+
+    try:
+        return stat.S_ISFIFO(os.stat(output).st_mode)
+    except OSError:
+        return False
+
+
+def open_stream_sink(output: str):
+    """
+    Open a stream output for writing.  Opening a named pipe waits until something opens it for reading.
+
+    :param output: "-" for the standard output (the original one, should sys.stdout have been replaced), or the path
+    of a named pipe.
+    :return: an unbuffered binary file object.
+    """
+
+    if output == STDOUT_SINK:
+        return open(sys.__stdout__.fileno(), "wb", buffering=0, closefd=False)
+
+    return open(output, "wb", buffering=0)
+
+
+def write_all(file, data: memoryview, offset=None):
+    """
+    Write all of the data to an unbuffered file, which may accept less than was asked for in one call.
+
+    :param file: an unbuffered binary file object, or a file descriptor if an offset is given.
+    :param data: the data to write.
+    :param offset: write at this position with os.pwrite rather than at the file's current position.
+    """
+
+    while data:
+        if offset is None:
+            written = file.write(data)
+        else:
+            written = os.pwrite(file, data, offset)
+            offset += written
+        data = data[written:]
+
+
+def pipelined_copy(response: Response, file, hasher, chunk_size: int, on_written=None, depth=PIPELINE_DEPTH):
+    """
+    Copy the data of a response to a file and feed it to a hasher, with reading, hashing and writing each on their own
+    thread so that the three overlap.  hashlib and file writes release the GIL for large buffers, as do socket reads.
+
+    The calling thread reads into a small, fixed pool of buffers; each filled buffer is passed through a queue to the
+    hashing thread, then through another to the writing thread, which hands it back to the pool.  Reading waits for a
+    buffer to come back when all of them are in use, so memory stays bounded by the pool whatever the speed of the
+    network or the disk.
+
+    The response must support readinto (see can_read_into).
+
+    :param response: the streamed response from iRobot.
+    :param file: an unbuffered binary file object, positioned where the data is to be written.
+    :param hasher: a hashlib object that is updated with the data.
+    :param chunk_size: the size of each buffer in bytes.
+    :param on_written: called from the writing thread with the file and the number of bytes of each write.
+    :param depth: the number of buffers in the pool.
+    """
+
+    free_buffers = queue.Queue()
+    for buffer in _get_buffers(depth, chunk_size):
+        free_buffers.put(buffer)
+
+    to_hash = queue.Queue()
+    to_write = queue.Queue()
+    errors = []
+
+    def hash_stage():
+        while True:
+            item = to_hash.get()
+            if item is None:
+                to_write.put(None)
+                return
+
+            buffer, length = item
+            if not errors:
+                try:
+                    with trace_handler.span("hash"):
+                        hasher.update(buffer[:length])
+                except Exception as err:
+                    errors.append(err)
+            to_write.put(item)
+
+    def write_stage():
+        while True:
+            item = to_write.get()
+            if item is None:
+                return
+
+            buffer, length = item
+            if not errors:
+                try:
+                    with trace_handler.span("write"):
+                        write_all(file, buffer[:length])
+                    if on_written:
+                        on_written(file, length)
+                except Exception as err:
+                    errors.append(err)
+            free_buffers.put(buffer)
+
+    stages = [threading.Thread(target=hash_stage, daemon=True), threading.Thread(target=write_stage, daemon=True)]
+    for stage in stages:
+        stage.start()
+
+    try:
+        while not errors:
+            buffer = free_buffers.get()
+            with trace_handler.span("read"):
+                length = _fill(response, buffer)
+
+            if length:
+                to_hash.put((buffer, length))
+
+            if length < chunk_size:
+                break
+    finally:
+        to_hash.put(None)
+        for stage in stages:
+            stage.join()
+
+    if errors:
+        raise errors[0]
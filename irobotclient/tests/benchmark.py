@@ -0,0 +1,137 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""benchmark.py - measure download throughput against the local iRobot emulator.
+
+Usage: python -m irobotclient.tests.benchmark [--mixes small mixed large] [--jobs 1 4 16] [--chunk_sizes 1 8] ...
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from irobotclient.download_handler import DownloadEngine
+from irobotclient.request_handler import Requester
+from irobotclient.tests.emulator import IrobotEmulator
+
+MIB = 1024 * 1024
+
+# The file size mixes benchmarked: each is a list of (number of files, size of each file in bytes).
+FILE_MIXES = {
+    "small": [(200, 64 * 1024)],
+    "mixed": [(100, 64 * 1024), (4, 32 * MIB)],
+    "large": [(2, 128 * MIB)]
+}
+
+
+def _parse_arguments(args=None) -> argparse.Namespace:
+    # The parameters to benchmark every combination of.
+
+    parser = argparse.ArgumentParser(description="Benchmark irobotclient downloads against a local iRobot emulator")
+    parser.add_argument("--mixes", nargs="+", choices=sorted(FILE_MIXES), default=sorted(FILE_MIXES),
+                        help="File size mixes to download")
+    parser.add_argument("--jobs", nargs="+", type=int, default=[1, 4, 16],
+                        help="Numbers of files downloaded at the same time")
+    parser.add_argument("--chunk_sizes", nargs="+", type=int, default=[1, 8],
+                        help="Sizes in MiB of the buffer data is read into")
+    parser.add_argument("--segments", nargs="+", type=int, default=[1],
+                        help="Numbers of byte ranges of a large file downloaded at the same time")
+    parser.add_argument("--segment_size", type=int, default=16,
+                        help="Size in MiB of each byte range of a segmented download")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds the emulator waits before answering each request")
+    parser.add_argument("--bandwidth", type=float,
+                        help="MiB per second the emulator sends each response at; unlimited by default")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times each combination is run; the median is reported")
+    parser.add_argument("--json", default=False, action="store_true",
+                        help="Print the results as JSON lines rather than a table")
+
+    return parser.parse_args(args)
+
+
+def _add_files(emulator: IrobotEmulator, mix: str) -> list:
+    # Serve the files of a mix, all sharing one block of random data, and return their paths.
+
+    data = os.urandom(max(size for _, size in FILE_MIXES[mix]))
+    file_paths = []
+
+    for count, size in FILE_MIXES[mix]:
+        for index in range(count):
+            file_path = f"{mix}/{size}-{index}.bin"
+            emulator.add_file(file_path, data[:size])
+            file_paths.append(file_path)
+
+    return file_paths
+
+
+def _time_download(emulator: IrobotEmulator, file_paths: list, jobs: int, chunk_size: int, segments: int,
+                   segment_size: int) -> float:
+    # Download the files into an empty directory and return the seconds it took.
+
+    with tempfile.TemporaryDirectory() as output_dir, \
+            Requester({}, emulator.url, pool_maxsize=jobs * segments) as request_handler:
+        engine = DownloadEngine(request_handler, output_dir + "/", jobs, segments=segments,
+                                segment_size=segment_size, chunk_size=chunk_size)
+
+        started = time.perf_counter()
+        for result in engine.download(file_paths):
+            if not result.checksum_matched:
+                raise RuntimeError(f"Download of {result.file_path} failed: {result.error}")
+
+        return time.perf_counter() - started
+
+
+def run(args=None):
+    """
+    Benchmark every combination of the parameters and print the files and MiB downloaded per second of each.
+
+    :param args: the command line arguments; defaults to sys.argv.
+    """
+
+    args = _parse_arguments(args)
+    bandwidth = args.bandwidth * MIB if args.bandwidth else None
+
+    if not args.json:
+        print(f"{'mix':<8}{'jobs':>6}{'chunk MiB':>11}{'segments':>10}{'files/s':>12}{'MiB/s':>10}")
+
+    for mix in args.mixes:
+        with IrobotEmulator(latency=args.latency, bandwidth=bandwidth) as emulator:
+            file_paths = _add_files(emulator, mix)
+            total_size = sum(count * size for count, size in FILE_MIXES[mix])
+
+            for jobs, chunk_size, segments in itertools.product(args.jobs, args.chunk_sizes, args.segments):
+                elapsed = statistics.median(_time_download(emulator, file_paths, jobs, chunk_size * MIB, segments,
+                                                           args.segment_size * MIB)
+                                            for _ in range(args.repeat))
+                result = {"mix": mix, "jobs": jobs, "chunk_size": chunk_size * MIB, "segments": segments,
+                          "seconds": elapsed, "files_per_second": len(file_paths) / elapsed,
+                          "mib_per_second": total_size / MIB / elapsed}
+
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print(f"{mix:<8}{jobs:>6}{chunk_size:>11}{segments:>10}{result['files_per_second']:>12.1f}"
+                          f"{result['mib_per_second']:>10.1f}")
+                sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,362 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""emulator.py - a local stand-in for an iRobot server, for end-to-end tests and benchmarks that run offline."""
+import collections
+import hashlib
+import json
+import re
+import socketserver
+import sys
+import threading
+import time
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from irobotclient.request_formatter import media_types
+
+# Default size (in bytes) of the chunks that the emulator gives checksums for.
+DEFAULT_CHECKSUM_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Size (in bytes) of the writes that data is sent in, and throttled by, when the bandwidth is limited.
+THROTTLE_WRITE_SIZE = 64 * 1024
+
+# The boundary of multipart chunk checksum responses.
+MULTIPART_BOUNDARY = "irobotemulator"
+
+# The reasons given in the JSON body of error responses.
+ERROR_DESCRIPTIONS = {
+    401: "Authentication failed",
+    403: "Access denied by iRODS",
+    404: "File not found",
+    416: "Requested range not satisfiable",
+    504: "Timed out fetching the data from iRODS",
+    507: "The precache is full"
+}
+
+# A request received by the emulator and the status it was answered with.
+EmulatedRequest = collections.namedtuple("EmulatedRequest", ["method", "path", "headers", "status"])
+
+
+class EmulatedFile:
+    """
+    A file held by the emulator, with the behaviour scripted for it.
+    """
+
+    def __init__(self, data: bytes, fetch_delay=0):
+        """
+        :param data: the content of the file.
+        :param fetch_delay: the seconds iRobot takes to fetch the file into its precache after it is first asked for;
+        it is answered with a 202 until then.
+        """
+
+        self.data = data
+        self.etag = hashlib.md5(data).hexdigest()
+        self.fetch_delay = fetch_delay
+        self.ready_time = None
+        # Status codes to answer the next requests with, before the usual behaviour.
+        self.scripted_statuses = collections.deque()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # Handle each connection on its own thread and do not wait for keep-alive connections when stopping.
+
+    daemon_threads = True
+    block_on_close = False
+
+    def handle_error(self, request, client_address):
+        # Clients close connections part way through a response, eg: once they have read the first range of a
+        # segmented download, which is not an error.
+
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Answers each request as iRobot would, from the state of the emulator the server belongs to.
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def _emulator(self):
+        return self.server.emulator
+
+    def do_GET(self):
+        self._emulator.handle(self, "GET")
+
+    def do_POST(self):
+        self._emulator.handle(self, "POST")
+
+    def do_HEAD(self):
+        self._emulator.handle(self, "HEAD")
+
+
+class IrobotEmulator:
+    """
+    A pure-Python HTTP server that behaves like iRobot: files are served with ETags, byte ranges (206 and 416),
+    conditional requests (304), metadata and chunk checksum representations, and prefetch requests; files can take a
+    while to fetch (202 with an iRobot-ETA); credentials are checked (401 with WWW-Authenticate); and any status,
+    such as a 504 or 507, can be scripted for the next requests of a file.  Latency and bandwidth can be limited to
+    resemble a remote iRobot.
+
+    Every request is recorded, with the status it was answered with, so tests can check what the client sent.
+
+    Public methods:
+    add_file - serve a file.
+    script - answer the next requests of a file with the given statuses.
+    start - start serving on a free local port.
+    stop - stop serving.
+    """
+
+    def __init__(self, credentials=None, latency=0.0, bandwidth=None, checksum_chunk_size=DEFAULT_CHECKSUM_CHUNK_SIZE):
+        """
+        Instantiate an emulator with no files.
+
+        :param credentials: the Authorization header values that are accepted; if None, requests are not checked.
+        :param latency: the seconds to wait before answering each request.
+        :param bandwidth: the bytes per second each response's data is sent at; if None, as fast as possible.
+        :param checksum_chunk_size: the size in bytes of the chunks checksums are given for.
+        """
+
+        self.credentials = credentials
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.checksum_chunk_size = checksum_chunk_size
+        self.files = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """
+        The URL of the emulator, with a trailing slash, as the client is given it.
+        """
+
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def add_file(self, path: str, data: bytes, fetch_delay=0) -> EmulatedFile:
+        """
+        Serve a file.
+
+        :param path: the path the file is requested by, without a leading slash.
+        :param data: the content of the file.
+        :param fetch_delay: the seconds the file takes to fetch into the precache once it is first asked for.
+        :return: the file, whose data and behaviour can be changed later.
+        """
+
+        self.files[path] = EmulatedFile(data, fetch_delay)
+        return self.files[path]
+
+    def script(self, path: str, *statuses: int):
+        """
+        Answer the next requests for a file with the given statuses, in order, before behaving as usual.  A scripted
+        202 has an ETA of now.
+
+        :param path: the path of the file.
+        :param statuses: the status codes.
+        """
+
+        self.files[path].scripted_statuses.extend(statuses)
+
+    def start(self):
+        """
+        Start serving on a free port of the loopback interface, on a background thread.
+        """
+
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.emulator = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket.
+        """
+
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def requests_for(self, path: str, method="GET") -> list:
+        """
+        Return the requests received for a file.
+
+        :param path: the path of the file.
+        :param method: the HTTP method of the requests.
+        :return: a list of EmulatedRequest tuples, in the order they were answered.
+        """
+
+        with self._lock:
+            return [request for request in self.requests if request.path == path and request.method == method]
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str):
+        """
+        Answer a request; called by the server's request handler.
+
+        :param handler: the request handler of the connection.
+        :param method: the HTTP method of the request.
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = handler.path.lstrip("/")
+        status = self._respond(handler, method, path)
+
+        with self._lock:
+            self.requests.append(EmulatedRequest(method, path, dict(handler.headers), status))
+
+    def _respond(self, handler: BaseHTTPRequestHandler, method: str, path: str) -> int:
+        # Send the response to a request and return its status.
+
+        if self.credentials is not None and handler.headers.get("Authorization") not in self.credentials:
+            schemes = sorted({credential.split(" ")[0] for credential in self.credentials})
+            return _send_error(handler, 401, {"WWW-Authenticate": ", ".join(f'{scheme} realm="iRobot"'
+                                                                            for scheme in schemes)})
+
+        emulated_file = self.files.get(path)
+
+        if emulated_file is None:
+            return _send_error(handler, 404)
+
+        with self._lock:
+            scripted_status = emulated_file.scripted_statuses.popleft() if emulated_file.scripted_statuses else None
+
+            if emulated_file.ready_time is None:
+                emulated_file.ready_time = time.time() + emulated_file.fetch_delay
+            eta = emulated_file.ready_time
+
+        if scripted_status == 202 or (scripted_status is None and eta > time.time()):
+            return _send_fetching(handler, eta if scripted_status is None else time.time())
+
+        if scripted_status is not None:
+            return _send_error(handler, scripted_status) if scripted_status >= 400 else \
+                _send(handler, scripted_status, b"", {"ETag": emulated_file.etag})
+
+        if method == "POST":
+            return _send(handler, 201, b"")
+
+        accept = handler.headers.get("Accept", "")
+        if accept == media_types['METADATA']:
+            metadata = {"size": len(emulated_file.data), "checksum": emulated_file.etag}
+            return _send(handler, 200, json.dumps(metadata).encode(), {"Content-Type": media_types['METADATA']})
+
+        if accept == media_types['CHECKSUM']:
+            return self._send_chunk_checksums(handler, emulated_file)
+
+        if handler.headers.get("If-None-Match") == emulated_file.etag:
+            return _send(handler, 304, b"", {"ETag": emulated_file.etag})
+
+        return self._send_data(handler, method, emulated_file)
+
+    def _send_data(self, handler: BaseHTTPRequestHandler, method: str, emulated_file: EmulatedFile) -> int:
+        # Send the data of a file, or the byte range of it that was requested.
+
+        data = emulated_file.data
+        headers = {"ETag": emulated_file.etag, "Content-Type": media_types['DATA']}
+        byte_range = re.match(r"bytes=(\d+)-(\d*)$", handler.headers.get("Range", ""))
+
+        if not byte_range:
+            return _send(handler, 200, data, headers, self.bandwidth, method == "HEAD")
+
+        first_byte = int(byte_range.group(1))
+        last_byte = min(int(byte_range.group(2)), len(data) - 1) if byte_range.group(2) else len(data) - 1
+
+        if first_byte >= len(data) or first_byte > last_byte:
+            return _send_error(handler, 416, {"Content-Range": f"bytes */{len(data)}"})
+
+        headers["Content-Range"] = f"bytes {first_byte}-{last_byte}/{len(data)}"
+        return _send(handler, 206, data[first_byte:last_byte + 1], headers, self.bandwidth, method == "HEAD")
+
+    def _send_chunk_checksums(self, handler: BaseHTTPRequestHandler, emulated_file: EmulatedFile) -> int:
+        # Send the checksums of each chunk of a file as a multipart/byteranges body.
+
+        data = emulated_file.data
+        parts = []
+
+        for first_byte in range(0, len(data), self.checksum_chunk_size):
+            last_byte = min(first_byte + self.checksum_chunk_size, len(data)) - 1
+            checksum = hashlib.md5(data[first_byte:last_byte + 1]).hexdigest()
+            parts.append(f"--{MULTIPART_BOUNDARY}\r\nContent-Type: {media_types['CHECKSUM']}\r\n"
+                         f"Content-Range: bytes {first_byte}-{last_byte}/{len(data)}\r\n\r\n{checksum}\r\n")
+
+        body = ("".join(parts) + f"--{MULTIPART_BOUNDARY}--\r\n").encode()
+
+        return _send(handler, 206, body, {"Content-Type": f"multipart/byteranges; boundary={MULTIPART_BOUNDARY}"})
+
+
+def _send(handler: BaseHTTPRequestHandler, status: int, body: bytes, headers=None, bandwidth=None,
+          headers_only=False) -> int:
+    # Send a response, throttling its body to the bandwidth if there is one.
+
+    handler.send_response(status)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+
+    if headers_only:
+        return status
+
+    if not bandwidth:
+        handler.wfile.write(body)
+        return status
+
+    started = time.monotonic()
+    body = memoryview(body)
+
+    for offset in range(0, len(body), THROTTLE_WRITE_SIZE):
+        handler.wfile.write(body[offset:offset + THROTTLE_WRITE_SIZE])
+        ahead = (offset + THROTTLE_WRITE_SIZE) / bandwidth - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    return status
+
+
+def _send_error(handler: BaseHTTPRequestHandler, status: int, headers=None) -> int:
+    # Send an error response with the JSON description iRobot gives.
+
+    body = json.dumps({"status": status, "reason": handler.responses[status][0],
+                       "description": ERROR_DESCRIPTIONS.get(status, handler.responses[status][1])}).encode()
+
+    return _send(handler, status, body, {"Content-Type": "application/json", **(headers or {})})
+
+
+def _send_fetching(handler: BaseHTTPRequestHandler, eta: float) -> int:
+    # Send a 202 with the time the data should be ready, rounded up to the second as iRobot gives it.
+
+    eta_time = datetime.fromtimestamp(int(eta) + (eta > int(eta)), tz=timezone.utc)
+    body = json.dumps({"status": 202, "description": "Fetching the data from iRODS"}).encode()
+
+    return _send(handler, 202, body, {"Content-Type": "application/json",
+                                      "iRobot-ETA": f"{eta_time:%Y-%m-%dT%H:%M:%SZ%z} +/- 0"})
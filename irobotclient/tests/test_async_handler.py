@@ -0,0 +1,174 @@
+import unittest
+from unittest.mock import patch
+
+import asyncio
+import errno
+import hashlib
+import os
+import tempfile
+
+from irobotclient.async_handler import AsyncRequester, aiohttp, download_file, download_many
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.request_handler import ResponseCodes
+from irobotclient.tests.emulator import IrobotEmulator
+
+
+def _run(coroutine):
+    # Run a coroutine on a new event loop.
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class TestAsyncHandler(unittest.TestCase):
+    """
+    Assessing the asyncio requester and downloads against the local iRobot emulator.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._output_dir = self._temp_directory.name + '/'
+
+        self._emulator = IrobotEmulator(credentials=["Basic test_basic"])
+        self._emulator.start()
+
+    def tearDown(self):
+        self._emulator.stop()
+        self._temp_directory.cleanup()
+
+    def _requester(self) -> AsyncRequester:
+        return AsyncRequester({"Authorization": "Bearer test_token"}, self._emulator.url, ["Basic test_basic"])
+
+    def _download_many(self, file_paths: list, concurrency=100) -> list:
+        async def download() -> list:
+            async with self._requester() as request_handler:
+                return [result async for result in download_many(request_handler, file_paths, self._output_dir,
+                                                                 concurrency)]
+
+        return _run(download())
+
+    def test_download_many(self):
+        data = {f"dir/test{index}.cram": os.urandom(1000 * index) for index in range(1, 51)}
+        for file_path, file_data in data.items():
+            self._emulator.add_file(file_path, file_data)
+
+        results = self._download_many(list(data), concurrency=10)
+
+        self.assertEqual(sorted(result.file_path for result in results), sorted(data))
+        for result in results:
+            self.assertTrue(result.checksum_matched)
+            with open(result.save_location, "rb") as file:
+                self.assertEqual(file.read(), data[result.file_path])
+
+        # Only the first concurrent requests are rejected; later ones are sent with the negotiated credential.
+        self.assertLessEqual(sum(request.status == ResponseCodes['AUTHENTICATION_FAILED']
+                                 for request in self._emulator.requests), 10)
+
+    def test_closing_early_finishes_cancelled_downloads(self):
+        self._emulator.add_file("test.crai", b"data")
+        self._emulator.add_file("test.cram", b"data", fetch_delay=5)
+
+        async def download():
+            async with self._requester() as request_handler:
+                results = download_many(request_handler, ["test.crai", "test.cram"], self._output_dir)
+                result = await results.__anext__()
+                await results.aclose()
+                return result, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+        result, unfinished_tasks = _run(download())
+
+        self.assertEqual(result.file_path, "test.crai")
+        self.assertEqual(unfinished_tasks, [])
+
+    def test_fetching_file_is_waited_for(self):
+        self._emulator.add_file("test.cram", b"data", fetch_delay=1)
+
+        result, = self._download_many(["test.cram"])
+
+        self.assertTrue(result.checksum_matched)
+        self.assertEqual([request.status for request in self._emulator.requests_for("test.cram")][-2:],
+                         [ResponseCodes['FETCHING_DATA'], ResponseCodes['SUCCESS']])
+
+    @patch("irobotclient.async_handler.BACKOFF_BASE_DELAY", 0)
+    def test_overloaded_requests_are_retried(self):
+        self._emulator.add_file("test.cram", b"data")
+        self._emulator.script("test.cram", ResponseCodes['TIMEOUT'], ResponseCodes['PRECACHE_FULL'])
+
+        result, = self._download_many(["test.cram"])
+
+        self.assertTrue(result.checksum_matched)
+
+    def test_ranged_and_conditional_requests(self):
+        emulated_file = self._emulator.add_file("test.cram", b"0123456789")
+
+        async def request() -> tuple:
+            async with self._requester() as request_handler:
+                ranged_response = await request_handler.get_data("test.cram", byte_range=(2, 5))
+                ranged_data = await ranged_response.read()
+                matched_response = await request_handler.get_data("test.cram", etag=emulated_file.etag)
+                matched_response.release()
+                return ranged_response.status, ranged_data, matched_response.status
+
+        self.assertEqual(_run(request()), (ResponseCodes['RANGED_DATA'], b"2345", ResponseCodes['CLIENT_MATCHED']))
+
+    # The following tests assess exception handling
+    def test_fetching_data_without_waiting(self):
+        self._emulator.add_file("test.cram", b"data", fetch_delay=60)
+
+        async def request():
+            async with self._requester() as request_handler:
+                await request_handler.get_data("test.cram", wait_for_data=False)
+
+        with self.assertRaises(DataNotReadyException) as context:
+            _run(request())
+        self.assertGreater(context.exception.delay, 0)
+
+    def test_missing_file_is_reported_in_result(self):
+        async def download():
+            async with self._requester() as request_handler:
+                return await download_file(request_handler, "missing.cram", self._output_dir)
+
+        result = _run(download())
+
+        self.assertIsInstance(result.error, IrobotClientException)
+        self.assertEqual(result.error.errno, ResponseCodes['NOT_FOUND'])
+        self.assertEqual(os.listdir(self._output_dir), [])
+
+    def test_failed_download_leaves_no_part_file(self):
+        self._emulator.add_file("test.cram", b"data")
+
+        with patch("irobotclient.async_handler._write_and_hash", side_effect=OSError(errno.ENOSPC, "No space")):
+            result, = self._download_many(["test.cram"])
+
+        self.assertEqual(result.error.errno, errno.ENOSPC)
+        self.assertEqual(os.listdir(self._output_dir), [])
+
+    def test_cancelled_download_leaves_no_part_file(self):
+        self._emulator.add_file("test.cram", b"data" * 1000)
+
+        async def download():
+            async with self._requester() as request_handler:
+                task = asyncio.ensure_future(download_file(request_handler, "test.cram", self._output_dir, 4))
+                while not os.listdir(self._output_dir):
+                    await asyncio.sleep(0.001)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+        _run(download())
+
+        self.assertEqual(os.listdir(self._output_dir), [])
+
+    def test_corrupt_download_is_reported(self):
+        self._emulator.add_file("test.cram", b"data").etag = hashlib.md5(b"other").hexdigest()
+
+        result, = self._download_many(["test.cram"])
+
+        self.assertTrue(result.succeeded)
+        self.assertFalse(result.checksum_matched)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+
+import os
+import tempfile
+
+from irobotclient.auth_handler import AuthenticationCache
+
+
+class TestAuthenticationCache(unittest.TestCase):
+    """
+    Assessing how negotiated authentication schemes are remembered, persisted and expired.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._cache_location = os.path.join(self._temp_directory.name, "cache", "auth.json")
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    def test_scheme_is_remembered_in_memory(self):
+        authentication_cache = AuthenticationCache()
+        authentication_cache.record("irobot:5000", "Basic")
+
+        self.assertEqual(authentication_cache.get_scheme("irobot:5000"), "Basic")
+        self.assertIsNone(authentication_cache.get_scheme("other:5000"))
+
+    def test_scheme_is_persisted(self):
+        AuthenticationCache(self._cache_location).record("irobot:5000", "Basic")
+
+        self.assertEqual(AuthenticationCache(self._cache_location).get_scheme("irobot:5000"), "Basic")
+
+    def test_concurrent_runs_keep_each_others_schemes(self):
+        first_run = AuthenticationCache(self._cache_location)
+        second_run = AuthenticationCache(self._cache_location)
+
+        first_run.record("irobot1:5000", "Basic")
+        second_run.record("irobot2:5000", "Arvados")
+
+        authentication_cache = AuthenticationCache(self._cache_location)
+        self.assertEqual(authentication_cache.get_scheme("irobot1:5000"), "Basic")
+        self.assertEqual(authentication_cache.get_scheme("irobot2:5000"), "Arvados")
+
+    def test_scheme_expires(self):
+        with patch("time.time", return_value=1000):
+            AuthenticationCache(self._cache_location, ttl=60).record("irobot:5000", "Basic")
+
+        with patch("time.time", return_value=1059):
+            self.assertEqual(AuthenticationCache(self._cache_location).get_scheme("irobot:5000"), "Basic")
+
+        with patch("time.time", return_value=1061):
+            self.assertIsNone(AuthenticationCache(self._cache_location).get_scheme("irobot:5000"))
+
+    def test_unreadable_cache_file_is_ignored(self):
+        os.makedirs(os.path.dirname(self._cache_location))
+        with open(self._cache_location, "w") as cache_file:
+            cache_file.write("not json")
+
+        self.assertIsNone(AuthenticationCache(self._cache_location).get_scheme("irobot:5000"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+import io
+import requests
+import threading
+import time
+
+from irobotclient.bandwidth_handler import BandwidthLimiter
+
+
+class _RawStream(io.BytesIO):
+    # A raw response stream, whose reads take the arguments of urllib3's.
+
+    def read(self, amt=None, decode_content=None):
+        return super().read(amt)
+
+
+def _response(data: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = _RawStream(data)
+
+    return response
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+    """
+    Assessing how the bandwidth limiter paces the data of responses, and how it shares the bandwidth between files.
+    """
+    def setUp(self):
+        self._data = bytes(range(256)) * 1200
+
+    def test_data_is_read_intact(self):
+        limiter = BandwidthLimiter(10 * 1024 * 1024, 10 * 1024 * 1024)
+
+        buffer = bytearray(len(self._data) + 10)
+        raw = limiter.throttle(_response(self._data), "file").raw
+        filled = 0
+        while True:
+            length = raw.readinto(memoryview(buffer)[filled:])
+            if not length:
+                break
+            filled += length
+
+        self.assertEqual(buffer[:filled], self._data)
+        self.assertEqual(b"".join(limiter.throttle(_response(self._data), "file").iter_content(100000)), self._data)
+        self.assertEqual(limiter.throttle(_response(self._data), "file").raw.read(), self._data)
+
+    def test_reads_are_granted_a_quantum_at_most(self):
+        limiter = BandwidthLimiter(10 * 1024 * 1024, quantum=1000)
+
+        self.assertEqual(len(limiter.throttle(_response(self._data), "file").raw.read(5000)), 1000)
+
+    def test_overall_rate_is_kept(self):
+        limiter = BandwidthLimiter(1000000)
+        responses = [limiter.throttle(_response(self._data), f"file{index}") for index in range(2)]
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=lambda response=response: response.raw.read()) for response in responses]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The bucket starts with 100000 bytes in it.
+        self.assertGreaterEqual(time.monotonic() - start, (2 * len(self._data) - 100000) / 1000000 - 0.05)
+
+    def test_file_rate_is_shared_by_its_responses(self):
+        limiter = BandwidthLimiter(file_rate=1000000)
+        responses = [limiter.throttle(_response(self._data), "file") for _ in range(2)]
+
+        start = time.monotonic()
+        for response in responses:
+            response.raw.read()
+
+        self.assertGreaterEqual(time.monotonic() - start, (2 * len(self._data) - 100000) / 1000000 - 0.05)
+
+    def test_files_take_turns(self):
+        limiter = BandwidthLimiter(100, quantum=10)
+        limiter._tokens = 0
+        granted = []
+
+        def take(file_path):
+            limiter._take(file_path, 10)
+            granted.append(file_path)
+
+        # Three connections of a large file queue up before the only connection of a small one.
+        threads = []
+        for file_path in ("cram", "cram", "cram", "crai"):
+            threads.append(threading.Thread(target=take, args=(file_path,)))
+            threads[-1].start()
+            while sum(len(tickets) for tickets in limiter._waiting.values()) < len(threads) - len(granted):
+                time.sleep(0.001)
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(granted, ["cram", "crai", "cram", "cram"])
+
+    def test_unread_grants_are_refunded(self):
+        limiter = BandwidthLimiter(1000000)
+
+        self.assertEqual(limiter.throttle(_response(b"small"), "file").raw.read(), b"small")
+        self.assertGreater(limiter._tokens, 100000 - 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+import errno
+import os
+import tempfile
+
+from unittest.mock import patch
+
+from irobotclient.cache_handler import DownloadCache, reflink_or_copy
+
+
+class TestDownloadCache(unittest.TestCase):
+    """
+    Assessing adding files to, copying them out of and evicting them from the download cache.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._cache = DownloadCache(os.path.join(self._temp_directory.name, "cache"), max_size=20)
+
+    def tearDown(self):
+        self._cache.close()
+        self._temp_directory.cleanup()
+
+    def _make_file(self, name: str, data: bytes) -> str:
+        location = os.path.join(self._temp_directory.name, name)
+        with open(location, "wb") as file:
+            file.write(data)
+        return location
+
+    def _read_file(self, name: str) -> bytes:
+        with open(os.path.join(self._temp_directory.name, name), "rb") as file:
+            return file.read()
+
+    def test_reflink_or_copy(self):
+        source = self._make_file("source", b"test data")
+        destination = self._make_file("destination", b"old data")
+
+        reflink_or_copy(source, destination)
+
+        self.assertEqual(self._read_file("destination"), b"test data")
+        self.assertEqual(sorted(os.listdir(self._temp_directory.name)), ["cache", "destination", "source"])
+
+    @unittest.skipUnless(hasattr(os, "copy_file_range"), "The kernel copy is not available")
+    def test_copy_between_file_systems(self):
+        source = self._make_file("source", b"test data")
+
+        with patch("irobotclient.cache_handler._reflink", side_effect=OSError(errno.EOPNOTSUPP, "Not supported")), \
+                patch("os.copy_file_range", side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+            reflink_or_copy(source, os.path.join(self._temp_directory.name, "destination"))
+
+        self.assertEqual(self._read_file("destination"), b"test data")
+
+    def test_added_file_can_be_materialized(self):
+        self._cache.add("dir/test.cram", "abc123", self._make_file("test.cram", b"test data"))
+        os.unlink(os.path.join(self._temp_directory.name, "test.cram"))
+
+        self.assertEqual(self._cache.get_etag("dir/test.cram"), "abc123")
+        self.assertTrue(self._cache.materialize("abc123", os.path.join(self._temp_directory.name, "copy.cram")))
+        self.assertEqual(self._read_file("copy.cram"), b"test data")
+
+    def test_output_changed_in_place_leaves_cache_intact(self):
+        self._cache.add("dir/test.cram", "abc123", self._make_file("test.cram", b"test data"))
+        with open(os.path.join(self._temp_directory.name, "test.cram"), "r+b") as file:
+            file.write(b"TEST")
+
+        self.assertTrue(self._cache.materialize("abc123", os.path.join(self._temp_directory.name, "copy.cram")))
+        with open(os.path.join(self._temp_directory.name, "copy.cram"), "r+b") as file:
+            file.write(b"BEST")
+
+        self.assertTrue(self._cache.materialize("abc123", os.path.join(self._temp_directory.name, "again.cram")))
+        self.assertEqual(self._read_file("again.cram"), b"test data")
+
+    def test_uncached_data_is_not_materialized(self):
+        self.assertIsNone(self._cache.get_etag("dir/test.cram"))
+        self.assertFalse(self._cache.materialize("abc123", os.path.join(self._temp_directory.name, "copy.cram")))
+
+    def test_unusual_etags_are_not_cached(self):
+        self._cache.add("dir/test.cram", "../abc123", self._make_file("test.cram", b"test data"))
+
+        self.assertIsNone(self._cache.get_etag("dir/test.cram"))
+
+    def test_least_recently_used_files_are_evicted(self):
+        self._cache.add("test.cram", "abc1", self._make_file("test.cram", b"0123456789"))
+        self._cache.add("test.bam", "abc2", self._make_file("test.bam", b"0123456789"))
+        self._cache.materialize("abc1", os.path.join(self._temp_directory.name, "copy.cram"))
+        self._cache.add("test.crai", "abc3", self._make_file("test.crai", b"0123456789"))
+
+        self.assertEqual(self._cache.get_etag("test.cram"), "abc1")
+        self.assertIsNone(self._cache.get_etag("test.bam"))
+        self.assertEqual(self._cache.get_etag("test.crai"), "abc3")
+        self.assertFalse(self._cache.materialize("abc2", os.path.join(self._temp_directory.name, "copy.bam")))
+
+
+if __name__ == '__main__':
+    unittest.main()
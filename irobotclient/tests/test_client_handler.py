@@ -0,0 +1,120 @@
+import unittest
+
+import base64
+import errno
+import hashlib
+import os
+import tempfile
+
+from irobotclient import IrobotClient, IrobotClientException
+from irobotclient.request_handler import ResponseCodes
+from irobotclient.tests.emulator import IrobotEmulator
+
+EMULATOR_TOKEN = "testtoken"
+EMULATOR_USER = "testuser"
+EMULATOR_PASSWORD = "testpass"
+
+
+class TestIrobotClient(unittest.TestCase):
+    """
+    Assessing the programmatic interface against the local iRobot emulator.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._output_dir = self._temp_directory.name + '/'
+
+        basic_credential = base64.b64encode(f"{EMULATOR_USER}:{EMULATOR_PASSWORD}".encode()).decode()
+        self._emulator = IrobotEmulator(credentials=[f"Basic {basic_credential}"])
+        self._emulator.start()
+
+        self._client = IrobotClient(self._emulator.url, self._output_dir, EMULATOR_TOKEN, EMULATOR_USER,
+                                    EMULATOR_PASSWORD, coalesce=False)
+
+    def tearDown(self):
+        self._client.close()
+        self._emulator.stop()
+        self._temp_directory.cleanup()
+
+    def test_download(self):
+        data = os.urandom(100000)
+        self._emulator.add_file("dir/test.cram", data)
+
+        result = self._client.download("dir/test.cram")
+
+        self.assertEqual(result.save_location, self._output_dir + "test.cram")
+        self.assertEqual(result.checksum, hashlib.md5(data).hexdigest())
+        self.assertEqual(result.metrics.bytes, len(data))
+        self.assertEqual(result.metrics.status, "downloaded")
+        self.assertIsNotNone(result.metrics.time_to_first_byte)
+
+    def test_authentication_is_shared_between_calls(self):
+        self._emulator.add_file("test1.cram", b"data1")
+        self._emulator.add_file("test2.cram", b"data2")
+
+        self._client.download("test1.cram")
+        self._client.download("test2.cram")
+
+        self.assertEqual([request.status for request in self._emulator.requests],
+                         [ResponseCodes['AUTHENTICATION_FAILED'], ResponseCodes['SUCCESS'], ResponseCodes['SUCCESS']])
+
+    def test_download_many(self):
+        data = {f"test{index}.cram": os.urandom(1000 * index) for index in range(1, 21)}
+        for file_path, file_data in data.items():
+            self._emulator.add_file(file_path, file_data)
+        self._emulator.files["test1.cram"].fetch_delay = 1
+
+        futures = self._client.download_many(list(data) + ["test2.cram"])
+
+        self.assertEqual(len(futures), 21)
+        self.assertIs(futures[1], futures[20])
+        for file_path, future in zip(data, futures):
+            result = future.result(timeout=30)
+            self.assertEqual(result.file_path, file_path)
+            self.assertEqual(result.checksum, hashlib.md5(data[file_path]).hexdigest())
+        self.assertGreater(futures[0].result().metrics.fetch_wait, 0)
+
+    def test_iter_download_of_duplicate_paths(self):
+        data = {"a/x.cram": os.urandom(1000000), "a/x.crai": os.urandom(1000)}
+        for file_path, file_data in data.items():
+            self._emulator.add_file(file_path, file_data)
+
+        results = list(self._client.iter_download(["a/x.cram", "a/x.crai", "a/x.crai", "a/x.cram"]))
+
+        self.assertEqual(sorted(result.file_path for result in results), ["a/x.crai", "a/x.crai", "a/x.cram",
+                                                                          "a/x.cram"])
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(result.checksum, hashlib.md5(data[result.file_path]).hexdigest())
+        self.assertEqual(sorted(os.listdir(self._output_dir)), ["x.crai", "x.cram"])
+
+    def test_close_waits_for_download_many(self):
+        self._emulator.add_file("test.cram", b"data", fetch_delay=1)
+
+        future, = self._client.download_many(["test.cram"])
+        self._client.close()
+
+        self.assertTrue(future.done())
+        self.assertTrue(os.path.exists(self._output_dir + "test.cram"))
+
+    # The following tests assess exception handling
+    def test_missing_file_is_raised(self):
+        with self.assertRaises(IrobotClientException) as context:
+            self._client.download("missing.cram")
+        self.assertEqual(context.exception.errno, ResponseCodes['NOT_FOUND'])
+
+    def test_corrupt_file_is_raised(self):
+        self._emulator.add_file("test.cram", b"data").etag = hashlib.md5(b"other").hexdigest()
+
+        future, = self._client.download_many(["test.cram"])
+
+        with self.assertRaises(IrobotClientException) as context:
+            future.result(timeout=30)
+        self.assertEqual(context.exception.errno, errno.EIO)
+
+    def test_credentials_not_set_exception(self):
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EACCES}", IrobotClient, self._emulator.url,
+                               self._output_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+import threading
+
+from irobotclient.concurrency_handler import ConcurrencyLimiter
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    """
+    Assessing how the concurrency limit responds to successes and overloads, and how it holds back downloads.
+    """
+    def test_limit_grows_additively(self):
+        limiter = ConcurrencyLimiter(2, 4)
+
+        # 2 + 1/2 + 1/2.5 + 1/2.9
+        for _ in range(3):
+            limiter.succeeded()
+        self.assertEqual(limiter.limit, 3)
+
+        for _ in range(100):
+            limiter.succeeded()
+        self.assertEqual(limiter.limit, 4)
+
+    def test_limit_is_cut_multiplicatively(self):
+        limiter = ConcurrencyLimiter(8)
+
+        with patch("time.monotonic", side_effect=[0, 10, 20, 30]):
+            limiter.overloaded()
+            self.assertEqual(limiter.limit, 4)
+            limiter.overloaded()
+            self.assertEqual(limiter.limit, 2)
+            limiter.overloaded()
+            limiter.overloaded()
+            self.assertEqual(limiter.limit, 1)
+
+    def test_one_overload_episode_cuts_once(self):
+        limiter = ConcurrencyLimiter(8)
+
+        with patch("time.monotonic", side_effect=[0, 0.1, 0.2]):
+            for _ in range(3):
+                limiter.overloaded()
+
+        self.assertEqual(limiter.limit, 4)
+
+    def test_slots_are_limited(self):
+        limiter = ConcurrencyLimiter(1)
+        second_slot_taken = threading.Event()
+
+        def take_slot():
+            with limiter.slot():
+                second_slot_taken.set()
+
+        with limiter.slot():
+            thread = threading.Thread(target=take_slot)
+            thread.start()
+            self.assertFalse(second_slot_taken.wait(0.2))
+
+        self.assertTrue(second_slot_taken.wait(5))
+        thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,7 +23,34 @@ class TestConfigurationSetup(unittest.TestCase):
                                         basic_password=None,
                                         force=False,
                                         no_index=False,
-                                        override_url=False)
+                                        override_url=False,
+                                        pool_connections=4,
+                                        pool_maxsize=10,
+                                        no_keep_alive=False,
+                                        jobs=4,
+                                        manifest=None,
+                                        prefetch=False,
+                                        prefetch_only=False,
+                                        segments=1,
+                                        segment_size=67108864,
+                                        memory_budget=268435456,
+                                        chunk_size=8388608,
+                                        skip_unchanged=False,
+                                        index_file=None,
+                                        cache_dir=None,
+                                        cache_size=107374182400,
+                                        no_coalesce=False,
+                                        preflight=False,
+                                        max_jobs=None,
+                                        auth_cache=None,
+                                        auth_cache_ttl=86400,
+                                        metrics=None,
+                                        metrics_textfile=None,
+                                        trace=None,
+                                        daemon_socket=None,
+                                        no_daemon=False,
+                                        max_bandwidth=None,
+                                        max_file_bandwidth=None)
 
         self._old_listdir = os.listdir
         os.listdir = MagicMock(spec=os.listdir)
@@ -47,7 +74,13 @@ class TestConfigurationSetup(unittest.TestCase):
         os.getenv.return_value = "test_url"
 
         args = ['/input', 'output', '-u', 'http://irobot/address', '--arvados_token', 'abc123',
-                '--basic_username', 'tester', '--basic_password', 'test', '-f', '--no_index', '-o']
+                '--basic_username', 'tester', '--basic_password', 'test', '-f', '--no_index', '-o',
+                '--pool_connections', '2', '--pool_maxsize', '8', '--no_keep_alive', '-j', '3', '--prefetch',
+                '--segments', '4', '--chunk_size', '1048576', '--cache_dir', 'cache', '--cache_size', '1073741824',
+                '--no_coalesce', '--preflight', '--max_jobs', '8', '--auth_cache', 'auth.json',
+                '--auth_cache_ttl', '60', '--metrics', 'metrics.jsonl', '--metrics_textfile', 'run.prom',
+                '--trace', 'trace.json', '--daemon_socket', 'daemon.sock', '--no_daemon',
+                '--max_bandwidth', '1000000', '--max_file_bandwidth', '250000']
 
         self.assertEqual(configuration_handler.run(args),
                          argparse.Namespace(input_file="input",            # leading '/' removed
@@ -58,7 +91,34 @@ class TestConfigurationSetup(unittest.TestCase):
                                             basic_password='test',
                                             force=True,                    # overwrite "input" in output_dir
                                             no_index=True,                 # don't download index files
-                                            override_url=True))            # override the environment var url
+                                            override_url=True,             # override the environment var url
+                                            pool_connections=2,
+                                            pool_maxsize=8,
+                                            no_keep_alive=True,            # close connections after each request
+                                            jobs=3,
+                                            manifest=None,
+                                            prefetch=True,
+                                            prefetch_only=False,
+                                            segments=4,
+                                            segment_size=67108864,
+                                            memory_budget=268435456,
+                                            chunk_size=1048576,
+                                            skip_unchanged=False,
+                                            index_file=None,
+                                            cache_dir="cache",
+                                            cache_size=1073741824,
+                                            no_coalesce=True,
+                                            preflight=True,
+                                            max_jobs=8,
+                                            auth_cache="auth.json",
+                                            auth_cache_ttl=60,
+                                            metrics="metrics.jsonl",
+                                            metrics_textfile="run.prom",
+                                            trace="trace.json",
+                                            daemon_socket="daemon.sock",
+                                            no_daemon=True,
+                                            max_bandwidth=1000000,
+                                            max_file_bandwidth=250000))
 
     def test_config_run_with_env_vars_set_but_no_optional_args_set(self):
         """
@@ -67,7 +127,7 @@ class TestConfigurationSetup(unittest.TestCase):
         :return:
         """
 
-        os.getenv.side_effect = ["test_url/", "test_token", "test_user", "test_password"]
+        os.getenv.side_effect = ["test_url/", "test_token", "test_user", "test_password", "test_cache/"]
 
         args = ['input', 'output/']
 
@@ -80,7 +140,34 @@ class TestConfigurationSetup(unittest.TestCase):
                                             basic_password='test_password',    # set via getenv
                                             force=False,                       # default value
                                             no_index=False,                    # default value
-                                            override_url=False))               # default value
+                                            override_url=False,                # default value
+                                            pool_connections=4,                # default value
+                                            pool_maxsize=10,                   # default value
+                                            no_keep_alive=False,               # default value
+                                            jobs=4,                            # default value
+                                            manifest=None,                     # default value
+                                            prefetch=False,                    # default value
+                                            prefetch_only=False,               # default value
+                                            segments=1,                        # default value
+                                            segment_size=67108864,             # default value
+                                            memory_budget=268435456,           # default value
+                                            chunk_size=8388608,                # default value
+                                            skip_unchanged=False,              # default value
+                                            index_file=None,                   # default value
+                                            cache_dir="test_cache/",           # set via getenv
+                                            cache_size=107374182400,           # default value
+                                            no_coalesce=False,                 # default value
+                                            preflight=False,                   # default value
+                                            max_jobs=None,                     # default value
+                                            auth_cache=None,                   # default value
+                                            auth_cache_ttl=86400,              # default value
+                                            metrics=None,                      # default value
+                                            metrics_textfile=None,             # default value
+                                            trace=None,                        # default value
+                                            daemon_socket=None,                # default value
+                                            no_daemon=False,                   # default value
+                                            max_bandwidth=None,                # default value
+                                            max_file_bandwidth=None))          # default value
 
     def test_config_run_with_override_url_set(self):
         """
@@ -88,7 +175,7 @@ class TestConfigurationSetup(unittest.TestCase):
 
         :return:
         """
-        os.getenv.side_effect = ["test_url/", "test_token", "test_user", "test_password", "test_url/"]
+        os.getenv.side_effect = ["test_url/", "test_token", "test_user", "test_password", None, "test_url/"]
 
         args = ['input', 'output/', '-o']
 
@@ -101,9 +188,74 @@ class TestConfigurationSetup(unittest.TestCase):
                                             basic_password='test_password',  # set via getenv
                                             force=False,                     # default value
                                             no_index=False,                  # default value
-                                            override_url=True))              # Override the environment variable URL
+                                            override_url=True,               # Override the environment variable URL
+                                            pool_connections=4,              # default value
+                                            pool_maxsize=10,                 # default value
+                                            no_keep_alive=False,             # default value
+                                            jobs=4,                          # default value
+                                            manifest=None,                   # default value
+                                            prefetch=False,                  # default value
+                                            prefetch_only=False,             # default value
+                                            segments=1,                      # default value
+                                            segment_size=67108864,           # default value
+                                            memory_budget=268435456,         # default value
+                                            chunk_size=8388608,              # default value
+                                            skip_unchanged=False,            # default value
+                                            index_file=None,                 # default value
+                                            cache_dir=None,                  # default value
+                                            cache_size=107374182400,         # default value
+                                            no_coalesce=False,               # default value
+                                            preflight=False,                 # default value
+                                            max_jobs=None,                   # default value
+                                            auth_cache=None,                 # default value
+                                            auth_cache_ttl=86400,            # default value
+                                            metrics=None,                    # default value
+                                            metrics_textfile=None,           # default value
+                                            trace=None,                      # default value
+                                            daemon_socket=None,              # default value
+                                            no_daemon=False,                 # default value
+                                            max_bandwidth=None,              # default value
+                                            max_file_bandwidth=None))        # default value
+
+    def test_config_run_with_manifest(self):
+        """
+        Test that a manifest can be given in place of the input file.
+
+        :return:
+        """
+        os.getenv.side_effect = ["test_url/", "test_token", "test_user", "test_password", None]
+
+        args = ['output/', '--manifest', '-']
+
+        config = configuration_handler.run(args)
+        self.assertIsNone(config.input_file)
+        self.assertEqual(config.manifest, '-')
+        self.assertEqual(config.output_dir, "output/")
+
+    def test_config_run_with_stream_output(self):
+        """
+        Test that '-' is taken as the standard output rather than a directory.
+
+        :return:
+        """
+        os.getenv.side_effect = ["test_url/", "test_token", "test_user", "test_password", None]
+
+        config = configuration_handler.run(['input.cram', '-'])
+        self.assertEqual(config.output_dir, '-')
+        os.listdir.assert_not_called()
 
     # The following tests assess exception handling.
+    def test_input_file_and_manifest_exception(self):
+        self._args.input_file = "input"
+        self._args.manifest = "manifest.txt"
+        self.assertRaisesRegex(IrobotClientException, f'{errno.EINVAL}',
+                               configuration_handler._check_input_file_argument, self._args)
+
+    def test_manifest_not_exist_exception(self):
+        self._args.manifest = "non_existant_manifest.txt"
+        self.assertRaisesRegex(IrobotClientException, f'{errno.ENOENT}',
+                               configuration_handler._check_input_file_argument, self._args)
+
     def test_input_file_is_directory_exception(self):
         self._args.input_file = "/input/"
         self.assertRaisesRegex(IrobotClientException, f'{errno.ECONNABORTED}',
@@ -117,6 +269,12 @@ class TestConfigurationSetup(unittest.TestCase):
         self.assertRaisesRegex(OSError, "directory",
                                configuration_handler._check_output_directory_argument, self._args)
 
+    def test_manifest_streamed_exception(self):
+        self._args.manifest = "manifest.txt"
+        self._args.output_dir = "-"
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EINVAL}",
+                               configuration_handler._check_output_directory_argument, self._args)
+
     def test_file_exist_in_output_dir_but_no_force_set_exception(self):
         os.listdir.return_value = {"hello.cram", "test.cram"}
 
@@ -126,6 +284,31 @@ class TestConfigurationSetup(unittest.TestCase):
         self.assertRaisesRegex(IrobotClientException, f"{errno.EEXIST}",
                                configuration_handler._check_output_directory_argument, self._args)
 
+    def test_invalid_connection_pool_size_exception(self):
+        self._args.pool_maxsize = 0
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EINVAL}",
+                               configuration_handler._check_connection_pool_arguments, self._args)
+
+    def test_invalid_jobs_exception(self):
+        self._args.jobs = 0
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EINVAL}",
+                               configuration_handler._check_jobs_argument, self._args)
+
+    def test_invalid_segment_exception(self):
+        self._args.segment_size = 0
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EINVAL}",
+                               configuration_handler._check_segment_arguments, self._args)
+
+    def test_invalid_bandwidth_exception(self):
+        self._args.max_file_bandwidth = 0
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EINVAL}",
+                               configuration_handler._check_bandwidth_arguments, self._args)
+
+    def test_invalid_cache_size_exception(self):
+        self._args.cache_size = 0
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EINVAL}",
+                               configuration_handler._check_cache_arguments, self._args)
+
     def test_credentials_not_set_exception(self):
         self.assertRaisesRegex(IrobotClientException, f"{errno.EACCES}",
                                configuration_handler._check_authorisation_credentials, self._args)
@@ -0,0 +1,164 @@
+import unittest
+
+import base64
+import errno
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+
+from unittest.mock import patch
+
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.daemon_handler import DaemonClient, IrobotDaemon, get_default_socket, is_listening, is_trusted
+from irobotclient.request_handler import ResponseCodes
+from irobotclient.tests.emulator import IrobotEmulator
+
+EMULATOR_TOKEN = "testtoken"
+EMULATOR_USER = "testuser"
+EMULATOR_PASSWORD = "testpass"
+
+
+class TestDaemon(unittest.TestCase):
+    """
+    Assessing runs handed to the daemon over its socket, against the local iRobot emulator.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._output_dir = self._temp_directory.name + '/'
+        self._socket_location = self._temp_directory.name + '/daemon.sock'
+
+        basic_credential = base64.b64encode(f"{EMULATOR_USER}:{EMULATOR_PASSWORD}".encode()).decode()
+        self._emulator = IrobotEmulator(credentials=[f"Basic {basic_credential}"])
+        self._emulator.start()
+
+        self._daemon = IrobotDaemon(self._socket_location)
+        self._daemon_thread = threading.Thread(target=self._daemon.serve_forever)
+        self._daemon_thread.start()
+
+    def tearDown(self):
+        self._daemon.shutdown()
+        self._daemon_thread.join()
+        self._daemon.server_close()
+        self._emulator.stop()
+        self._temp_directory.cleanup()
+
+    def _client(self) -> DaemonClient:
+        return DaemonClient(self._socket_location, url=self._emulator.url, output_dir=self._output_dir,
+                            arvados_token=EMULATOR_TOKEN, basic_username=EMULATOR_USER,
+                            basic_password=EMULATOR_PASSWORD, coalesce=False)
+
+    def test_download(self):
+        data = {f"test{index}.cram": os.urandom(1000 * index) for index in range(1, 11)}
+        for file_path, file_data in data.items():
+            self._emulator.add_file(file_path, file_data)
+
+        results = list(self._client().iter_download(iter(data)))
+
+        self.assertEqual(sorted(result.file_path for result in results), sorted(data))
+        for result in results:
+            self.assertEqual(result.checksum, hashlib.md5(data[result.file_path]).hexdigest())
+            self.assertEqual(result.metrics.bytes, len(data[result.file_path]))
+            with open(result.save_location, "rb") as file:
+                self.assertEqual(file.read(), data[result.file_path])
+
+    def test_authentication_is_kept_warm_between_runs(self):
+        self._emulator.add_file("test1.cram", b"data1")
+        self._emulator.add_file("test2.cram", b"data2")
+
+        list(self._client().iter_download(["test1.cram"]))
+        list(self._client().iter_download(["test2.cram"]))
+
+        self.assertEqual([request.status for request in self._emulator.requests],
+                         [ResponseCodes['AUTHENTICATION_FAILED'], ResponseCodes['SUCCESS'], ResponseCodes['SUCCESS']])
+
+    def test_calls_are_chained(self):
+        self._emulator.add_file("small.cram", b"data")
+        self._emulator.add_file("large.cram", b"more data")
+
+        client = self._client()
+        planned = (result.file_path for result in client.preflight(["small.cram", "large.cram"]))
+        results = list(client.iter_download(result.file_path for result in client.prefetch(planned)))
+
+        self.assertEqual(sorted(result.file_path for result in results), ["large.cram", "small.cram"])
+
+    def test_relative_output_dir_is_made_absolute(self):
+        client = DaemonClient(self._socket_location, output_dir="output", metrics="metrics.jsonl")
+
+        self.assertEqual(client._options["output_dir"], os.path.abspath("output") + "/")
+        self.assertEqual(client._options["metrics"], os.path.abspath("metrics.jsonl"))
+
+    # The following tests assess exception handling
+    def test_missing_file_is_reported_in_result(self):
+        result, = self._client().iter_download(["missing.cram"])
+
+        self.assertIsInstance(result.error, IrobotClientException)
+        self.assertEqual(result.error.errno, ResponseCodes['NOT_FOUND'])
+
+    def test_run_error_is_raised(self):
+        client = DaemonClient(self._socket_location, url=self._emulator.url, output_dir=self._output_dir)
+
+        with self.assertRaises(IrobotClientException) as context:
+            list(client.iter_download(["test.cram"]))
+        self.assertEqual(context.exception.errno, errno.EACCES)
+
+    def test_file_path_error_is_raised(self):
+        def file_paths():
+            raise IrobotClientException(errno.ENOSPC, "No room.")
+            yield
+
+        with self.assertRaises(IrobotClientException) as context:
+            list(self._client().iter_download(file_paths()))
+        self.assertEqual(context.exception.errno, errno.ENOSPC)
+
+    def test_second_daemon_exception(self):
+        self.assertTrue(is_listening(self._socket_location))
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EADDRINUSE}", IrobotDaemon, self._socket_location)
+
+    def test_not_listening(self):
+        self.assertFalse(is_listening(self._temp_directory.name + '/other.sock'))
+
+    def test_socket_is_trusted(self):
+        self.assertEqual(os.stat(self._socket_location).st_mode & 0o777, 0o600)
+        self.assertTrue(is_trusted(self._socket_location))
+
+    def test_accessible_socket_is_not_trusted(self):
+        os.chmod(self._socket_location, 0o666)
+
+        self.assertTrue(is_listening(self._socket_location))
+        self.assertFalse(is_trusted(self._socket_location))
+
+    def test_socket_of_other_user_is_not_trusted(self):
+        with patch("os.getuid", return_value=os.getuid() + 1):
+            self.assertFalse(is_trusted(self._socket_location))
+
+    @unittest.skipUnless(hasattr(socket, "SO_PEERCRED"), "The platform cannot tell who is at the other end")
+    def test_daemon_of_other_user_is_not_sent_options(self):
+        with patch("os.getuid", side_effect=[os.getuid() + 1]):
+            with self.assertRaises(IrobotClientException) as context:
+                list(self._client().iter_download(["test.cram"]))
+        self.assertEqual(context.exception.errno, errno.EACCES)
+
+    def test_default_socket_is_in_private_directory(self):
+        with patch.dict(os.environ, {"XDG_RUNTIME_DIR": ""}), \
+                patch("tempfile.gettempdir", return_value=self._temp_directory.name):
+            socket_location = get_default_socket()
+            daemon = IrobotDaemon(socket_location)
+            daemon.server_close()
+
+        self.assertEqual(os.path.dirname(os.path.dirname(socket_location)), self._temp_directory.name)
+        self.assertEqual(os.stat(os.path.dirname(socket_location)).st_mode & 0o777, 0o700)
+
+    def test_shared_socket_directory_exception(self):
+        shared_directory = self._temp_directory.name + f"/irobotclient-{os.getuid()}"
+        os.mkdir(shared_directory)
+        os.chmod(shared_directory, 0o777)
+
+        with patch.dict(os.environ, {"XDG_RUNTIME_DIR": ""}), \
+                patch("tempfile.gettempdir", return_value=self._temp_directory.name):
+            self.assertRaisesRegex(IrobotClientException, f"{errno.EACCES}", IrobotDaemon, get_default_socket())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,417 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import errno
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from contextlib import redirect_stdout
+
+import requests
+
+from irobotclient.cache_handler import DownloadCache
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.download_handler import DownloadEngine, _download_data, prefetch_files, stream_file, \
+    PROGRESS_LOGGER
+from irobotclient.index_handler import ChecksumIndex
+from irobotclient.metrics_handler import MetricsRecorder
+from irobotclient.request_handler import Requester, ResponseCodes, REQUEST_LIMIT
+from irobotclient.resume_handler import PartialDownload
+
+
+def _make_response(url: str, data: bytes, checksum=None) -> requests.Response:
+    # Build a successful streamed response carrying the given data.
+
+    response = requests.Response()
+    response.status_code = ResponseCodes['SUCCESS']
+    response.url = url
+    response.raw = io.BytesIO(data)
+    response.headers['ETag'] = checksum if checksum else hashlib.md5(data).hexdigest()
+    return response
+
+
+class TestDownloadEngine(unittest.TestCase):
+    """
+    Assessing the download engine: data written to disk, checksums and how failures are reported per file.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._output_dir = self._temp_directory.name + '/'
+        self._log = MagicMock()
+
+        self._requester = MagicMock(spec=Requester)
+        self._requester.get_chunk_checksums.return_value = []
+        self._requester.get_data.side_effect = lambda file_path, **kwargs: _make_response(f"http://testURL/{file_path}",
+                                                                               file_path.encode())
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    def test_download_data_writes_file_and_returns_checksum(self):
+        data = b"some test data" * 1000
+        save_location = self._output_dir + "test.cram"
+
+        checksum = _download_data(_make_response("http://testURL/test.cram", data), save_location)
+
+        self.assertEqual(checksum, hashlib.md5(data).hexdigest())
+        with open(save_location, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+    def test_download_data_pipelined(self):
+        data = os.urandom(100000)
+        save_location = self._output_dir + "test.cram"
+        response = _make_response("http://testURL/test.cram", data)
+        response.headers['Content-Length'] = str(len(data))
+
+        checksum = _download_data(response, save_location, chunk_size=1000)
+
+        self.assertEqual(checksum, hashlib.md5(data).hexdigest())
+        with open(save_location, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+    def test_download_all_files(self):
+        file_list = ["dir/test.bam", "dir/test.bai", "dir/test.pbi"]
+
+        results = list(DownloadEngine(self._requester, self._output_dir, jobs=2, log=self._log).download(file_list))
+
+        self.assertEqual(sorted(result.file_path for result in results), sorted(file_list))
+        for result in results:
+            self.assertTrue(result.succeeded)
+            self.assertTrue(result.checksum_matched)
+            self.assertTrue(os.path.exists(result.save_location))
+
+    def test_files_are_downloaded_concurrently(self):
+        # Both downloads have to be in progress at the same time for the barrier to be passed.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get_data(file_path, **kwargs):
+            barrier.wait()
+            return _make_response(f"http://testURL/{file_path}", b"data")
+
+        self._requester.get_data.side_effect = get_data
+
+        results = list(DownloadEngine(self._requester, self._output_dir, jobs=2, log=self._log)
+                       .download(["test.cram", "test.crai"]))
+
+        self.assertTrue(all(result.succeeded for result in results))
+
+    def test_mismatched_checksum_is_reported(self):
+        self._requester.get_data.side_effect = None
+        self._requester.get_data.return_value = _make_response("http://testURL/test.cram", b"data", "0" * 32)
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log).download(["test.cram"])
+
+        self.assertTrue(result.succeeded)
+        self.assertFalse(result.checksum_matched)
+
+    def test_interrupted_download_is_resumed(self):
+        data = b"0123456789" * 100
+        partial = PartialDownload(self._output_dir + "test.cram")
+        partial.start(hashlib.md5(data).hexdigest(), len(data), committed=400)
+        with open(partial.location, "wb") as file:
+            file.write(data[:400] + b"not committed")
+
+        def get_data(file_path, **kwargs):
+            response = _make_response(f"http://testURL/{file_path}", data[kwargs['byte_range'][0]:])
+            response.status_code = ResponseCodes['RANGED_DATA']
+            response.headers['Content-Range'] = f"bytes {kwargs['byte_range'][0]}-{len(data) - 1}/{len(data)}"
+            response.headers['ETag'] = hashlib.md5(data).hexdigest()
+            return response
+
+        self._requester.get_data.side_effect = get_data
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log).download(["dir/test.cram"])
+
+        self.assertTrue(result.checksum_matched)
+        self._requester.get_data.assert_called_once_with("dir/test.cram", wait_for_data=False, byte_range=(400, None))
+        self.assertEqual(os.listdir(self._output_dir), ["test.cram"])
+        with open(result.save_location, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+    def test_changed_file_is_not_resumed(self):
+        partial = PartialDownload(self._output_dir + "test.cram")
+        partial.start("old_etag", 1000, committed=400)
+        with open(partial.location, "wb") as file:
+            file.write(b"0" * 400)
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log).download(["test.cram"])
+
+        self.assertTrue(result.checksum_matched)
+        with open(result.save_location, "rb") as file:
+            self.assertEqual(file.read(), b"test.cram")
+
+    def test_mismatched_checksum_is_repaired(self):
+        data = b"0123456789" * 10
+        self._requester.get_data.side_effect = None
+        self._requester.get_data.return_value = _make_response("http://testURL/test.cram", b"01234x6789" + data[10:],
+                                                               hashlib.md5(data).hexdigest())
+        self._requester.get_chunk_checksums.return_value = [(0, 49, hashlib.md5(data[:50]).hexdigest()),
+                                                            (50, 99, hashlib.md5(data[50:]).hexdigest())]
+
+        with patch("irobotclient.download_handler.repair_ranges") as repair_ranges:
+            def repair(request_handler, file_path, save_location, chunk_checksums, workers, chunk_size):
+                with open(save_location, "r+b") as file:
+                    file.write(data[:50])
+                return [(0, 49)]
+
+            repair_ranges.side_effect = repair
+
+            result, = DownloadEngine(self._requester, self._output_dir, log=self._log).download(["test.cram"])
+
+        self.assertTrue(result.checksum_matched)
+        self.assertEqual(result.checksum, hashlib.md5(data).hexdigest())
+
+    def test_unchanged_file_is_not_downloaded(self):
+        checksum_index = MagicMock(spec=ChecksumIndex)
+        checksum_index.get_etag.return_value = "test_etag"
+        response = requests.Response()
+        response.status_code = ResponseCodes['CLIENT_MATCHED']
+        self._requester.get_data.side_effect = None
+        self._requester.get_data.return_value = response
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, checksum_index=checksum_index)\
+            .download(["dir/test.cram"])
+
+        self.assertTrue(result.unchanged)
+        self._requester.get_data.assert_called_once_with("dir/test.cram", wait_for_data=False, etag="test_etag")
+        checksum_index.record.assert_not_called()
+
+    def test_downloaded_file_is_recorded_in_index(self):
+        checksum_index = MagicMock(spec=ChecksumIndex)
+        checksum_index.get_etag.return_value = None
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, checksum_index=checksum_index)\
+            .download(["test.cram"])
+
+        checksum_index.record.assert_called_once_with(result.save_location, result.checksum, result.checksum)
+
+    def test_cached_file_is_not_downloaded(self):
+        cache = MagicMock(spec=DownloadCache)
+        cache.get_etag.return_value = "test_etag"
+        cache.materialize.return_value = True
+        response = requests.Response()
+        response.status_code = ResponseCodes['CLIENT_MATCHED']
+        self._requester.get_data.side_effect = None
+        self._requester.get_data.return_value = response
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, cache=cache)\
+            .download(["dir/test.cram"])
+
+        self.assertTrue(result.cached)
+        self._requester.get_data.assert_called_once_with("dir/test.cram", wait_for_data=False, etag="test_etag")
+        cache.materialize.assert_called_once_with("test_etag", self._output_dir + "test.cram")
+
+    def test_data_cached_under_another_path_is_not_downloaded(self):
+        cache = MagicMock(spec=DownloadCache)
+        cache.get_etag.return_value = None
+        cache.materialize.return_value = True
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, cache=cache)\
+            .download(["test.cram"])
+
+        self.assertTrue(result.cached)
+        cache.materialize.assert_called_once_with(hashlib.md5(b"test.cram").hexdigest(),
+                                                  self._output_dir + "test.cram")
+        cache.add.assert_not_called()
+
+    def test_downloaded_file_is_added_to_cache(self):
+        cache = MagicMock(spec=DownloadCache)
+        cache.get_etag.return_value = None
+        cache.materialize.return_value = False
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, cache=cache)\
+            .download(["dir/test.cram"])
+
+        self.assertFalse(result.cached)
+        cache.add.assert_called_once_with("dir/test.cram", result.checksum, result.save_location)
+
+    def test_cache_copy_error_is_a_miss(self):
+        cache = MagicMock(spec=DownloadCache)
+        cache.get_etag.return_value = None
+        cache.materialize.side_effect = OSError(errno.EXDEV, "Invalid cross-device link")
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, cache=cache)\
+            .download(["dir/test.cram"])
+
+        self.assertIsNone(result.error)
+        self.assertTrue(result.checksum_matched)
+        self.assertFalse(result.cached)
+
+    def test_concurrent_downloads_of_a_file_are_coalesced(self):
+        def get_data(file_path, **kwargs):
+            # Long enough for the second worker to find the file locked.
+            time.sleep(0.5)
+            return _make_response(f"http://testURL/{file_path}", b"data")
+
+        self._requester.get_data.side_effect = get_data
+        lock_dir = self._temp_directory.name + "/locks"
+
+        results = list(DownloadEngine(self._requester, self._output_dir, jobs=2, log=self._log, lock_dir=lock_dir)
+                       .download(["dir/test.cram", "dir/test.cram"]))
+
+        self._requester.get_data.assert_called_once()
+        self.assertEqual(sorted(result.coalesced for result in results), [False, True])
+        self.assertTrue(all(result.checksum == hashlib.md5(b"data").hexdigest() for result in results))
+
+    def test_coalesced_file_that_cannot_be_copied_is_downloaded(self):
+        def get_data(file_path, **kwargs):
+            time.sleep(0.5)
+            return _make_response(f"http://testURL/{file_path}", b"data")
+
+        self._requester.get_data.side_effect = get_data
+        lock_dir = self._temp_directory.name + "/locks"
+        other_output_dir = self._temp_directory.name + "/other/"
+        os.mkdir(other_output_dir)
+        results = []
+
+        def download(output_dir):
+            results.extend(DownloadEngine(self._requester, output_dir, log=self._log, lock_dir=lock_dir)
+                           .download(["dir/test.cram"]))
+
+        with patch("irobotclient.download_handler.reflink_or_copy",
+                   side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+            threads = [threading.Thread(target=download, args=(output_dir,))
+                       for output_dir in (self._output_dir, other_output_dir)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self._requester.get_data.call_count, 2)
+        self.assertEqual([result.coalesced for result in results], [False, False])
+        self.assertTrue(all(result.checksum_matched for result in results))
+
+    def test_coalesced_file_that_has_changed_is_downloaded(self):
+        shared_location = self._temp_directory.name + "/shared.cram"
+        with open(shared_location, "wb") as file:
+            file.write(b"changed data")
+
+        engine = DownloadEngine(self._requester, self._output_dir, log=self._log)
+
+        self.assertIsNone(engine._coalesced_result("dir/test.cram", self._output_dir + "test.cram", shared_location,
+                                                   hashlib.md5(b"data").hexdigest()))
+
+    def test_existing_files_are_skipped(self):
+        open(self._output_dir + "test.cram", "w").close()
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log, skip_existing=True)\
+            .download(["dir/test.cram"])
+
+        self.assertTrue(result.skipped)
+        self._requester.get_data.assert_not_called()
+
+    @patch("irobotclient.download_handler.MINIMUM_POLL_DELAY", 0)
+    def test_fetching_files_do_not_block_ready_files(self):
+        # The first request for the cram is answered with a 202; the crai is ready and should be downloaded first.
+        fetching = {"test.cram"}
+
+        def get_data(file_path, **kwargs):
+            if file_path in fetching:
+                fetching.remove(file_path)
+                raise DataNotReadyException(ResponseCodes['FETCHING_DATA'], "Fetching", 0)
+            return _make_response(f"http://testURL/{file_path}", b"data")
+
+        self._requester.get_data.side_effect = get_data
+        stdout = io.StringIO()
+
+        with self.assertLogs(PROGRESS_LOGGER, "INFO") as logs, redirect_stdout(stdout):
+            results = list(DownloadEngine(self._requester, self._output_dir, jobs=1, log=self._log)
+                           .download(["test.cram", "test.crai"]))
+
+        self.assertEqual([result.file_path for result in results], ["test.crai", "test.cram"])
+        self.assertTrue(all(result.succeeded for result in results))
+        self._requester.get_data.assert_called_with("test.cram", wait_for_data=False)
+        # Progress is logged rather than printed, as the engine may be running in a library or the daemon.
+        self.assertIn("iRobot is fetching test.cram", logs.output[0])
+        self.assertEqual(stdout.getvalue(), "")
+
+    @patch("irobotclient.download_handler.MINIMUM_POLL_DELAY", 0)
+    def test_download_metrics_are_recorded(self):
+        fetching = {"test.cram"}
+
+        def get_data(file_path, **kwargs):
+            if file_path in fetching:
+                fetching.remove(file_path)
+                raise DataNotReadyException(ResponseCodes['FETCHING_DATA'], "Fetching", 5)
+            return _make_response(f"http://testURL/{file_path}", b"some data")
+
+        self._requester.get_data.side_effect = get_data
+        metrics = MetricsRecorder()
+
+        list(DownloadEngine(self._requester, self._output_dir, log=self._log, metrics=metrics).download(["test.cram"]))
+
+        summary = metrics.summary()
+        self.assertEqual(summary["files"], {"downloaded": 1})
+        self.assertEqual((summary["bytes"], summary["fetch_wait"]), (9, 5))
+        self.assertGreater(summary["transfer_time"], 0)
+
+    def test_file_is_streamed(self):
+        sink = io.BytesIO()
+
+        result = stream_file(self._requester, "dir/test.cram", sink, chunk_size=4, log=self._log)
+
+        self.assertEqual(sink.getvalue(), b"dir/test.cram")
+        self.assertTrue(result.checksum_matched)
+        self.assertIsNone(result.save_location)
+        self._requester.get_data.assert_called_once_with("dir/test.cram")
+
+    def test_corrupt_stream_is_reported(self):
+        self._requester.get_data.side_effect = None
+        self._requester.get_data.return_value = _make_response("http://testURL/test.cram", b"data", "0" * 32)
+
+        result = stream_file(self._requester, "test.cram", io.BytesIO(), log=self._log)
+
+        self.assertTrue(result.succeeded)
+        self.assertFalse(result.checksum_matched)
+
+    def test_prefetched_files_are_ordered_by_eta(self):
+        delays = {"a.cram": 300, "b.cram": 0, "c.cram": 60, "d.cram": 10}
+        self._requester.prefetch.side_effect = lambda file_path: delays[file_path]
+
+        results = list(prefetch_files(self._requester, ["a.cram", "b.cram", "c.cram", "d.cram"], window=3))
+
+        # Each window of three files is ordered on its own.
+        self.assertEqual([result.file_path for result in results], ["b.cram", "c.cram", "a.cram", "d.cram"])
+
+    # The following tests assess exception handling
+    @patch("irobotclient.download_handler.MINIMUM_POLL_DELAY", 0)
+    def test_exceeded_polls_of_fetching_file(self):
+        self._requester.get_data.side_effect = DataNotReadyException(ResponseCodes['FETCHING_DATA'], "Fetching", 0)
+
+        result, = DownloadEngine(self._requester, self._output_dir, log=self._log).download(["test.cram"])
+
+        self.assertEqual(result.error.errno, errno.ECONNABORTED)
+        self.assertEqual(self._requester.get_data.call_count, REQUEST_LIMIT)
+
+    def test_failed_file_does_not_stop_the_others(self):
+        def get_data(file_path, **kwargs):
+            if file_path.endswith(".crai"):
+                raise IrobotClientException(ResponseCodes['NOT_FOUND'], "Content not found")
+            return _make_response(f"http://testURL/{file_path}", b"data")
+
+        self._requester.get_data.side_effect = get_data
+
+        results = {result.file_path: result for result in
+                   DownloadEngine(self._requester, self._output_dir, log=self._log)
+                   .download(["test.cram", "test.crai"])}
+
+        self.assertTrue(results["test.cram"].succeeded)
+        self.assertEqual(results["test.crai"].error.errno, ResponseCodes['NOT_FOUND'])
+
+    def test_closing_download_cancels_queued_files(self):
+        self._requester.get_data.side_effect = IrobotClientException(errno.ECONNABORTED, "Failed")
+        file_list = [f"test_{index}.cram" for index in range(100)]
+
+        downloads = DownloadEngine(self._requester, self._output_dir, jobs=1, log=self._log).download(file_list)
+        next(downloads)
+        downloads.close()
+
+        self.assertLess(self._requester.get_data.call_count, len(file_list))
+
+
+if __name__ == '__main__':
+    unittest.main()
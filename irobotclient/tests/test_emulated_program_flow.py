@@ -0,0 +1,171 @@
+import unittest
+
+import base64
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from irobotclient.daemon_handler import IrobotDaemon
+from irobotclient.tests.emulator import IrobotEmulator
+
+PROGRAM_ENTRYPOINT = f"{os.path.dirname(os.path.realpath(__file__))}/../entrypoint.py"
+EMULATOR_TOKEN = "testtoken"
+EMULATOR_USER = "testuser"
+EMULATOR_PASSWORD = "testpass"
+EMULATOR_CRAM = "test.cram"
+EMULATOR_CRAI = "test.crai"
+
+
+class TestEmulatedProgramFlow(unittest.TestCase):
+    """
+    Testing the entire program flow against the local iRobot emulator, which needs neither Docker nor network access.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._output_dir = self._temp_directory.name
+
+        basic_credential = base64.b64encode(f"{EMULATOR_USER}:{EMULATOR_PASSWORD}".encode()).decode()
+        self._emulator = IrobotEmulator(credentials=[f"Basic {basic_credential}"])
+        self._cram = os.urandom(3 * 1024 * 1024 + 123)
+        self._emulator.add_file(EMULATOR_CRAM, self._cram)
+        self._emulator.add_file(EMULATOR_CRAI, b"crai data")
+        self._emulator.start()
+
+        self._environment = os.environ.copy()
+        self._environment["PYTHONPATH"] = f"{os.path.dirname(os.path.realpath(__file__))}/../../"
+
+    def tearDown(self):
+        self._emulator.stop()
+        self._temp_directory.cleanup()
+
+    def _run_client(self, *options, output=None) -> subprocess.CompletedProcess:
+        # Run the client against the emulator, from the output directory so that its error log is left there.
+
+        return subprocess.run([sys.executable, PROGRAM_ENTRYPOINT, EMULATOR_CRAM, output or self._output_dir,
+                               "-u", self._emulator.url,
+                               "--arvados_token", EMULATOR_TOKEN,
+                               "--basic_username", EMULATOR_USER,
+                               "--basic_password", EMULATOR_PASSWORD,
+                               "--no_coalesce", *options],
+                              env=self._environment, cwd=self._output_dir, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+
+    def _assert_downloaded(self):
+        with open(f"{self._output_dir}/{EMULATOR_CRAM}", "rb") as cram:
+            self.assertEqual(hashlib.md5(cram.read()).digest(), hashlib.md5(self._cram).digest())
+        self.assertTrue(os.path.exists(f"{self._output_dir}/{EMULATOR_CRAI}"))
+
+    def test_cli(self):
+        self.assertEqual(self._run_client("-f").returncode, 0)
+
+        self._assert_downloaded()
+        # The Arvados token is rejected and the client moves on to basic authentication.
+        self.assertEqual([request.status for request in self._emulator.requests_for(EMULATOR_CRAM)], [401, 200])
+
+    def test_segmented_download(self):
+        self.assertEqual(self._run_client("-f", "--segments", "3", "--segment_size", "1048576").returncode, 0)
+
+        self._assert_downloaded()
+        self.assertEqual(sorted(request.headers.get("Range") for request in self._emulator.requests_for(EMULATOR_CRAM)
+                                if request.status == 206),
+                         ["bytes=1048576-2097151", "bytes=2097152-3145727", "bytes=3145728-3145850"])
+
+    def test_bandwidth_is_limited(self):
+        start = time.monotonic()
+        self.assertEqual(self._run_client("-f", "--segments", "3", "--segment_size", "1048576",
+                                          "--max_bandwidth", "6000000").returncode, 0)
+
+        self._assert_downloaded()
+        # Less the tenth of a second of bandwidth the limiter starts with.
+        self.assertGreaterEqual(time.monotonic() - start, (len(self._cram) - 600000) / 6000000)
+
+    def test_fetching_and_overloaded_files_are_retried(self):
+        self._emulator.files[EMULATOR_CRAM].fetch_delay = 1
+        self._emulator.script(EMULATOR_CRAI, 504, 507)
+
+        self.assertEqual(self._run_client("-f").returncode, 0)
+
+        self._assert_downloaded()
+        self.assertIn(202, [request.status for request in self._emulator.requests_for(EMULATOR_CRAM)])
+
+    def test_unchanged_files_are_not_downloaded_again(self):
+        self.assertEqual(self._run_client("-f", "--skip_unchanged").returncode, 0)
+        self.assertEqual(self._run_client("--skip_unchanged").returncode, 0)
+
+        self.assertEqual([request.status for request in self._emulator.requests_for(EMULATOR_CRAM)][-1], 304)
+
+    def test_stream_to_stdout(self):
+        completed_process = self._run_client(output="-")
+
+        self.assertEqual(completed_process.returncode, 0)
+        self.assertEqual(hashlib.md5(completed_process.stdout).digest(), hashlib.md5(self._cram).digest())
+        self.assertEqual(os.listdir(self._output_dir), ["irobot_client_error.log"])
+
+    def test_runs_handed_to_daemon(self):
+        daemon_socket = f"{self._output_dir}/daemon.sock"
+        daemon = IrobotDaemon(daemon_socket)
+        daemon_thread = threading.Thread(target=daemon.serve_forever)
+        daemon_thread.start()
+
+        try:
+            self.assertEqual(self._run_client("-f", "--daemon_socket", daemon_socket).returncode, 0)
+            self.assertEqual(self._run_client("-f", "--daemon_socket", daemon_socket).returncode, 0)
+        finally:
+            daemon.shutdown()
+            daemon_thread.join()
+            daemon.server_close()
+
+        self._assert_downloaded()
+        # The second run is sent straight to the credential the daemon negotiated in the first.
+        self.assertEqual([request.status for request in self._emulator.requests_for(EMULATOR_CRAM)], [401, 200, 200])
+
+    def test_failover_between_instances(self):
+        with IrobotEmulator() as stopped_emulator:
+            stopped_url = stopped_emulator.url
+        overloaded_emulator = IrobotEmulator(credentials=self._emulator.credentials)
+        overloaded_emulator.add_file(EMULATOR_CRAM, self._cram)
+        overloaded_emulator.script(EMULATOR_CRAM, 504)
+        overloaded_emulator.start()
+
+        # Only the cram is requested, so that the instances are chosen in the same order every time: the stopped one,
+        # then the overloaded one (which has no latency, as rejecting a credential is not counted), then the healthy
+        # one.
+        try:
+            completed_process = self._run_client("-f", "--no_index", "-u", f"{stopped_url},{overloaded_emulator.url},"
+                                                                           f"{self._emulator.url}")
+        finally:
+            overloaded_emulator.stop()
+
+        self.assertEqual(completed_process.returncode, 0)
+        with open(f"{self._output_dir}/{EMULATOR_CRAM}", "rb") as cram:
+            self.assertEqual(hashlib.md5(cram.read()).digest(), hashlib.md5(self._cram).digest())
+        self.assertIn(504, [request.status for request in overloaded_emulator.requests_for(EMULATOR_CRAM)])
+
+    # The following tests evaluate exception handling
+    def test_corrupt_stream(self):
+        self._emulator.files[EMULATOR_CRAM].etag = "0" * 32
+
+        completed_process = self._run_client(output="-")
+
+        self.assertNotEqual(completed_process.returncode, 0)
+        self.assertEqual(completed_process.stdout, self._cram)
+        self.assertIn(b"does not match", completed_process.stderr)
+
+    def test_authentication_fail(self):
+        self._emulator.credentials = ["Basic other"]
+
+        self.assertNotEqual(self._run_client("-f").returncode, 0)
+        self.assertFalse(os.path.exists(f"{self._output_dir}/{EMULATOR_CRAM}"))
+
+    def test_file_not_found(self):
+        del self._emulator.files[EMULATOR_CRAM]
+
+        self.assertIn(b"Could not find", self._run_client("-f").stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch
+
+from irobotclient.endpoint_handler import EndpointPool, split_urls
+
+
+class TestEndpointPool(unittest.TestCase):
+    """
+    Assessing how requests are spread over several iRobot instances.
+    """
+    def setUp(self):
+        self._pool = EndpointPool(["http://first/", "http://second/", "http://third/"])
+        self._first, self._second, self._third = self._pool.endpoints
+
+    def test_split_urls(self):
+        self.assertEqual(split_urls("http://first, http://second/,"), ["http://first/", "http://second/"])
+
+    def test_untried_endpoints_are_used_first(self):
+        self.assertEqual([self._pool.select(f"file{index}").url for index in range(3)],
+                         ["http://first/", "http://second/", "http://third/"])
+
+    def test_least_loaded_endpoint_is_selected(self):
+        for endpoint, latency in ((self._first, 0.1), (self._second, 0.2), (self._third, 1.0)):
+            self._pool.select("file")
+            self._pool.succeeded(endpoint, latency)
+
+        self.assertIs(self._pool.select("file1"), self._first)
+        self.assertIs(self._pool.select("file2"), self._second)
+        # The first endpoint, with two outstanding requests, now costs more than the second with one.
+        self.assertIs(self._pool.select("file3"), self._first)
+        self.assertEqual(self._first.outstanding, 2)
+
+    def test_response_without_latency_is_not_counted(self):
+        self._pool.select("file")
+        self._pool.succeeded(self._first, 0.5, "file")
+        self.assertIs(self._pool.select("file"), self._first)
+        self._pool.succeeded(self._first)
+
+        self.assertEqual(self._first.latency, 0.5)
+        self.assertEqual(self._first.outstanding, 0)
+
+    def test_file_is_pinned_to_endpoint(self):
+        self._pool.select("file")
+        self._pool.succeeded(self._third, 1.0, "file")
+        self._pool.select("other")
+        self._pool.succeeded(self._first, 0.1)
+
+        self.assertIs(self._pool.select("file"), self._third)
+
+    def test_failed_endpoint_is_avoided(self):
+        with patch("time.monotonic", return_value=100.0):
+            self._pool.select("file")
+            self._pool.failed(self._first)
+            self._pool.select("file")
+            self._pool.failed(self._first)
+
+            self.assertEqual(self._first.unhealthy_until, 102.0)
+            self.assertNotIn(self._first, [self._pool.select(f"file{index}") for index in range(5)])
+
+        with patch("time.monotonic", return_value=102.0):
+            self.assertIs(self._pool.select("file"), self._first)
+
+    def test_pinned_endpoint_fails_over(self):
+        self._pool.select("file")
+        self._pool.succeeded(self._first, 0.1, "file")
+        self._pool.select("file")
+        self._pool.failed(self._first)
+
+        self.assertIsNot(self._pool.select("file"), self._first)
+
+    def test_all_endpoints_failed(self):
+        with patch("time.monotonic", return_value=100.0):
+            for endpoint in (self._second, self._second, self._first, self._third, self._third, self._third):
+                self._pool.select("file")
+                self._pool.failed(endpoint)
+
+            self.assertFalse(self._pool.has_healthy())
+            # The first endpoint has failed the fewest times, so is avoided for the shortest time.
+            self.assertIs(self._pool.select("file"), self._first)
+
+
+if __name__ == '__main__':
+    unittest.main()
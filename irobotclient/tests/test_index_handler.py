@@ -0,0 +1,53 @@
+import unittest
+
+import hashlib
+import os
+import tempfile
+
+from irobotclient.index_handler import ChecksumIndex
+
+
+class TestChecksumIndex(unittest.TestCase):
+    """
+    Assessing when the checksum index vouches for a file on disk.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._save_location = os.path.join(self._temp_directory.name, "test.cram")
+        self._index = ChecksumIndex(os.path.join(self._temp_directory.name, "index.sqlite"))
+
+        with open(self._save_location, "wb") as file:
+            file.write(b"test data")
+
+    def tearDown(self):
+        self._index.close()
+        self._temp_directory.cleanup()
+
+    def test_recorded_etag_is_returned(self):
+        self._index.record(self._save_location, "test_md5", "test_etag")
+
+        self.assertEqual(self._index.get_etag(self._save_location), "test_etag")
+
+    def test_index_persists(self):
+        self._index.record(self._save_location, "test_md5", "test_etag")
+        self._index.close()
+
+        self._index = ChecksumIndex(os.path.join(self._temp_directory.name, "index.sqlite"))
+        self.assertEqual(self._index.get_etag(self._save_location), "test_etag")
+
+    def test_modified_file_is_rehashed(self):
+        self._index.record(self._save_location, "test_md5", "test_etag")
+
+        with open(self._save_location, "ab") as file:
+            file.write(b" modified")
+
+        self.assertIsNone(self._index.get_etag(self._save_location, rehash_unknown=False))
+        self.assertEqual(self._index.get_etag(self._save_location),
+                         hashlib.md5(b"test data modified").hexdigest())
+
+    def test_missing_file(self):
+        self.assertIsNone(self._index.get_etag(os.path.join(self._temp_directory.name, "missing.cram")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+
+import errno
+import os
+import tempfile
+import threading
+
+from unittest.mock import patch
+
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.lock_handler import DownloadLock
+
+
+class TestDownloadLock(unittest.TestCase):
+    """
+    Assessing how a download lock is waited for and how the holder's result is handed to a waiter.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._lock_dir = os.path.join(self._temp_directory.name, "locks")
+        self._save_location = os.path.join(self._temp_directory.name, "test.cram")
+
+        with open(self._save_location, "wb") as file:
+            file.write(b"test data")
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    def _wait_for_lock(self, results: list):
+        with DownloadLock(self._lock_dir, "dir/test.cram") as lock:
+            results.append(lock.shared_result())
+
+    def test_uncontended_lock_is_not_waited_for(self):
+        lock = DownloadLock(self._lock_dir, "dir/test.cram")
+
+        self.assertFalse(lock.acquire())
+        self.assertIsNone(lock.shared_result())
+        lock.release()
+
+    def test_same_path_on_other_server_is_locked_separately(self):
+        with DownloadLock(self._lock_dir, "dir/test.cram", "http://irobot1:5000/"):
+            lock = DownloadLock(self._lock_dir, "dir/test.cram", "http://irobot2:5000/")
+
+            self.assertFalse(lock.acquire())
+            lock.release()
+
+    def test_waiter_is_given_published_result(self):
+        results = []
+
+        with DownloadLock(self._lock_dir, "dir/test.cram") as lock:
+            waiter = threading.Thread(target=self._wait_for_lock, args=(results,))
+            waiter.start()
+            waiter.join(0.2)
+            self.assertTrue(waiter.is_alive())
+
+            lock.publish(self._save_location, "test_md5")
+
+        waiter.join(5)
+        self.assertEqual(results, [(self._save_location, "test_md5")])
+
+    def test_waiter_is_not_given_changed_file(self):
+        results = []
+
+        with DownloadLock(self._lock_dir, "dir/test.cram") as lock:
+            waiter = threading.Thread(target=self._wait_for_lock, args=(results,))
+            waiter.start()
+            waiter.join(0.2)
+
+            lock.publish(self._save_location, "test_md5")
+            with open(self._save_location, "ab") as file:
+                file.write(b" modified")
+
+        waiter.join(5)
+        self.assertEqual(results, [None])
+
+    @patch("irobotclient.lock_handler.LOCK_NAME_DIGITS", 0)
+    def test_waiter_is_not_given_result_of_other_path(self):
+        results = []
+
+        with DownloadLock(self._lock_dir, "dir/other.cram") as lock:
+            waiter = threading.Thread(target=self._wait_for_lock, args=(results,))
+            waiter.start()
+            waiter.join(0.2)
+            self.assertTrue(waiter.is_alive())
+
+            lock.publish(self._save_location, "test_md5")
+
+        waiter.join(5)
+        self.assertEqual(results, [None])
+        self.assertEqual(os.listdir(self._lock_dir), [".lock"])
+
+    def test_lock_directory_is_private(self):
+        with DownloadLock(self._lock_dir, "dir/test.cram"):
+            self.assertEqual(os.stat(self._lock_dir).st_mode & 0o777, 0o700)
+
+    def test_shared_lock_directory_is_refused(self):
+        os.mkdir(self._lock_dir, 0o777)
+        os.chmod(self._lock_dir, 0o777)
+
+        self.assertRaisesRegex(IrobotClientException, f"{errno.EACCES}", DownloadLock(self._lock_dir,
+                                                                                      "dir/test.cram").acquire)
+
+    def test_result_published_before_waiting_is_ignored(self):
+        with DownloadLock(self._lock_dir, "dir/test.cram") as lock:
+            lock.publish(self._save_location, "test_md5")
+
+        results = []
+        self._wait_for_lock(results)
+
+        self.assertEqual(results, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+
+from unittest.mock import patch
+
+from irobotclient.download_handler import DownloadResult
+from irobotclient.metrics_handler import MetricsRecorder, TimedHasher
+
+
+class TestMetricsRecorder(unittest.TestCase):
+    """
+    Assessing how the metrics of each file are collected, written as JSON lines and summarised for Prometheus.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._json_lines_location = os.path.join(self._temp_directory.name, "metrics.jsonl")
+        self._textfile_location = os.path.join(self._temp_directory.name, "irobotclient.prom")
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    def _read_json_lines(self) -> list:
+        with open(self._json_lines_location) as json_lines_file:
+            return [json.loads(line) for line in json_lines_file]
+
+    def test_file_metrics_are_written_when_finished(self):
+        with MetricsRecorder(self._json_lines_location) as metrics:
+            metrics.add("test/file", "requests", 2)
+            metrics.add("test/file", "bytes", 1000)
+            metrics.add("test/file", "transfer_time", 0.5)
+            metrics.first_byte("test/file", 0.1)
+            metrics.first_byte("test/file", 0.2)
+            metrics.finish(DownloadResult("test/file", "output/file", "abc", True))
+
+        file_record, summary = self._read_json_lines()
+
+        self.assertEqual((file_record["type"], file_record["file_path"], file_record["status"]),
+                         ("file", "test/file", "downloaded"))
+        self.assertEqual((file_record["requests"], file_record["bytes"], file_record["throughput"],
+                          file_record["time_to_first_byte"]), (2, 1000, 2000.0, 0.1))
+        self.assertEqual((summary["type"], summary["files"], summary["bytes"]), ("summary", {"downloaded": 1}, 1000))
+
+    def test_outcomes_are_counted(self):
+        metrics = MetricsRecorder()
+
+        metrics.finish(DownloadResult("test/a", error=Exception()))
+        metrics.finish(DownloadResult("test/b", "output/b", "abc", True, cached=True))
+        metrics.finish(DownloadResult("test/c", "output/c", "abc", True, unchanged=True))
+        metrics.finish(DownloadResult("test/d", "output/d", "abc", False))
+
+        self.assertEqual(metrics.summary()["files"], {"failed": 1, "cached": 1, "unchanged": 1, "corrupt": 1})
+
+    @patch("irobotclient.metrics_handler.FIRST_BYTE_SAMPLES", 100)
+    def test_times_to_first_byte_are_sampled(self):
+        random.seed(0)
+        metrics = MetricsRecorder()
+
+        for index in range(10000):
+            metrics.first_byte(f"test/{index}", index / 10000)
+            metrics.finish(DownloadResult(f"test/{index}", f"output/{index}", "abc", True))
+
+        self.assertEqual(len(metrics._time_to_first_byte_samples), 100)
+        self.assertEqual(metrics._time_to_first_byte_count, 10000)
+        self.assertAlmostEqual(metrics._time_to_first_byte_sum, 4999.5)
+        self.assertAlmostEqual(metrics.summary()["median_time_to_first_byte"], 0.5, delta=0.15)
+
+    def test_prometheus_textfile(self):
+        with MetricsRecorder(textfile_location=self._textfile_location) as metrics:
+            metrics.add("test/file", "bytes", 1000)
+            metrics.first_byte("test/file", 0.25)
+            metrics.finish(DownloadResult("test/file", "output/file", "abc", True))
+
+        with open(self._textfile_location) as textfile:
+            lines = textfile.read().splitlines()
+
+        self.assertIn('irobotclient_files_total{status="downloaded"} 1', lines)
+        self.assertIn("irobotclient_bytes_total 1000", lines)
+        self.assertIn("irobotclient_time_to_first_byte_seconds_sum 0.25", lines)
+        self.assertIn("irobotclient_time_to_first_byte_seconds_count 1", lines)
+        self.assertEqual(os.listdir(self._temp_directory.name), ["irobotclient.prom"])
+
+
+class TestTimedHasher(unittest.TestCase):
+    """
+    Assessing that a wrapped hasher still hashes and counts what it is fed.
+    """
+    def test_timed_hasher(self):
+        hasher = TimedHasher(hashlib.md5())
+        hasher.update(b"test")
+        hasher.update(memoryview(b"data"))
+
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(b"testdata").hexdigest())
+        self.assertEqual(hasher.bytes, 8)
+        self.assertGreaterEqual(hasher.elapsed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
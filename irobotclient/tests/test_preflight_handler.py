@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import errno
+import tempfile
+
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.index_handler import ChecksumIndex
+from irobotclient.preflight_handler import preflight_files
+from irobotclient.request_handler import Requester, ResponseCodes
+
+
+class TestPreflight(unittest.TestCase):
+    """
+    Assessing how a batch of files is planned from their metadata.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._output_dir = self._temp_directory.name + '/'
+
+        self._metadata = {"small.cram": {"size": 10, "checksum": "abc1"},
+                          "large.cram": {"size": 1000, "checksum": "abc2"},
+                          "medium.cram": {"size": 100, "checksum": "abc3"},
+                          "unknown.cram": None}
+        self._requester = MagicMock(spec=Requester)
+        self._requester.get_metadata.side_effect = lambda file_path: self._metadata[file_path]
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    def test_largest_files_are_planned_first(self):
+        results = list(preflight_files(self._requester, self._metadata, self._output_dir, jobs=2))
+
+        self.assertEqual([result.file_path for result in results],
+                         ["large.cram", "medium.cram", "small.cram", "unknown.cram"])
+        self.assertEqual(results[0].size, 1000)
+        self.assertEqual(results[0].checksum, "abc2")
+
+    def test_unchanged_files_are_identified(self):
+        checksum_index = MagicMock(spec=ChecksumIndex)
+        checksum_index.get_etag.side_effect = lambda save_location: "abc3" if "medium" in save_location else None
+
+        results = list(preflight_files(self._requester, self._metadata, self._output_dir, jobs=2,
+                                       checksum_index=checksum_index))
+
+        self.assertEqual([result.file_path for result in results if result.unchanged], ["medium.cram"])
+        self.assertEqual(results[0].file_path, "medium.cram")
+
+    def test_errors_are_kept_in_results(self):
+        self._requester.get_metadata.side_effect = IrobotClientException(ResponseCodes['NOT_FOUND'], "Not found")
+
+        result, = preflight_files(self._requester, ["missing.cram"], self._output_dir, jobs=1)
+
+        self.assertEqual(result.error.errno, ResponseCodes['NOT_FOUND'])
+
+    @patch("shutil.disk_usage")
+    def test_insufficient_disk_space_exception(self, disk_usage):
+        disk_usage.return_value.free = 1000
+
+        self.assertRaisesRegex(IrobotClientException, f"{errno.ENOSPC}",
+                               list, preflight_files(self._requester, self._metadata, self._output_dir, jobs=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -47,6 +47,26 @@ class TestRequestFormatter(unittest.TestCase):
 
         self.assertEqual(file_list, [input_file])
 
+    def test_get_manifest_file_list(self):
+        manifest = ["/some/address/in/irods/file.cram\n",
+                    "\n",
+                    "# A comment\n",
+                    "/some/address/in/irods/directory/\n",
+                    "/some/address/in/irods/file.txt\n"]
+
+        file_list = request_formatter.get_manifest_file_list(manifest, False, True)
+
+        self.assertEqual(list(file_list), ["some/address/in/irods/file.cram",
+                                           "some/address/in/irods/file.crai",
+                                           "some/address/in/irods/file.txt"])
+
+    def test_get_manifest_file_list_is_lazy(self):
+        def manifest():
+            yield "file.txt"
+            raise AssertionError("The manifest was read beyond the first requested file")
+
+        self.assertEqual(next(request_formatter.get_manifest_file_list(manifest(), False, False)), "file.txt")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,17 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+import datetime
 import requests
 import time
 import errno
 import json
 
-from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.auth_handler import AuthenticationCache
+from irobotclient.bandwidth_handler import BandwidthLimiter
+from irobotclient.concurrency_handler import ConcurrencyLimiter
+from irobotclient.custom_exceptions import IrobotClientException, DataNotReadyException
+from irobotclient.metrics_handler import MetricsRecorder
 from irobotclient.request_handler import Requester, ResponseCodes
 
 
@@ -31,29 +36,251 @@ class TestRequester(unittest.TestCase):
         requests.Session.send = self._session_send
         time.sleep = self._old_time_sleep
 
-    # Tests for future functionality
-    @unittest.skip("206 to be implemented")
     def test_206(self):
         self._response.status_code = ResponseCodes['RANGED_DATA']
-        # TODO - Implement
 
-    @unittest.skip("304 to be implemented")
+        self.assertIs(self._test_requester.get_data("test/file/path", byte_range=(10, 19)), self._response)
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.headers["Range"], "bytes=10-19")
+
     def test_304(self):
         self._response.status_code = ResponseCodes['CLIENT_MATCHED']
-        # TODO - Implement
 
+        self.assertIs(self._test_requester.get_data("test/file/path", etag="test_etag"), self._response)
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.headers["If-None-Match"], "test_etag")
+
+    def test_data_responses_are_throttled(self):
+        bandwidth = MagicMock(spec=BandwidthLimiter)
+        self._test_requester = Requester({"testKey": "testValue"}, "http://testURL", bandwidth=bandwidth)
+        self._response.status_code = ResponseCodes['SUCCESS']
+
+        self.assertIs(self._test_requester.get_data("test/file/path"), self._response)
+
+        bandwidth.throttle.assert_called_once_with(self._response, "test/file/path")
+
+    # Tests for future functionality
     @unittest.skip("Check authentication function to be implemented")
     def test_set_authentication_header(self):
         pass
         # TODO - Implement
 
+    def test_session_reused_across_retries(self):
+        self._response.status_code = ResponseCodes['FETCHING_DATA']
+
+        with patch("requests.Session") as session_class:
+            self.assertRaises(IrobotClientException, self._test_requester.get_data, "test/file/path")
+            session_class.assert_not_called()
+
+        self.assertEqual(requests.Session.send.call_count, 10)
+
+    def test_no_keep_alive_closes_connections(self):
+        self._response.status_code = ResponseCodes['SUCCESS']
+        requester = Requester({"testKey": "testValue"}, "http://testURL", keep_alive=False)
+
+        requester.get_data("test/file/path")
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.headers["Connection"], "close")
+        self.assertEqual(prepared_request.headers["testKey"], "testValue")
+
+    def test_fetching_data_without_waiting(self):
+        self._response.status_code = ResponseCodes['FETCHING_DATA']
+        self._response.headers['iRobot-ETA'] = "2017-09-25T12:34:56Z+0000 +/- 123"
+
+        with patch("irobotclient.response_handler.get_request_delay", return_value=30):
+            with self.assertRaises(DataNotReadyException) as context:
+                self._test_requester.get_data("test/file/path", wait_for_data=False)
+
+        self.assertEqual(context.exception.delay, 153)   # ETA delay plus the margin
+        self.assertEqual(requests.Session.send.call_count, 1)
+        time.sleep.assert_not_called()
+
+    def test_fetching_data_is_waited_for_with_margin(self):
+        fetching_response = requests.Response()
+        fetching_response.status_code = ResponseCodes['FETCHING_DATA']
+        fetching_response.headers['iRobot-ETA'] = "2017-09-25T12:34:56Z+0000 +/- 123"
+        fetching_response._content = b''
+        self._response.status_code = ResponseCodes['SUCCESS']
+        requests.Session.send.side_effect = [fetching_response, self._response]
+
+        with patch("irobotclient.response_handler.get_request_delay", return_value=30):
+            self.assertIs(self._test_requester.get_data("test/file/path"), self._response)
+
+        time.sleep.assert_called_once_with(153)   # the same delay as when not waiting
+
+    def test_prefetch_returns_delay_until_eta(self):
+        self._response.status_code = ResponseCodes['FETCHING_DATA']
+        self._response.headers['iRobot-ETA'] = "2017-09-25T12:34:56Z+0000 +/- 20"
+
+        with patch("irobotclient.response_handler.get_request_delay", return_value=100):
+            self.assertEqual(self._test_requester.prefetch("test/file/path"), 120)
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.method, "POST")
+
+    def test_prefetch_of_ready_data(self):
+        for status_code in (ResponseCodes['CREATED'], ResponseCodes['INVALID_REQUEST_METHOD']):
+            self._response.status_code = status_code
+            self.assertEqual(self._test_requester.prefetch("test/file/path"), 0)
+
+    def test_get_metadata(self):
+        self._response.status_code = ResponseCodes['SUCCESS']
+        self._response.headers['Content-Type'] = "application/vnd.irobot.metadata+json"
+        self._response._content = b'{"size": 1024, "checksum": "abc123"}'
+
+        self.assertEqual(self._test_requester.get_metadata("test/file/path"), {"size": 1024, "checksum": "abc123"})
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.headers["Accept"], "application/vnd.irobot.metadata+json")
+
+    def test_get_metadata_not_supported(self):
+        self._response.status_code = ResponseCodes['INVALID_MEDIA_REQUESTED']
+        self._response._content = b''
+
+        self.assertIsNone(self._test_requester.get_metadata("test/file/path"))
+
+    def test_get_metadata_ignored(self):
+        self._response.status_code = ResponseCodes['SUCCESS']
+        self._response.headers['Content-Type'] = "application/octet-stream"
+        self._response.raw = MagicMock()
+
+        self.assertIsNone(self._test_requester.get_metadata("test/file/path"))
+        self._response.raw.read.assert_not_called()
+
+    def test_get_chunk_checksums(self):
+        self._response.status_code = ResponseCodes['RANGED_DATA']
+        self._response.headers['Content-Type'] = "multipart/byteranges; boundary=test_boundary"
+        self._response._content = b"--test_boundary\r\nContent-Range: bytes 0-9/10\r\n\r\nabc123\r\n--test_boundary--"
+
+        self.assertEqual(self._test_requester.get_chunk_checksums("test/file/path"), [(0, 9, "abc123")])
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.headers["Accept"], "application/vnd.irobot.checksum")
+        self.assertEqual(prepared_request.headers["Range"], "bytes=0-")
+
+    def test_get_chunk_checksums_ignored(self):
+        self._response.status_code = ResponseCodes['RANGED_DATA']
+        self._response.headers['Content-Type'] = "application/octet-stream"
+        self._response.raw = MagicMock()
+
+        self.assertEqual(self._test_requester.get_chunk_checksums("test/file/path"), [])
+        self._response.raw.read.assert_not_called()
+
+    def test_overloaded_requests_are_backed_off(self):
+        limiter = MagicMock(spec=ConcurrencyLimiter)
+        self._test_requester = Requester({"testKey": "testValue"}, "http://testURL", limiter=limiter)
+        overloaded_response = requests.Response()
+        overloaded_response.status_code = ResponseCodes['PRECACHE_FULL']
+        overloaded_response._content = b''
+        self._response.status_code = ResponseCodes['SUCCESS']
+        requests.Session.send.side_effect = [overloaded_response, requests.exceptions.ConnectionError(),
+                                             self._response]
+
+        self.assertIs(self._test_requester.get_data("test/file/path"), self._response)
+
+        self.assertEqual(limiter.overloaded.call_count, 2)
+        limiter.succeeded.assert_called_once_with()
+        self.assertEqual(time.sleep.call_count, 2)
+        # The backoff is jittered up to a limit that doubles with each attempt.
+        self.assertLessEqual(time.sleep.call_args_list[0][0][0], 1)
+        self.assertLessEqual(time.sleep.call_args_list[1][0][0], 2)
+
+    def test_overloaded_endpoint_fails_over(self):
+        limiter = MagicMock(spec=ConcurrencyLimiter)
+        self._test_requester = Requester({"testKey": "testValue"}, "http://first,http://second", limiter=limiter)
+        overloaded_response = requests.Response()
+        overloaded_response.status_code = ResponseCodes['TIMEOUT']
+        overloaded_response._content = b''
+        self._response.status_code = ResponseCodes['SUCCESS']
+        requests.Session.send.side_effect = [overloaded_response, requests.exceptions.ConnectionError(),
+                                             self._response]
+
+        self.assertIs(self._test_requester.get_data("test/file/path"), self._response)
+
+        self.assertEqual([call[0][0].url for call in requests.Session.send.call_args_list],
+                         ["http://first/test/file/path", "http://second/test/file/path",
+                          "http://first/test/file/path"])
+        # The first failure is sent straight to the other endpoint; the second, with both failed, is backed off.
+        limiter.overloaded.assert_called_once_with()
+        self.assertEqual(time.sleep.call_count, 1)
+
+    def test_cached_authentication_scheme_is_used_first(self):
+        authentication_cache = AuthenticationCache()
+        authentication_cache.record("testURL", "Basic")
+        self._response.status_code = ResponseCodes['SUCCESS']
+
+        requester = Requester({"Authorization": "Bearer test_token"}, "http://testURL/", ["Basic test_basic"],
+                              authentication_cache=authentication_cache)
+        requester.get_data("test/file/path")
+
+        prepared_request = requests.Session.send.call_args[0][0]
+        self.assertEqual(prepared_request.headers["Authorization"], "Basic test_basic")
+
+    def test_negotiated_authentication_scheme_is_cached(self):
+        authentication_cache = AuthenticationCache()
+        rejected_response = requests.Response()
+        rejected_response.status_code = ResponseCodes['AUTHENTICATION_FAILED']
+        rejected_response.headers['WWW-Authenticate'] = "Basic realm=\"test\""
+        rejected_response._content = b''
+        self._response.status_code = ResponseCodes['SUCCESS']
+        requests.Session.send.side_effect = [rejected_response, self._response]
+
+        requester = Requester({"Authorization": "Bearer test_token"}, "http://testURL/", ["Basic test_basic"],
+                              authentication_cache=authentication_cache)
+
+        self.assertIs(requester.get_data("test/file/path"), self._response)
+        self.assertEqual(authentication_cache.get_scheme("testURL"), "Basic")
+
+    def test_request_metrics_are_recorded(self):
+        metrics = MetricsRecorder()
+        fetching_response = requests.Response()
+        fetching_response.status_code = ResponseCodes['FETCHING_DATA']
+        fetching_response._content = b''
+        rejected_response = requests.Response()
+        rejected_response.status_code = ResponseCodes['AUTHENTICATION_FAILED']
+        rejected_response.headers['WWW-Authenticate'] = "Basic realm=\"test\""
+        rejected_response._content = b''
+        self._response.status_code = ResponseCodes['SUCCESS']
+        self._response.elapsed = datetime.timedelta(seconds=0.25)
+        requests.Session.send.side_effect = [fetching_response, rejected_response, self._response]
+
+        requester = Requester({"Authorization": "Bearer test_token"}, "http://testURL/", ["Basic test_basic"],
+                              metrics=metrics)
+        with patch("irobotclient.response_handler.get_request_delay", return_value=30):
+            requester.get_data("test/file/path")
+
+        file_metrics = metrics._files["test/file/path"]
+        self.assertEqual((file_metrics.requests, file_metrics.retries, file_metrics.authentication_renegotiations,
+                          file_metrics.fetch_wait, file_metrics.time_to_first_byte), (3, 2, 1, 30, 0.25))
+
     # Exception Testing
+    def test_persistent_timeout_exception(self):
+        self._response.status_code = ResponseCodes['TIMEOUT']
+        self._response._content = b''
+
+        self.assertRaisesRegex(IrobotClientException, f"{errno.ECONNABORTED}",
+                               self._test_requester.get_data, "test/file/path")
+
+    def test_persistent_connection_error_exception(self):
+        requests.Session.send.side_effect = requests.exceptions.ConnectionError()
+
+        self.assertRaises(requests.exceptions.ConnectionError, self._test_requester.get_data, "test/file/path")
+
     def test_exceeded_request_retires_exception(self):
         self._response.status_code = ResponseCodes['FETCHING_DATA']
 
         self.assertRaisesRegex(IrobotClientException, f"{errno.ECONNABORTED}",
                                self._test_requester.get_data, "test/file/path")
 
+    def test_invalid_range_exception(self):
+        self._response.status_code = ResponseCodes['INVALID_RANGE']
+
+        self.assertRaisesRegex(IrobotClientException, str(ResponseCodes['INVALID_RANGE']),
+                               self._test_requester.get_data, "test/file/path", byte_range=(100, None))
+
     def test_error_responses(self):
         self._response.status_code = ResponseCodes['NOT_FOUND']
         self._response._content = bytearray(json.dumps({'description': 'Content not found'}), 'utf-8')
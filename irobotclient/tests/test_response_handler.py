@@ -40,6 +40,34 @@ class TestResponseHandler(unittest.TestCase):
         self.assertEqual(response_handler.get_request_delay(self._response),
                          int((future_time - datetime.now(tz=timezone.utc)).total_seconds()))
 
+    def test_get_eta_margin(self):
+        self._response.headers['iRobot-ETA'] = "2017-09-25T12:34:56Z+0000 +/- 123"
+        self.assertEqual(response_handler.get_request_eta_margin(self._response), 123)
+
+        self._response.headers['iRobot-ETA'] = "2017-09-25T12:34:56Z+0000"
+        self.assertEqual(response_handler.get_request_eta_margin(self._response), 0)
+
+    def test_get_chunk_checksums(self):
+        self._response.headers['Content-Type'] = "multipart/byteranges; boundary=test_boundary"
+        self._response._content = b"--test_boundary\r\n" \
+                                  b"Content-Type: application/vnd.irobot.checksum\r\n" \
+                                  b"Content-Range: bytes 1000-1499/1500\r\n\r\n" \
+                                  b"abc2\r\n" \
+                                  b"--test_boundary\r\n" \
+                                  b"Content-Type: application/vnd.irobot.checksum\r\n" \
+                                  b"Content-Range: bytes 0-999/1500\r\n\r\n" \
+                                  b"abc1\r\n" \
+                                  b"--test_boundary--\r\n"
+
+        self.assertEqual(response_handler.get_chunk_checksums(self._response),
+                         [(0, 999, "abc1"), (1000, 1499, "abc2")])
+
+    def test_get_chunk_checksums_of_whole_file(self):
+        self._response.headers['Content-Type'] = "application/vnd.irobot.checksum"
+        self._response._content = b"abc123"
+
+        self.assertEqual(response_handler.get_chunk_checksums(self._response), [])
+
     def test_update_authentication_header(self):
         arvados_test_string = f"{request_formatter.authentication_types['ARVADOS']} test_token"
         basic_test_string = f"{request_formatter.authentication_types['BASIC']} test_basic"
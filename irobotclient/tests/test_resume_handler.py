@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import patch
+
+import hashlib
+import os
+import tempfile
+
+from irobotclient.resume_handler import PartialDownload
+
+
+class TestPartialDownload(unittest.TestCase):
+    """
+    Assessing how the state of a partial download is recorded, reloaded and cleared.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._save_location = os.path.join(self._temp_directory.name, "test.cram")
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    @patch("irobotclient.resume_handler.STATE_COMMIT_INTERVAL", 10)
+    def test_committed_data_is_reloaded(self):
+        partial = PartialDownload(self._save_location)
+        partial.start("test_etag", 100)
+
+        with open(partial.location, "wb") as file:
+            file.write(b"0123456789abcde")
+            partial.advance(file, 15)
+
+        reloaded = PartialDownload(self._save_location)
+        self.assertTrue(reloaded.resumable)
+        self.assertEqual(reloaded.etag, "test_etag")
+        self.assertEqual(reloaded.committed, 15)
+        self.assertEqual(reloaded.rehash().hexdigest(), hashlib.md5(b"0123456789abcde").hexdigest())
+
+    def test_uncommitted_data_is_not_recorded(self):
+        partial = PartialDownload(self._save_location)
+        partial.start("test_etag", 100)
+
+        with open(partial.location, "wb") as file:
+            file.write(b"0123456789")
+            partial.advance(file, 10)
+
+        self.assertFalse(PartialDownload(self._save_location).resumable)
+
+    def test_completed_segments_are_reloaded(self):
+        partial = PartialDownload(self._save_location)
+        partial.start("test_etag", 100, segment_size=10)
+
+        file_descriptor = os.open(partial.location, os.O_WRONLY | os.O_CREAT)
+        partial.commit_segment(file_descriptor, 0)
+        partial.commit_segment(file_descriptor, 20)
+        os.close(file_descriptor)
+
+        reloaded = PartialDownload(self._save_location)
+        self.assertTrue(reloaded.resumable)
+        self.assertEqual(reloaded.segment_size, 10)
+        self.assertEqual(reloaded.completed_segments, {0, 20})
+
+    def test_finish_moves_file_and_removes_state(self):
+        partial = PartialDownload(self._save_location)
+        partial.start("test_etag", 10)
+
+        with open(partial.location, "wb") as file:
+            file.write(b"0123456789")
+            partial.commit(file)
+
+        partial.finish()
+
+        self.assertEqual(os.listdir(self._temp_directory.name), ["test.cram"])
+
+    # The following tests assess exception handling
+    def test_state_without_part_file_is_ignored(self):
+        partial = PartialDownload(self._save_location)
+        partial.start("test_etag", 100)
+        partial.committed = 50
+        partial._save()
+
+        self.assertFalse(PartialDownload(self._save_location).resumable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import MagicMock
+
+import hashlib
+import io
+import os
+import tempfile
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+
+from irobotclient import segment_handler
+from irobotclient.custom_exceptions import IrobotClientException
+from irobotclient.request_handler import Requester, ResponseCodes
+
+TEST_DATA = bytes(range(256)) * 40
+
+
+def _make_ranged_response(byte_range=None) -> requests.Response:
+    # Build a response for the whole of the test data, or a 206 response for a range of it.
+
+    response = requests.Response()
+    if byte_range:
+        first_byte, last_byte = byte_range
+        response.status_code = ResponseCodes['RANGED_DATA']
+        response.headers['Content-Range'] = f"bytes {first_byte}-{last_byte}/{len(TEST_DATA)}"
+        response.raw = io.BytesIO(TEST_DATA[first_byte:last_byte + 1])
+    else:
+        response.status_code = ResponseCodes['SUCCESS']
+        response.raw = io.BytesIO(TEST_DATA)
+    return response
+
+
+class TestSegmentHandler(unittest.TestCase):
+    """
+    Assessing segmented downloads: how files are split into byte ranges and how those ranges are written into place.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._save_location = os.path.join(self._temp_directory.name, "test.cram")
+        self._executor = ThreadPoolExecutor(max_workers=4)
+
+        self._requester = MagicMock(spec=Requester)
+        self._requester.get_data.side_effect = lambda file_path, **kwargs: _make_ranged_response(kwargs['byte_range'])
+
+    def tearDown(self):
+        self._executor.shutdown()
+        self._temp_directory.cleanup()
+
+    def test_plan_segments(self):
+        self.assertEqual(segment_handler.plan_segments(10, 4), [(0, 3), (4, 7), (8, 9)])
+        self.assertEqual(segment_handler.plan_segments(8, 4), [(0, 3), (4, 7)])
+
+    def test_download_segments(self):
+        checksum = segment_handler.download_segments(self._requester, "test.cram", _make_ranged_response(),
+                                                     self._save_location, len(TEST_DATA), self._executor,
+                                                     segments=3, segment_size=1000, chunk_size=128)
+
+        self.assertEqual(checksum, hashlib.md5(TEST_DATA).hexdigest())
+        with open(self._save_location, "rb") as file:
+            self.assertEqual(file.read(), TEST_DATA)
+
+        # The first range is read from the initial response, so only the rest are requested.
+        requested_ranges = sorted(call[1]['byte_range'] for call in self._requester.get_data.call_args_list)
+        self.assertEqual(requested_ranges, segment_handler.plan_segments(len(TEST_DATA), 1000)[1:])
+
+    def test_repair_ranges(self):
+        corrupt_data = bytearray(TEST_DATA)
+        corrupt_data[1500:1510] = bytes(10)
+        with open(self._save_location, "wb") as file:
+            file.write(corrupt_data[:-100])
+
+        chunk_checksums = [(first_byte, last_byte, hashlib.md5(TEST_DATA[first_byte:last_byte + 1]).hexdigest())
+                           for first_byte, last_byte in segment_handler.plan_segments(len(TEST_DATA), 1000)]
+
+        repaired_ranges = segment_handler.repair_ranges(self._requester, "test.cram", self._save_location,
+                                                        chunk_checksums, workers=2, chunk_size=128)
+
+        # Only the corrupt range and the truncated last range are downloaded again.
+        self.assertEqual(repaired_ranges, [(1000, 1999), (10000, 10239)])
+        with open(self._save_location, "rb") as file:
+            self.assertEqual(file.read(), TEST_DATA)
+
+    def test_range_ignored_by_server(self):
+        self._requester.get_data.side_effect = lambda file_path, **kwargs: _make_ranged_response()
+        checksum = segment_handler.download_segments(self._requester, "test.cram", _make_ranged_response(),
+                                                     self._save_location, len(TEST_DATA), self._executor,
+                                                     segments=2, segment_size=1000, chunk_size=128)
+
+        # The whole file is streamed from the initial response, after a single range request.
+        self.assertEqual(checksum, hashlib.md5(TEST_DATA).hexdigest())
+        self.assertEqual(self._requester.get_data.call_count, 1)
+        with open(self._save_location, "rb") as file:
+            self.assertEqual(file.read(), TEST_DATA)
+
+    def test_range_ignored_by_server_when_resuming(self):
+        self._requester.get_data.side_effect = lambda file_path, **kwargs: _make_ranged_response()
+        with open(self._save_location, "wb") as file:
+            file.write(TEST_DATA[:1000])
+
+        checksum = segment_handler.download_segments(self._requester, "test.cram", _make_ranged_response(),
+                                                     self._save_location, len(TEST_DATA), self._executor,
+                                                     segments=2, segment_size=1000, chunk_size=128,
+                                                     completed_segments={0})
+
+        self.assertEqual(checksum, hashlib.md5(TEST_DATA).hexdigest())
+
+    # The following tests assess exception handling
+    def test_wrong_range_exception(self):
+        self._requester.get_data.side_effect = lambda file_path, **kwargs: _make_ranged_response((0, 999))
+
+        self.assertRaisesRegex(IrobotClientException, str(ResponseCodes['INVALID_RANGE']),
+                               segment_handler.download_segments, self._requester, "test.cram",
+                               _make_ranged_response(), self._save_location, len(TEST_DATA), self._executor,
+                               segments=2, segment_size=1000, chunk_size=128)
+
+    def test_truncated_range_exception(self):
+        def get_data(file_path, byte_range):
+            response = _make_ranged_response(byte_range)
+            response.raw = io.BytesIO(TEST_DATA[byte_range[0]:byte_range[1] - 10])
+            return response
+
+        self._requester.get_data.side_effect = get_data
+
+        self.assertRaisesRegex(IrobotClientException, "incomplete",
+                               segment_handler.download_segments, self._requester, "test.cram",
+                               _make_ranged_response(), self._save_location, len(TEST_DATA), self._executor,
+                               segments=2, segment_size=1000, chunk_size=128)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest.mock import MagicMock
+
+import hashlib
+import io
+import os
+import tempfile
+
+import requests
+
+from irobotclient import stream_handler
+
+TEST_DATA = os.urandom(100000)
+
+
+def _make_response(data: bytes) -> requests.Response:
+    # Build a streamed response carrying the given data.
+
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(data)
+    return response
+
+
+class TestStreamHandler(unittest.TestCase):
+    """
+    Assessing how data is moved from a response to disk, both inline and through the read/hash/write pipeline.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._save_location = os.path.join(self._temp_directory.name, "test.cram")
+
+    def tearDown(self):
+        self._temp_directory.cleanup()
+
+    def test_read_chunks_fills_and_reuses_buffer(self):
+        chunks = [(bytes(chunk), chunk.obj) for chunk in stream_handler.read_chunks(_make_response(TEST_DATA), 40000)]
+
+        self.assertEqual([len(chunk) for chunk, _ in chunks], [40000, 40000, 20000])
+        self.assertEqual(b"".join(chunk for chunk, _ in chunks), TEST_DATA)
+        self.assertEqual(len({id(buffer) for _, buffer in chunks}), 1)
+
+    def test_pipelined_copy(self):
+        hasher = hashlib.md5()
+        written = []
+
+        with open(self._save_location, "wb", buffering=0) as file:
+            stream_handler.pipelined_copy(_make_response(TEST_DATA), file, hasher, 1000,
+                                          on_written=lambda file, length: written.append(length), depth=3)
+
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(TEST_DATA).hexdigest())
+        self.assertEqual(sum(written), len(TEST_DATA))
+        with open(self._save_location, "rb") as file:
+            self.assertEqual(file.read(), TEST_DATA)
+
+    # The following tests assess exception handling
+    def test_pipelined_copy_write_error(self):
+        file = MagicMock()
+        file.write.side_effect = OSError(28, "No space left on device")
+
+        self.assertRaisesRegex(OSError, "No space", stream_handler.pipelined_copy, _make_response(TEST_DATA), file,
+                               hashlib.md5(), 1000)
+
+    def test_pipelined_copy_read_error(self):
+        response = _make_response(TEST_DATA)
+        response.raw = MagicMock()
+        response.raw.readinto.side_effect = ConnectionError("Connection reset")
+
+        with open(self._save_location, "wb", buffering=0) as file:
+            self.assertRaises(ConnectionError, stream_handler.pipelined_copy, response, file, hashlib.md5(), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import json
+import os
+import tempfile
+import threading
+
+from irobotclient import trace_handler
+
+
+class TestTraceHandler(unittest.TestCase):
+    """
+    Assessing that spans are recorded in the Chrome trace event format only while tracing is on.
+    """
+    def setUp(self):
+        self._temp_directory = tempfile.TemporaryDirectory()
+        self._trace_location = os.path.join(self._temp_directory.name, "trace.json")
+
+    def tearDown(self):
+        trace_handler.stop()
+        self._temp_directory.cleanup()
+
+    def _read_spans(self) -> list:
+        with open(self._trace_location) as trace_file:
+            return [event for event in json.load(trace_file)["traceEvents"] if event["ph"] == "X"]
+
+    def test_spans_are_written(self):
+        trace_handler.start(self._trace_location)
+
+        with trace_handler.span("request", url="http://testURL/test.cram") as span:
+            span.set(status=200)
+        with self.assertRaises(ValueError), trace_handler.span("write"):
+            raise ValueError()
+        trace_handler.record("configuration", trace_handler.now())
+        trace_handler.stop()
+
+        request, write, configuration = self._read_spans()
+        self.assertEqual((request["name"], request["args"]), ("request", {"url": "http://testURL/test.cram",
+                                                                          "status": 200}))
+        self.assertEqual(write["args"], {"error": "ValueError"})
+        self.assertEqual(configuration["name"], "configuration")
+        self.assertGreaterEqual(request["dur"], 0)
+
+    def test_threads_are_named(self):
+        trace_handler.start(self._trace_location)
+
+        def hash_stage():
+            with trace_handler.span("hash"):
+                pass
+
+        thread = threading.Thread(target=hash_stage, name="hasher")
+        thread.start()
+        thread.join()
+        trace_handler.stop()
+
+        with open(self._trace_location) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+
+        self.assertIn({"name": "hasher"}, [event["args"] for event in events if event["ph"] == "M"])
+
+    def test_iterate_records_each_step(self):
+        trace_handler.start(self._trace_location)
+
+        self.assertEqual(list(trace_handler.iterate("read", [b"a", b"b"])), [b"a", b"b"])
+        trace_handler.stop()
+
+        self.assertEqual([span["name"] for span in self._read_spans()], ["read", "read", "read"])
+
+    def test_nothing_is_recorded_while_tracing_is_off(self):
+        items = [b"a"]
+
+        with trace_handler.span("request") as span:
+            span.set(status=200)
+
+        self.assertIs(trace_handler.iterate("read", items), items)
+        self.assertIs(trace_handler.span("request"), trace_handler.span("write"))
+        trace_handler.stop()
+        self.assertFalse(os.path.exists(self._trace_location))
+
+
+if __name__ == '__main__':
+    unittest.main()
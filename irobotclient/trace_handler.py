@@ -0,0 +1,192 @@
+"""
+Copyright (c) 2017 Genome Research Ltd.
+
+This program is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your
+option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+"""trace_handler.py - record the phases of a run as spans in the Chrome trace event format."""
+import json
+import os
+import threading
+import time
+
+# The category given to every span, which timeline viewers can filter on.
+TRACE_CATEGORY = "irobotclient"
+
+# The tracer spans are recorded by; None while tracing is off.
+_tracer = None
+
+
+def now() -> float:
+    """
+    Return the current time on the clock that spans are measured with, in seconds.
+    """
+
+    return time.perf_counter()
+
+
+class _Tracer:
+    # Collects the trace events of every thread.  Appending to a list is atomic, so no lock is needed for the events;
+    # the lock only guards the set of threads that have been named.
+
+    def __init__(self, trace_location: str):
+        self.trace_location = trace_location
+        self.events = []
+        self._pid = os.getpid()
+        self._named_threads = set()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float, args: dict):
+        # Record a complete ("X") event, naming the thread the first time it records one.
+
+        thread_id = threading.get_ident()
+
+        if thread_id not in self._named_threads:
+            with self._lock:
+                self._named_threads.add(thread_id)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": thread_id,
+                                    "args": {"name": threading.current_thread().name}})
+
+        self.events.append({"name": name, "cat": TRACE_CATEGORY, "ph": "X", "pid": self._pid, "tid": thread_id,
+                            "ts": start * 1e6, "dur": (end - start) * 1e6, "args": args})
+
+    def write(self):
+        # Write the events as a JSON object trace, which Perfetto and chrome://tracing open.
+
+        with open(self.trace_location, "w") as trace_file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, trace_file)
+
+
+class _Span:
+    # A span that is recorded when its context exits, along with the error that ended it, if any.
+
+    __slots__ = ("_tracer", "_name", "_args", "_start")
+
+    def __init__(self, tracer: _Tracer, name: str, args: dict):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+        self._start = None
+
+    def __enter__(self):
+        self._start = now()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self._args["error"] = exc_type.__name__
+        self._tracer.add(self._name, self._start, now(), self._args)
+
+    def set(self, **args):
+        # Add to the arguments shown with the span.
+
+        self._args.update(args)
+
+
+class _NoSpan:
+    # The span used while tracing is off, which does nothing.
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def set(self, **args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start(trace_location: str):
+    """
+    Start recording spans, to be written to a trace file when tracing is stopped.
+
+    :param trace_location: the path of the trace file.
+    """
+
+    global _tracer
+    _tracer = _Tracer(trace_location)
+
+
+def stop():
+    """
+    Stop recording spans and write those recorded to the trace file.
+    """
+
+    global _tracer
+    tracer, _tracer = _tracer, None
+
+    if tracer:
+        tracer.write()
+
+
+def span(name: str, **args):
+    """
+    A context manager that records the time spent in it as a span of the current thread.  While tracing is off it is
+    a shared object that does nothing, so spans can be left in hot paths.
+
+    :param name: the name of the span, eg: the phase of the download.
+    :param args: details shown with the span, eg: the file path; more can be added with the span's set method.
+    :return: the span.
+    """
+
+    tracer = _tracer
+
+    return _NO_SPAN if tracer is None else _Span(tracer, name, args)
+
+
+def record(name: str, start_time: float, **args):
+    """
+    Record a span that has already finished, such as one that began before tracing was started.
+
+    :param name: the name of the span.
+    :param start_time: when the span began, as returned by now().
+    :param args: details shown with the span.
+    """
+
+    tracer = _tracer
+
+    if tracer:
+        tracer.add(name, start_time, now(), args)
+
+
+def iterate(name: str, iterable):
+    """
+    Record the time spent producing each item of an iterable (eg: each read of a response) as a span.  While tracing
+    is off the iterable is returned as it is.
+
+    :param name: the name of the spans.
+    :param iterable: the iterable to be traced.
+    :return: an iterator over the same items.
+    """
+
+    if _tracer is None:
+        return iterable
+
+    return _iterate(name, iter(iterable))
+
+
+def _iterate(name: str, iterator):
+    # Time each step of the iterator, not counting the time the caller spends on each item.
+
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
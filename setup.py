@@ -18,9 +18,13 @@ setup(name="irobotclient",
       license="GNU General Public License",
       packages=find_packages(exclude=["test"]),
       install_requires=open("requirements.txt", "r").readlines(),
+      extras_require={
+          "async": ["aiohttp"]
+      },
       entry_points={
           "console_scripts": [
-              "irobotclient=irobotclient.entrypoint:main"
+              "irobotclient=irobotclient.entrypoint:main",
+              "irobotclient-daemon=irobotclient.daemon_handler:main"
           ]
       },
       zip_safe=True)